@@ -0,0 +1,96 @@
+import argparse
+import csv
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+try:
+    from scripts.columnar_export import (
+        BILLING_SUMMARY_COLUMN_TYPES, read_columnar, write_dataframe_columnar, write_eob_columnar
+    )
+    from scripts.extract_eob_data import EOB_COLUMNS
+except ImportError:
+    from columnar_export import BILLING_SUMMARY_COLUMN_TYPES, read_columnar, write_dataframe_columnar, write_eob_columnar
+    from extract_eob_data import EOB_COLUMNS
+
+def sample_billing_summary(rows, seed=0):
+    '''Synthetic rows shaped like billing_engine.read_billing_summary().'''
+    rng = np.random.default_rng(seed)
+    codes = [f"H{i // 10:02d}.{i % 10}" for i in range(50)]
+    icd = rng.choice(codes, rows)
+    charge = rng.integers(50, 900, rows).astype(float)
+    covered = np.round(charge * rng.uniform(0, 0.8, rows), 2)
+    return pd.DataFrame({
+        'Patient Name': [f"Patient {i:07d}" for i in range(rows)],
+        'Patient ID': [f"{i:010x}" for i in range(rows)],
+        'Disease': [f"DISEASE {c}" for c in icd],
+        'ICD Code': icd,
+        'Assigned Doctor': rng.choice([f"Doctor {i:04d}" for i in range(20)], rows),
+        'Doctor Charge': charge,
+        'Insurance Provider': rng.choice([f"Insurer {i:03d}" for i in range(8)], rows),
+        'Insurance Pays': covered,
+        'Patient Pays': charge - covered,
+    })
+
+def sample_eob_items(rows, seed=0):
+    '''Synthetic EOB line items as extract_eob_data yields them (amounts as "1,234.00" strings).'''
+    rng = np.random.default_rng(seed)
+    billed = rng.uniform(10, 5000, rows)
+    paid = billed * rng.uniform(0, 1, rows)
+    denial = rng.choice(['PR1', 'CO45', 'PR2', 'CO97', 'OA23'], rows)
+    cpt = rng.choice(['96372', '99214,25', '99213', '92014', '92250'], rows)
+    return [
+        {'Patient Name': f"Patient {i:07d}", 'Patient ID': f"{i:09d}", 'CPT Code': cpt[i], 'Units': '1',
+         'Service Date': '01/25/2022 to 01/25/2022', 'Amount Billed': f"{billed[i]:,.2f}",
+         'Amount Paid': f"{paid[i]:,.2f}", 'Patient Responsibility': f"{billed[i] - paid[i]:,.2f}",
+         'Denial Code': denial[i]}
+        for i in range(rows)
+    ]
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def _write_eob_csv(items, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=EOB_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(items)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare CSV with Parquet and Arrow output: write/read time and size.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'dataset':<16} {'rows':>8} {'format':<8} {'write (s)':>10} {'read (s)':>9} {'size (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            summary = sample_billing_summary(rows)
+            items = sample_eob_items(rows)
+            cases = {
+                'billing summary': {
+                    'csv': (lambda path: summary.to_csv(path, index=False), pd.read_csv),
+                    'parquet': (lambda path: write_dataframe_columnar(summary, path, BILLING_SUMMARY_COLUMN_TYPES),
+                                lambda path: read_columnar(path).to_pandas()),
+                    'arrow': (lambda path: write_dataframe_columnar(summary, path, BILLING_SUMMARY_COLUMN_TYPES),
+                              lambda path: read_columnar(path).to_pandas()),
+                },
+                'eob lines': {
+                    # Typed read: the amounts are parsed, as in the columnar formats
+                    'csv': (lambda path: _write_eob_csv(items, path), lambda path: pd.read_csv(path, thousands=',')),
+                    'parquet': (lambda path: write_eob_columnar(items, path), lambda path: read_columnar(path).to_pandas()),
+                    'arrow': (lambda path: write_eob_columnar(items, path), lambda path: read_columnar(path).to_pandas()),
+                },
+            }
+            for dataset, formats in cases.items():
+                for fmt, (write, read) in formats.items():
+                    path = os.path.join(tmp, f"{dataset.replace(' ', '_')}_{rows}.{fmt}")
+                    write_seconds = _timed(lambda: write(path))
+                    read_seconds = _timed(lambda: read(path))
+                    size = os.path.getsize(path) / 1e6
+                    print(f"{dataset:<16} {rows:>8} {fmt:<8} {write_seconds:>10.3f} {read_seconds:>9.3f} {size:>10.2f}")
+
+if __name__ == '__main__':
+    main()
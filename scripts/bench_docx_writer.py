@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import time
+import zipfile
+import numpy as np
+import pandas as pd
+from docx import Document
+try:
+    from scripts.data_loader import df_to_docx_table
+except ImportError:
+    from data_loader import df_to_docx_table
+
+def legacy_df_to_docx_table(df, output_file):
+    '''The previous row-by-row writer (table.add_row() per DataFrame row), kept as the baseline.'''
+    doc = Document()
+    doc.add_heading('Patient Disease Assignments', level=1)
+    table = doc.add_table(rows=1, cols=len(df.columns))
+    table.style = 'Table Grid'
+    hdr_cells = table.rows[0].cells
+    for i, col in enumerate(df.columns):
+        hdr_cells[i].text = str(col)
+    for _, row in df.iterrows():
+        row_cells = table.add_row().cells
+        for i, value in enumerate(row):
+            if isinstance(value, (int, float)):
+                row_cells[i].text = f"{value:.2f}"
+            else:
+                row_cells[i].text = str(value)
+    doc.save(output_file)
+
+def sample_assignments(rows, seed=0):
+    '''Synthetic patient assignments shaped like Patient_Disease_Assignments.docx.'''
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Patient ID': [f"P{i:06d}" for i in range(rows)],
+        'Patient Name': [f"Patient {i}" for i in range(rows)],
+        'Disease': rng.choice(['CONJUNCTIVITIS', 'C.L.A.RE', 'DRY EYE', 'CHALAZION', 'BLEPHARITIS'], rows),
+        'Assigned Doctor': rng.choice(['Kelvin', 'Alan', 'Kevin'], rows),
+        'Insurance Company': rng.choice(['Aetna', 'BlueCross', 'Medicare', 'UnitedHealthCare'], rows),
+        'Doctor Charge': rng.integers(100, 900, rows).astype(float),
+    })
+
+def _document_xml(path):
+    with zipfile.ZipFile(path) as zf:
+        return zf.read('word/document.xml')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark df_to_docx_table against the row-by-row writer.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--skip-legacy-above', type=int, default=5000, help='Do not time the legacy writer beyond this many rows')
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy (s)':>12} {'bulk (s)':>10} {'speedup':>8}  same XML")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            df = sample_assignments(rows)
+            bulk_path = os.path.join(tmp, f'bulk_{rows}.docx')
+            start = time.perf_counter()
+            df_to_docx_table(df, bulk_path)
+            bulk = time.perf_counter() - start
+            if rows > args.skip_legacy_above:
+                print(f"{rows:>8} {'-':>12} {bulk:>10.3f} {'-':>8}  -")
+                continue
+            legacy_path = os.path.join(tmp, f'legacy_{rows}.docx')
+            start = time.perf_counter()
+            legacy_df_to_docx_table(df, legacy_path)
+            legacy = time.perf_counter() - start
+            same = _document_xml(bulk_path) == _document_xml(legacy_path)
+            print(f"{rows:>8} {legacy:>12.3f} {bulk:>10.3f} {legacy / bulk:>7.1f}x  {same}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+import pandas as pd
+try:
+    from scripts import billing_engine, data_loader, db_utils, extract_diagnosis_table, extract_eob_data, rate_matrix
+    from scripts.db_models import DATA_DIR, BASE_DIR, temporary_engine
+    from scripts.generate_synthetic_data import generate_synthetic_data
+except ImportError:
+    import billing_engine
+    import data_loader
+    import db_utils
+    import extract_diagnosis_table
+    import extract_eob_data
+    import rate_matrix
+    from db_models import DATA_DIR, BASE_DIR, temporary_engine
+    from generate_synthetic_data import generate_synthetic_data
+
+DEFAULT_RESULTS_DIR = os.path.join(BASE_DIR, 'bench_results')
+
+def _time(func, repeat, setup=None):
+    '''Wall-clock seconds of `repeat` calls to func(setup(i)) (or func()), setup excluded.'''
+    runs = []
+    for i in range(repeat):
+        arg = setup(i) if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        runs.append(time.perf_counter() - start)
+    return {
+        'runs': runs, 'min': min(runs), 'median': statistics.median(runs),
+        'mean': statistics.fmean(runs), 'max': max(runs),
+    }
+
+# --- Benchmark cases ---
+def _db_read_cases():
+    return {
+        'db_utils.get_doctors': db_utils.get_doctors,
+        'db_utils.get_patients': db_utils.get_patients,
+        'db_utils.get_insurance_rates': db_utils.get_insurance_rates,
+        'db_utils.resolve_doctor_charges': db_utils.resolve_doctor_charges,
+    }
+
+def _db_write_cases(batch):
+    doctors = db_utils.get_doctors()
+    doctor = next(d for d in doctors if d['rates'])
+    rate = doctor['rates'][0]
+    provider = db_utils.get_insurance_rates()[0]['provider']
+
+    def new_patients(i, prefix):
+        return [
+            {'name': f"Bench {prefix} {i} {n}", 'email': f"bench{prefix}{i}.{n}@example.com", 'phone': f"{i}{n}",
+             'disease': rate['disease'], 'icd_code': rate['icd_code'], 'doctor_id': doctor['id'],
+             'insurance_provider': provider}
+            for n in range(batch)
+        ]
+
+    def add_patients(patients):
+        for p in patients:
+            db_utils.add_patient(p['name'], p['email'], p['phone'], p['disease'], p['icd_code'],
+                                 p['doctor_id'], p['insurance_provider'])
+
+    def set_rates(patient_ids):
+        for n, patient_id in enumerate(patient_ids):
+            db_utils.set_custom_rate(patient_id, doctor['id'], rate['icd_code'], 100.0 + n)
+
+    patient_ids = [p['id'] for p in db_utils.get_patients()[:batch]]
+    return {
+        f'db_utils.add_patient x{batch}': (add_patients, lambda i: new_patients(i, 'single')),
+        f'db_utils.upsert_patients_bulk x{batch}': (db_utils.upsert_patients_bulk, lambda i: new_patients(i, 'bulk')),
+        f'db_utils.set_custom_rate x{batch}': (set_rates, lambda i: patient_ids),
+        f'db_utils.set_custom_rates_bulk x{batch}': (db_utils.set_custom_rates_bulk, lambda i: [
+            {'patient_id': pid, 'doctor_id': doctor['id'], 'icd_code': rate['icd_code'], 'custom_rate': 200.0 + i}
+            for pid in patient_ids
+        ]),
+    }
+
+def _billing_cases():
+    return {
+        'billing_engine.compute_billing_summary': billing_engine.compute_billing_summary,
+        'billing_engine.rebuild_billing_summary': billing_engine.rebuild_billing_summary,
+        'billing_engine.read_billing_summary': billing_engine.read_billing_summary,
+        'billing_engine.query_billing_summary (page)': lambda: billing_engine.query_billing_summary(sort_by='Patient Pays'),
+        'billing_engine.billing_summary_totals': billing_engine.billing_summary_totals,
+    }
+
+def _rate_matrix_cases():
+    matrix = rate_matrix.load_rate_matrix()
+    patients = pd.DataFrame(db_utils.get_patients())
+    first = (patients.at[0, 'id'], patients.at[0, 'assigned_doctor_id'], patients.at[0, 'icd_code'])
+    return {
+        'rate_matrix.load_rate_matrix': rate_matrix.load_rate_matrix,
+        'rate_matrix.price_patients (all)': lambda: matrix.price_patients(patients),
+        'rate_matrix.doctor_charge x1000': lambda: [
+            matrix.doctor_charge(*first) for _ in range(1000)
+        ],
+    }
+
+def _prepare_billing_summary_inputs():
+    '''The billing summary reshaped into prepare_billing_summary's legacy inputs.'''
+    summary = billing_engine.read_billing_summary()
+    patient_df = summary.rename(columns={'Insurance Provider': 'Insurance Company'})
+    patient_df = patient_df[['Patient ID', 'Patient Name', 'Disease', 'Assigned Doctor', 'Insurance Company', 'Doctor Charge']]
+    patient_df = patient_df.assign(**{'Doctor Charge': patient_df['Doctor Charge'].map(str)})
+    insurance_rates = {}
+    for r in db_utils.get_insurance_rates():
+        insurance_rates.setdefault(r['provider'], {})[r['disease']] = r['rate']
+    return insurance_rates, patient_df
+
+def run_benchmarks(repeat=5, write_batch=100, diagnosis_pages=10, eob_pdf=None, diagnosis_pdf=None, skip_pdf=False):
+    results = {}
+    for name, func in {**_db_read_cases(), **_billing_cases(), **_rate_matrix_cases()}.items():
+        print(f"  {name}")
+        results[name] = _time(func, repeat)
+    for name, (func, setup) in _db_write_cases(write_batch).items():
+        print(f"  {name}")
+        results[name] = _time(func, repeat, setup)
+
+    insurance_rates, patient_df = _prepare_billing_summary_inputs()
+    print("  data_loader.prepare_billing_summary")
+    # Its per-patient warnings would otherwise dominate the timing
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results['data_loader.prepare_billing_summary'] = _time(
+            lambda: data_loader.prepare_billing_summary(None, insurance_rates, patient_df), repeat
+        )
+
+    if not skip_pdf:
+        eob_pdf = eob_pdf or os.path.join(DATA_DIR, 'uhc eob.pdf')
+        if os.path.exists(eob_pdf):
+            print("  extract_eob_data.extract_eob_data")
+            results['extract_eob_data.extract_eob_data'] = _time(lambda: extract_eob_data.extract_eob_data(eob_pdf), repeat)
+        diagnosis_pdf = diagnosis_pdf or os.path.join(DATA_DIR, 'diagnosistable.pdf')
+        if os.path.exists(diagnosis_pdf):
+            # Uncached page parsing only; a full cold run of the 942-page table takes minutes
+            pages = list(range(1, diagnosis_pages + 1))
+            name = f'extract_diagnosis_table pages 1-{diagnosis_pages} (uncached)'
+            print(f"  {name}")
+            results[name] = _time(lambda: extract_diagnosis_table._extract_pages(diagnosis_pdf, pages), repeat)
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(current, baseline_path):
+    '''Print the median of every benchmark next to the baseline file's.'''
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n{'benchmark':<55} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:<55} {'-':>10} {result['median']:>10.4f} {'-':>7}")
+            continue
+        print(f"{name:<55} {old['median']:>10.4f} {result['median']:>10.4f} {result['median'] / old['median']:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the billing paths on a synthetic database.')
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--icd-codes', type=int, default=50)
+    parser.add_argument('--insurers', type=int, default=8)
+    parser.add_argument('--custom-rate-fraction', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--write-batch', type=int, default=100, help='Rows per write benchmark call')
+    parser.add_argument('--diagnosis-pages', type=int, default=10)
+    parser.add_argument('--skip-pdf', action='store_true', help='Leave out the PDF extractors')
+    parser.add_argument('--output', help=f'Results JSON (default: {os.path.relpath(DEFAULT_RESULTS_DIR, BASE_DIR)}/<commit>.json)')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    params = {k: getattr(args, k) for k in ('patients', 'doctors', 'icd_codes', 'insurers',
+                                            'custom_rate_fraction', 'seed', 'repeat', 'write_batch', 'diagnosis_pages')}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Always a fresh database, never data/billing.db
+        with temporary_engine(os.path.join(tmp, 'bench.db')):
+            print(f"Generating {args.patients} synthetic patients...")
+            start = time.perf_counter()
+            generate_synthetic_data(args.patients, args.doctors, args.icd_codes, args.insurers,
+                                    args.custom_rate_fraction, args.seed)
+            generate_seconds = time.perf_counter() - start
+            print("Running benchmarks:")
+            results = run_benchmarks(args.repeat, args.write_batch, args.diagnosis_pages, skip_pdf=args.skip_pdf)
+
+    commit = _git_commit()
+    report = {
+        'meta': {
+            'commit': commit, 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'params': params,
+        },
+        'results': {'generate_synthetic_data': {'runs': [generate_seconds], 'min': generate_seconds,
+                                                'median': generate_seconds, 'mean': generate_seconds,
+                                                'max': generate_seconds}, **results},
+    }
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'benchmark':<55} {'median (s)':>10} {'min (s)':>10}")
+    for name, result in report['results'].items():
+        print(f"{name:<55} {result['median']:>10.4f} {result['min']:>10.4f}")
+    print(f"\nSaved results to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import argparse
+import csv
+import sys
+from functools import lru_cache
+import pandas as pd
+from sqlalchemy import and_, delete, func, literal_column, select, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+try:
+    from scripts import db_utils, instrumentation
+    from scripts.db_models import BillingSummary, Doctor, InsuranceRate, Patient
+except ImportError:
+    import db_utils
+    import instrumentation
+    from db_models import BillingSummary, Doctor, InsuranceRate, Patient
+
+SUMMARY_COLUMNS = [
+    'Patient Name', 'Patient ID', 'Disease', 'ICD Code', 'Assigned Doctor',
+    'Doctor Charge', 'Insurance Provider', 'Insurance Pays', 'Patient Pays'
+]
+
+# billing_summary table columns, in SUMMARY_COLUMNS order
+MATERIALIZED_COLUMNS = [
+    'patient_name', 'patient_id', 'disease', 'icd_code', 'doctor_name',
+    'doctor_charge', 'insurance_provider', 'insurance_pays', 'patient_pays'
+]
+
+# Tables a summary row is computed from, for db_utils.data_version()
+SOURCE_TABLES = ('patients', 'doctors', 'doctor_rates', 'patient_doctor_rates', 'insurance_rates')
+
+def billing_summary_query():
+    '''
+    One SELECT that joins patients, doctors, patient_doctor_rates, doctor_rates
+    and insurance_rates and yields one billing summary row per patient.
+
+    The doctor charge is resolved exactly as db_utils.resolve_doctor_charges
+    does it; a missing insurance rate counts as 0.0.
+    '''
+    doctor_charge = db_utils.doctor_charge_column()
+    insurance_pays = func.coalesce(InsuranceRate.rate, 0.0)
+    stmt = (
+        select(
+            Patient.name.label('Patient Name'),
+            Patient.id.label('Patient ID'),
+            Patient.disease.label('Disease'),
+            Patient.icd_code.label('ICD Code'),
+            func.coalesce(Doctor.name, 'Unknown').label('Assigned Doctor'),
+            doctor_charge.label('Doctor Charge'),
+            Patient.insurance_provider.label('Insurance Provider'),
+            insurance_pays.label('Insurance Pays'),
+            (doctor_charge - insurance_pays).label('Patient Pays'),
+        )
+        .select_from(Patient)
+        .outerjoin(Doctor, Doctor.id == Patient.assigned_doctor_id)
+    )
+    return db_utils.join_doctor_charge(stmt).outerjoin(InsuranceRate, and_(
+        InsuranceRate.insurance_provider == Patient.insurance_provider,
+        InsuranceRate.icd_code == Patient.icd_code,
+    ))
+
+def compute_billing_summary():
+    '''Recompute the billing summary for every patient as a DataFrame (numeric money columns).'''
+    with db_utils.session_scope() as session, instrumentation.stage('compute: query'):
+        rows = session.execute(billing_summary_query()).all()
+    with instrumentation.stage('compute: to DataFrame'):
+        return pd.DataFrame([tuple(r) for r in rows], columns=SUMMARY_COLUMNS)
+
+# --- Single-patient statements ---
+@lru_cache(maxsize=256)
+def _patient_statement_rows(patient_id, version):
+    stmt = billing_summary_query().where(Patient.id == patient_id)
+    with db_utils.session_scope() as session:
+        return tuple(tuple(r) for r in session.execute(stmt))
+
+def get_patient_statement(patient_id):
+    '''
+    Billing summary lines of one patient, computed through the patients
+    primary key without touching anyone else's rows. Repeat lookups come
+    from an LRU cache until the next database write.
+    '''
+    rows = _patient_statement_rows(patient_id, db_utils.data_version(*SOURCE_TABLES))
+    return pd.DataFrame(list(rows), columns=SUMMARY_COLUMNS)
+
+# --- Materialized billing_summary table ---
+def _needs_build(session):
+    # An empty table next to a non-empty patients table has never been built
+    # (e.g. a database created before billing_summary existed)
+    if session.scalar(select(BillingSummary.patient_id).limit(1)) is not None:
+        return False
+    return session.scalar(select(Patient.id).limit(1)) is not None
+
+def _upsert_summary_rows(session, criterion):
+    stmt = sqlite_insert(BillingSummary).from_select(
+        MATERIALIZED_COLUMNS, billing_summary_query().where(criterion)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['patient_id'],
+        set_={c: stmt.excluded[c] for c in MATERIALIZED_COLUMNS if c != 'patient_id'},
+    )
+    session.execute(stmt)
+
+def _rebuild(session):
+    with instrumentation.stage('materialize: full rebuild'):
+        session.execute(delete(BillingSummary))
+        _upsert_summary_rows(session, true())
+
+def summary_row(session, patient_id):
+    '''One stored summary row as a dict keyed by SUMMARY_COLUMNS, or None.'''
+    c = BillingSummary.__table__.c
+    row = session.execute(
+        select(*[c[name] for name in MATERIALIZED_COLUMNS]).where(c.patient_id == patient_id)
+    ).first()
+    return dict(zip(SUMMARY_COLUMNS, row)) if row is not None else None
+
+def _ensure_built(session):
+    if _needs_build(session):
+        _rebuild(session)
+
+def refresh_summary_rows(session, criterion):
+    '''
+    Recompute the stored summary rows of the patients matching criterion
+    (a WHERE clause over patients) inside the caller's transaction.
+    Existing rows are updated in place, so the table keeps patient order.
+    '''
+    if _needs_build(session):
+        _rebuild(session)
+    else:
+        with instrumentation.stage('materialize: refresh rows'):
+            _upsert_summary_rows(session, criterion)
+
+def rebuild_billing_summary():
+    '''Throw away the billing_summary table and recompute it. Returns the row count.'''
+    with db_utils.session_scope() as session:
+        _rebuild(session)
+        return session.scalar(select(func.count()).select_from(BillingSummary))
+
+def read_billing_summary():
+    '''Return the stored billing summary as a DataFrame, building the table on first use.'''
+    return query_billing_summary(limit=None)
+
+# --- Filtered, paged reads ---
+# Display column -> billing_summary column, for sorting
+SORT_COLUMNS = dict(zip(SUMMARY_COLUMNS, MATERIALIZED_COLUMNS))
+# Rows are updated in place, so rowid order is patient order; unique, so pages never overlap
+TABLE_ORDER = literal_column('billing_summary.rowid')
+
+def _summary_criteria(doctor=None, patient=None, insurance=None, patient_id=None):
+    '''
+    WHERE clauses for the dashboard filters; None means "All".
+    patient is a name prefix, matched as a range so the name index is used.
+    '''
+    c = BillingSummary.__table__.c
+    criteria = []
+    if doctor is not None:
+        criteria.append(c.doctor_name == doctor)
+    if insurance is not None:
+        criteria.append(c.insurance_provider == insurance)
+    if patient:
+        criteria.extend([c.patient_name >= patient, c.patient_name < patient + '\U0010ffff'])
+    if patient_id is not None:
+        criteria.append(c.patient_id == patient_id)
+    return criteria
+
+def _summary_select(doctor=None, patient=None, insurance=None, patient_id=None, sort_by=None, descending=False):
+    c = BillingSummary.__table__.c
+    stmt = select(*[c[name] for name in MATERIALIZED_COLUMNS]).where(
+        *_summary_criteria(doctor, patient, insurance, patient_id)
+    )
+    if sort_by is not None:
+        column = c[SORT_COLUMNS[sort_by]]
+        stmt = stmt.order_by(column.desc() if descending else column.asc(), c.patient_id)
+    else:
+        # LIMIT/OFFSET pages need a total order even when unsorted
+        stmt = stmt.order_by(TABLE_ORDER)
+    return stmt
+
+def query_billing_summary(doctor=None, patient=None, insurance=None, patient_id=None,
+                          sort_by=None, descending=False, limit=50, offset=0):
+    '''
+    One page of the stored billing summary, filtered and sorted in SQL.
+    sort_by is a display column name (see SORT_COLUMNS); limit=None returns every match.
+    '''
+    stmt = _summary_select(doctor, patient, insurance, patient_id, sort_by, descending)
+    if limit is not None:
+        stmt = stmt.limit(limit).offset(offset)
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        with instrumentation.stage('read: query'):
+            rows = session.execute(stmt).all()
+    with instrumentation.stage('read: to DataFrame'):
+        return pd.DataFrame([tuple(r) for r in rows], columns=SUMMARY_COLUMNS)
+
+def query_billing_summary_for_patients(patient_ids):
+    '''Stored billing summary rows of many patients at once, looked up on the primary key in chunks.'''
+    c = BillingSummary.__table__.c
+    patient_ids = list(patient_ids)
+    rows = []
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        for start in range(0, len(patient_ids), db_utils.MAX_IN_PARAMS):
+            chunk = patient_ids[start:start + db_utils.MAX_IN_PARAMS]
+            rows.extend(session.execute(
+                select(*[c[name] for name in MATERIALIZED_COLUMNS]).where(c.patient_id.in_(chunk))
+            ).all())
+    return pd.DataFrame([tuple(r) for r in rows], columns=SUMMARY_COLUMNS)
+
+# --- Streaming export ---
+EXPORT_CHUNK_SIZE = 10000
+
+def iter_billing_summary_chunks(doctor=None, patient=None, insurance=None, sort_by=None, descending=False,
+                                chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Yield the filtered billing summary as lists of up to chunk_size row tuples
+    (in SUMMARY_COLUMNS order), fetched from one open cursor, so only one
+    chunk is held in memory however large the table is.
+    '''
+    stmt = _summary_select(doctor, patient, insurance, sort_by=sort_by, descending=descending)
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        result = session.execute(stmt.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions():
+            yield [tuple(r) for r in chunk]
+
+def write_billing_summary_csv(file, doctor=None, patient=None, insurance=None, sort_by=None, descending=False,
+                              chunk_size=EXPORT_CHUNK_SIZE):
+    '''
+    Stream the filtered billing summary as CSV (the same text as
+    DataFrame.to_csv(index=False)) into an open text file. Returns the row count.
+    '''
+    writer = csv.writer(file, lineterminator='\n')
+    writer.writerow(SUMMARY_COLUMNS)
+    count = 0
+    for chunk in iter_billing_summary_chunks(doctor, patient, insurance, sort_by, descending, chunk_size):
+        writer.writerows(chunk)
+        count += len(chunk)
+    return count
+
+def billing_summary_totals(doctor=None, patient=None, insurance=None):
+    '''Row count and money totals of the filtered billing summary, aggregated in SQL.'''
+    c = BillingSummary.__table__.c
+    stmt = select(
+        func.count(),
+        func.coalesce(func.sum(c.doctor_charge), 0.0),
+        func.coalesce(func.sum(c.insurance_pays), 0.0),
+        func.coalesce(func.sum(c.patient_pays), 0.0),
+    ).where(*_summary_criteria(doctor, patient, insurance))
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        with instrumentation.stage('read: totals'):
+            rows, charges, covered, out_of_pocket = session.execute(stmt).one()
+    return {'rows': rows, 'Doctor Charge': charges, 'Insurance Pays': covered, 'Patient Pays': out_of_pocket}
+
+def billing_summary_filter_options():
+    '''Distinct doctors and insurance providers in the billing summary, read off their indexes.'''
+    c = BillingSummary.__table__.c
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        doctors = session.scalars(select(c.doctor_name).distinct().order_by(c.doctor_name)).all()
+        providers = session.scalars(select(c.insurance_provider).distinct().order_by(c.insurance_provider)).all()
+    return {'doctors': doctors, 'insurance_providers': providers}
+
+def insurance_providers_in_table_order():
+    '''Insurance providers in order of first appearance in read_billing_summary() (table order).'''
+    c = BillingSummary.__table__.c
+    stmt = (
+        select(c.insurance_provider)
+        .group_by(c.insurance_provider)
+        .order_by(func.min(TABLE_ORDER))
+    )
+    with db_utils.session_scope() as session:
+        _ensure_built(session)
+        return session.scalars(stmt).all()
+
+def check_billing_summary():
+    '''
+    Compare the stored table with a full recompute.
+    Returns {'missing': [...], 'extra': [...], 'mismatched': [...]} patient ids;
+    all three lists are empty when the table is consistent.
+    '''
+    columns = [BillingSummary.__table__.c[c] for c in MATERIALIZED_COLUMNS]
+    with db_utils.session_scope() as session:
+        stored = {r[1]: tuple(r) for r in session.execute(select(*columns))}
+        expected = {r[1]: tuple(r) for r in session.execute(billing_summary_query())}
+    return {
+        'missing': sorted(set(expected) - set(stored)),
+        'extra': sorted(set(stored) - set(expected)),
+        'mismatched': sorted(pid for pid in set(expected) & set(stored) if expected[pid] != stored[pid]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain and export the materialized billing_summary table.')
+    parser.add_argument('command', choices=['rebuild', 'check', 'export'])
+    parser.add_argument('output', nargs='?', default='-', help='export: CSV file to write (default: stdout)')
+    parser.add_argument('--doctor', help='export: only this doctor')
+    parser.add_argument('--patient', help='export: only patient names starting with this')
+    parser.add_argument('--insurance', help='export: only this insurance provider')
+    parser.add_argument('--sort-by', choices=SUMMARY_COLUMNS)
+    parser.add_argument('--descending', action='store_true')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='export: rows fetched per chunk')
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_args = (args.doctor, args.patient, args.insurance, args.sort_by, args.descending, args.chunk_size)
+        if args.output == '-':
+            write_billing_summary_csv(sys.stdout, *export_args)
+            return
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            count = write_billing_summary_csv(f, *export_args)
+        print(f"Exported {count} billing summary rows to {args.output}")
+        return
+    if args.command == 'rebuild':
+        count = rebuild_billing_summary()
+        print(f"Rebuilt billing_summary: {count} rows")
+        return
+    report = check_billing_summary()
+    if not any(report.values()):
+        print("billing_summary is consistent with the source tables.")
+        return
+    for problem, patient_ids in report.items():
+        if patient_ids:
+            print(f"{problem}: {len(patient_ids)} patient(s), e.g. {', '.join(patient_ids[:10])}")
+    raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import os
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency: pip install pyarrow
+    pa = ipc = pq = None
+
+# Output format by file extension. Parquet is compressed and dictionary
+# encoded; Arrow IPC (.arrow/.feather) is uncompressed, so a reader can
+# memory-map it and use the columns without decoding anything.
+PARQUET_EXTENSIONS = ('.parquet',)
+ARROW_EXTENSIONS = ('.arrow', '.feather')
+
+# Column name -> type: 'dict' (dictionary-encoded string), 'str', 'float' or 'int'
+EOB_COLUMN_TYPES = {
+    'Patient Name': 'str',
+    'Patient ID': 'str',
+    'CPT Code': 'dict',
+    'Units': 'int',
+    'Service Date': 'str',
+    'Amount Billed': 'float',
+    'Amount Paid': 'float',
+    'Patient Responsibility': 'float',
+    'Denial Code': 'dict',
+}
+BATCH_EOB_COLUMN_TYPES = {'Source File': 'dict', **EOB_COLUMN_TYPES}
+BILLING_SUMMARY_COLUMN_TYPES = {
+    'Patient Name': 'str',
+    'Patient ID': 'str',
+    'Disease': 'dict',
+    'ICD Code': 'dict',
+    'Assigned Doctor': 'dict',
+    'Doctor Charge': 'float',
+    'Insurance Provider': 'dict',
+    'Insurance Pays': 'float',
+    'Patient Pays': 'float',
+}
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('Parquet/Arrow output needs pyarrow: pip install pyarrow')
+
+def is_columnar_path(path):
+    return path.lower().endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS)
+
+def parse_amount(value):
+    '''"1,234.00" (as extracted from an EOB) -> 1234.0; empty -> None.'''
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value.replace(',', '').replace('$', '').strip()
+    return float(value) if value else None
+
+def _missing(value):
+    # None, or the NaN pandas uses for missing values
+    return value is None or (isinstance(value, float) and value != value)
+
+def _parse_int(value):
+    if value is None or isinstance(value, int):
+        return value
+    value = str(value).strip()
+    return int(value) if value else None
+
+def _arrow_type(kind):
+    return {
+        'dict': pa.dictionary(pa.int32(), pa.string()),
+        'str': pa.string(),
+        'float': pa.float64(),
+        'int': pa.int32(),
+    }[kind]
+
+def columnar_schema(column_types):
+    require_pyarrow()
+    return pa.schema([(name, _arrow_type(kind)) for name, kind in column_types.items()])
+
+class ColumnarWriter:
+    '''
+    Streaming writer of dict rows to a .parquet or .arrow file, batch_size rows
+    at a time, so memory stays bounded however many rows are written.
+
+    String values of 'float'/'int' columns are parsed (see parse_amount).
+    Dictionary columns share one growing dictionary across batches, which
+    Arrow IPC stores as dictionary deltas. The file is written under a
+    temporary name and renamed into place on close().
+    '''
+    def __init__(self, path, column_types, batch_size=10000):
+        require_pyarrow()
+        self.path = path
+        self.column_types = column_types
+        self.schema = columnar_schema(column_types)
+        self.batch_size = batch_size
+        self.count = 0
+        self._pending = []
+        self._dictionaries = {name: {} for name, kind in column_types.items() if kind == 'dict'}
+        self._tmp_path = path + '.tmp'
+        if path.lower().endswith(PARQUET_EXTENSIONS):
+            self._writer = pq.ParquetWriter(self._tmp_path, self.schema, compression='zstd')
+        elif path.lower().endswith(ARROW_EXTENSIONS):
+            self._sink = pa.OSFile(self._tmp_path, 'wb')
+            self._writer = ipc.new_file(self._sink, self.schema,
+                                        options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        else:
+            raise ValueError(f"Unsupported columnar file type: {path} (use .parquet or .arrow)")
+
+    def _array(self, name, values):
+        kind = self.column_types[name]
+        values = [None if _missing(v) else v for v in values]
+        if kind == 'dict':
+            interned = self._dictionaries[name]
+            indices = [None if v is None else interned.setdefault(v, len(interned)) for v in values]
+            return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(interned), pa.string()))
+        if kind == 'float':
+            values = [parse_amount(v) for v in values]
+        elif kind == 'int':
+            values = [_parse_int(v) for v in values]
+        return pa.array(values, _arrow_type(kind))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        rows = self._pending
+        self._pending = []
+        arrays = [self._array(name, [row.get(name) for row in rows]) for name in self.column_types]
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+
+    def write(self, row):
+        self._pending.append(row)
+        self.count += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def _frame_array(self, name, column):
+        kind = self.column_types[name]
+        if kind == 'dict':
+            # Only the distinct values of the chunk go through Python
+            interned = self._dictionaries[name]
+            codes, uniques = pd.factorize(column)
+            positions = np.array([interned.setdefault(v, len(interned)) for v in uniques] + [-1], dtype=np.int32)
+            indices = positions[codes]  # code -1 (missing) picks the trailing -1
+            return pa.DictionaryArray.from_arrays(pa.array(indices, mask=indices < 0),
+                                                  pa.array(list(interned), pa.string()))
+        if kind == 'float' and not pd.api.types.is_numeric_dtype(column):
+            column = column.map(parse_amount, na_action='ignore')
+        elif kind == 'int' and not pd.api.types.is_numeric_dtype(column):
+            column = column.map(_parse_int, na_action='ignore')
+        array = pa.Array.from_pandas(column, type=_arrow_type(kind))
+        # Arrow-backed pandas strings convert to a ChunkedArray
+        return array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+
+    def write_frame(self, df):
+        '''Write a DataFrame chunk column by column (much faster than write() per row).'''
+        self._flush()
+        for start in range(0, len(df), self.batch_size):
+            chunk = df.iloc[start:start + self.batch_size]
+            arrays = [self._frame_array(name, chunk[name]) for name in self.column_types]
+            self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+            self.count += len(chunk)
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        if hasattr(self, '_sink'):
+            self._sink.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        '''Stop writing and remove the partial file.'''
+        try:
+            self._writer.close()
+            if hasattr(self, '_sink'):
+                self._sink.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_columnar(rows, path, column_types, batch_size=10000):
+    '''Write an iterable of dict rows to path (.parquet or .arrow). Returns the row count.'''
+    with ColumnarWriter(path, column_types, batch_size) as writer:
+        writer.write_rows(rows)
+    return writer.count
+
+def write_eob_columnar(items, path, batch_size=10000):
+    '''EOB line items (from extract_eob_data.iter_eob_line_items) to a typed .parquet/.arrow file.'''
+    return write_columnar(items, path, EOB_COLUMN_TYPES, batch_size)
+
+def write_dataframe_columnar(df, path, column_types, batch_size=10000):
+    '''A DataFrame (numeric money columns) to a typed .parquet/.arrow file, batch_size rows at a time.'''
+    with ColumnarWriter(path, column_types, batch_size) as writer:
+        writer.write_frame(df)
+    return writer.count
+
+def read_columnar(path):
+    '''
+    Read a .parquet or .arrow file into a pyarrow Table through a memory map.
+    An .arrow file is not copied or decoded: the Table's buffers point into
+    the mapped file. Use .to_pandas() for a DataFrame.
+    '''
+    require_pyarrow()
+    if path.lower().endswith(ARROW_EXTENSIONS):
+        # The map stays open for as long as the Table's buffers reference it
+        return ipc.open_file(pa.memory_map(path)).read_all()
+    return pq.read_table(path, memory_map=True)
+
+def iter_columnar_batches(path, batch_size=10000):
+    '''Yield a .parquet or .arrow file as DataFrames of up to batch_size rows (memory-mapped reads).'''
+    require_pyarrow()
+    if path.lower().endswith(ARROW_EXTENSIONS):
+        reader = ipc.open_file(pa.memory_map(path))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for start in range(0, batch.num_rows, batch_size):
+                yield batch.slice(start, batch_size).to_pandas()
+        return
+    for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_size):
+        yield batch.to_pandas()
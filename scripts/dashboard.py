@@ -1,40 +1,132 @@
 import streamlit as st
 import pandas as pd
+import io
 import os
+import tempfile
 import plotly.express as px
+try:
+    from scripts import billing_engine, db_utils, instrumentation
+    from scripts.diagnosis_search import diagnosis_db_version, search_diagnosis
+except ImportError:
+    import billing_engine
+    import db_utils
+    import instrumentation
+    from diagnosis_search import diagnosis_db_version, search_diagnosis
 
-def main():
-    try:
-        from scripts import db_utils
-    except ImportError:
-        import db_utils
-    st.set_page_config(page_title="Hospital Billing Dashboard", layout="wide")
-    st.title("\U0001F3E5 Hospital Billing & Insurance Demo Dashboard")
-    st.markdown("""
-    This dashboard displays the billing summary for all patients, doctors, and insurance companies.\nYou can add new patients and visualize billing results (Doctor access only).
-    """)
+# Money columns stay numeric in every frame; they are formatted only when rendered
+CURRENCY_COLUMN_CONFIG = {
+    col: st.column_config.NumberColumn(format="dollar")
+    for col in ('Doctor Charge', 'Insurance Pays', 'Patient Pays')
+}
 
-    # --- Load all data from the database ---
-    doctors = db_utils.get_doctors() 
-    patients = db_utils.get_patients()
-    insurance_rates = db_utils.get_insurance_rates()
+# Most patients offered by the custom charge form's name lookup
+PATIENT_LOOKUP_LIMIT = 20
+PATIENT_COLUMNS = ['id', 'name', 'email', 'phone', 'disease', 'icd_code', 'assigned_doctor_id', 'insurance_provider']
 
+# --- Cached loaders ---
+# Each loader takes db_utils.data_version(<tables it reads>) as its cache key,
+# so reruns reuse the parsed data until one of those tables is written.
+@st.cache_data(show_spinner=False)
+def load_doctors(version):
+    doctors = db_utils.get_doctors()
     # Convert to DataFrames for compatibility
     doctor_df = pd.DataFrame([
         {**{'id': d['id'], 'name': d['name']}, **{f"{r['icd_code']}|{r['disease']}": r['default_rate'] for r in d['rates']}}
         for d in doctors
     ]) if doctors else pd.DataFrame()
-    patient_df = pd.DataFrame(patients) if patients else pd.DataFrame()
-    insurance_df = pd.DataFrame(insurance_rates) if insurance_rates else pd.DataFrame()
+    return doctors, doctor_df
+
+@st.cache_data(show_spinner=False)
+def load_patient_count(version, name):
+    return db_utils.count_patients(name)
+
+@st.cache_data(show_spinner=False)
+def load_patient_page(version, name, limit, offset):
+    patients = db_utils.query_patients(name, limit=limit, offset=offset)
+    return pd.DataFrame(patients, columns=PATIENT_COLUMNS)
+
+@st.cache_data(show_spinner=False)
+def load_insurance_rates(version):
+    insurance_rates = db_utils.get_insurance_rates()
+    return insurance_rates, pd.DataFrame(insurance_rates) if insurance_rates else pd.DataFrame()
+
+@st.cache_data(show_spinner=False)
+def load_filter_options(version):
+    return billing_engine.billing_summary_filter_options()
+
+@st.cache_data(show_spinner=False)
+def load_billing_totals(version, doctor, patient, insurance):
+    return billing_engine.billing_summary_totals(doctor, patient, insurance)
+
+@st.cache_data(show_spinner=False)
+def load_billing_page(version, doctor, patient, insurance, sort_by, descending, limit, offset):
+    return billing_engine.query_billing_summary(
+        doctor, patient, insurance, sort_by=sort_by, descending=descending, limit=limit, offset=offset
+    )
+
+@st.cache_data(show_spinner=False)
+def load_diagnosis_search(version, query, limit=20):
+    # version is diagnosis_db_version(): results are recomputed once
+    # extract_diagnosis_table.py rewrites (or first creates) the database
+    return search_diagnosis(query, limit)
+
+def billing_summary_csv_bytes(filters):
+    '''
+    The filtered billing summary as CSV bytes. The rows are streamed from the
+    database in chunks into a temporary file (no DataFrame or CSV string is
+    built), which is closed once its contents are read back.
+    '''
+    with tempfile.TemporaryFile() as f:
+        text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+        billing_engine.write_billing_summary_csv(text, *filters)
+        text.flush()
+        text.seek(0)
+        return text.buffer.read()
+
+def show_instrumentation():
+    '''Timings recorded during this rerun of this session (BILLING_INSTRUMENTATION=1).'''
+    report = instrumentation.snapshot()
+    with st.expander("Performance instrumentation"):
+        st.write(f"{report['query_count']} SQL statement(s), {report['query_total_ms']:.1f} ms in the database")
+        for key, title in [('stages', 'Billing summary stages'), ('functions', 'db_utils functions'), ('queries', 'SQL statements')]:
+            st.subheader(title)
+            if report[key]:
+                st.dataframe(pd.DataFrame(report[key]), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Nothing recorded (cached results are not re-timed).")
+
+def render_dashboard():
+    st.set_page_config(page_title="Hospital Billing Dashboard", layout="wide")
+    st.title("\U0001F3E5 Hospital Billing & Insurance Demo Dashboard")
+    st.markdown("""
+    This dashboard displays the billing summary for all patients, doctors, and insurance companies.\nYou can add new patients and visualize billing results (Doctor access only).
+    """)
+
+    # --- Load all data from the database (cached until the next write) ---
+    doctors, doctor_df = load_doctors(db_utils.data_version('doctors', 'doctor_rates'))
+    insurance_rates, insurance_df = load_insurance_rates(db_utils.data_version('insurance_rates'))
 
     # --- Sidebar: Add New Patient Form ---
     st.sidebar.header("Simulate New Patient")
+    disease_options = doctor_df.columns[2:].tolist() if not doctor_df.empty else []
+    disease_icd_pairs = [col.split('|') for col in disease_options]
+    diagnosis_query = st.sidebar.text_input("Search diagnosis codes (code or description)")
+    if diagnosis_query.strip():
+        diagnosis_results = load_diagnosis_search(diagnosis_db_version(), diagnosis_query.strip())
+        if diagnosis_results.empty:
+            st.sidebar.info("No matching diagnosis codes.")
+        else:
+            st.sidebar.dataframe(diagnosis_results[['Diagnosis Code', 'Diagnosis Name']], hide_index=True)
+            # Narrow the disease picker to the doctors' diseases among the matches
+            codes = set(diagnosis_results['Diagnosis Code'].str.upper())
+            names = set(diagnosis_results['Diagnosis Name'].str.lower())
+            matching_pairs = [pair for pair in disease_icd_pairs if pair[0].upper() in codes or pair[1].lower() in names]
+            if matching_pairs:
+                disease_icd_pairs = matching_pairs
     with st.sidebar.form("add_patient_form"):
         new_patient_name = st.text_input("Patient Name")
         new_patient_email = st.text_input("Patient Email")
         new_patient_phone = st.text_input("Patient Phone")
-        disease_options = doctor_df.columns[2:].tolist() if not doctor_df.empty else []
-        disease_icd_pairs = [col.split('|') for col in disease_options]
         disease_list = [pair[1] for pair in disease_icd_pairs] if disease_icd_pairs else []
         new_disease = st.selectbox("Disease", disease_list) if disease_list else ''
         icd_code = disease_icd_pairs[disease_list.index(new_disease)][0] if new_disease and disease_list else ''
@@ -57,78 +149,21 @@ def main():
             st.sidebar.success(f"Added patient: {new_patient_name}")
         except Exception as e:
             st.sidebar.error(f"Error adding patient: {e}")
-        # Reload patients
-        patients = db_utils.get_patients()
-        patient_df = pd.DataFrame(patients) if patients else pd.DataFrame()
-
-    # --- Prepare Billing Summary ---
-    # Build lookup dictionaries
-    doctor_lookup = {d['id']: d for d in doctors}
-    insurance_lookup = {(r['provider'], r['icd_code']): r['rate'] for r in insurance_rates}
-    summary_rows = []
-    for p in patients:
-        patient_id = p['id']
-        doctor_id = p['assigned_doctor_id']
-        icd_code = p['icd_code']
-        disease = p['disease']
-        insurance_provider = p['insurance_provider']
-        patient_name = p['name']
-        doctor_name = doctor_lookup[doctor_id]['name'] if doctor_id in doctor_lookup else 'Unknown'
-        # Check for custom rate
-        custom_rate = db_utils.get_custom_rate(patient_id, doctor_id, icd_code)
-        if custom_rate is not None:
-            doctor_charge = custom_rate
-        else:
-            doctor_rates = doctor_lookup[doctor_id]['rates'] if doctor_id in doctor_lookup else []
-            default_rate = next((r['default_rate'] for r in doctor_rates if r['icd_code'] == icd_code), None)
-            doctor_charge = default_rate if default_rate is not None else 0.0
-        insurance_rate = insurance_lookup.get((insurance_provider, icd_code), 0.0)
-        patient_owes = doctor_charge - insurance_rate
-        summary_rows.append({
-            'Patient Name': patient_name,
-            'Patient ID': patient_id,
-            'Disease': disease,
-            'ICD Code': icd_code,
-            'Assigned Doctor': doctor_name,
-            'Doctor Charge': doctor_charge,
-            'Insurance Provider': insurance_provider,
-            'Insurance Pays': insurance_rate,
-            'Patient Pays': patient_owes
-        })
-
-    # --- Prepare Billing Summary ---
-    billing_summary = pd.DataFrame(summary_rows)
-    # Defensive checks for missing columns
-    required_columns = ["Assigned Doctor", "Patient Name", "Insurance Provider"]
-    missing_columns = [col for col in required_columns if col not in billing_summary.columns]
 
-    if not billing_summary.empty and not missing_columns:
-        billing_summary["Assigned Doctor"] = billing_summary["Assigned Doctor"].fillna("").astype(str)
-        billing_summary["Patient Name"] = billing_summary["Patient Name"].fillna("").astype(str)
-        billing_summary["Insurance Provider"] = billing_summary["Insurance Provider"].fillna("").astype(str)
-        doctor_options = ["All"] + sorted(billing_summary["Assigned Doctor"].unique())
-        patient_options = ["All"] + sorted(billing_summary["Patient Name"].unique())
-        insurance_options = ["All"] + sorted(billing_summary["Insurance Provider"].unique())
-    else:
-        if billing_summary.empty:
-            st.warning("No billing summary data available.")
-        if missing_columns:
-            st.warning(f"Missing columns in billing summary: {', '.join(missing_columns)}. Some filters may be unavailable.")
-        doctor_options = ["All"]
-        patient_options = ["All"]
-        insurance_options = ["All"]
-
-    doctor_filter = st.sidebar.selectbox("Filter by Doctor", options=doctor_options)
-    patient_filter = st.sidebar.selectbox("Filter by Patient", options=patient_options)
-    insurance_filter = st.sidebar.selectbox("Filter by Insurance Provider", options=insurance_options)
-
-    filtered_summary = billing_summary.copy()
-    if doctor_filter != "All":
-        filtered_summary = filtered_summary[filtered_summary["Assigned Doctor"] == doctor_filter]
-    if patient_filter != "All":
-        filtered_summary = filtered_summary[filtered_summary["Patient Name"] == patient_filter]
-    if insurance_filter != "All":
-        filtered_summary = filtered_summary[filtered_summary["Insurance Provider"] == insurance_filter]
+    # --- Billing Summary filters (evaluated in SQL, one page at a time) ---
+    summary_version = db_utils.data_version('billing_summary')
+    filter_options = load_filter_options(summary_version)
+    doctor_filter = st.sidebar.selectbox("Filter by Doctor", options=["All"] + filter_options['doctors'])
+    patient_filter = st.sidebar.text_input("Filter by Patient Name (starts with)")
+    insurance_filter = st.sidebar.selectbox("Filter by Insurance Provider", options=["All"] + filter_options['insurance_providers'])
+    filters = (
+        None if doctor_filter == "All" else doctor_filter,
+        patient_filter.strip() or None,
+        None if insurance_filter == "All" else insurance_filter,
+    )
+    totals = load_billing_totals(summary_version, *filters)
+    if totals['rows'] == 0 and not any(filters):
+        st.warning("No billing summary data available.")
 
     # --- Main Tables ---
     # Only show the personalized billing summary for the logged-in patient or by entered patient ID
@@ -136,13 +171,30 @@ def main():
     if not patient_id:
         patient_id = st.text_input("Enter your Patient ID to view your billing summary")
     if patient_id:
-        patient_info = billing_summary[billing_summary['Patient ID'] == patient_id]
+        patient_info = billing_engine.get_patient_statement(patient_id.strip())
         st.subheader("Your Billing Summary Table")
         if not patient_info.empty:
-            st.dataframe(patient_info, use_container_width=True)
+            st.dataframe(patient_info, use_container_width=True, column_config=CURRENCY_COLUMN_CONFIG)
         else:
             st.info("No billing information found for your ID.")
 
+    st.subheader("Billing Summary")
+    sort_col, order_col, size_col, page_col = st.columns(4)
+    with sort_col:
+        sort_by = st.selectbox("Sort by", ["Default"] + billing_engine.SUMMARY_COLUMNS)
+    with order_col:
+        descending = st.checkbox("Descending")
+    with size_col:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+    page_count = max(1, -(-totals['rows'] // page_size))
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+    filtered_summary = load_billing_page(
+        summary_version, *filters, None if sort_by == "Default" else sort_by, descending, page_size, (page - 1) * page_size
+    )
+    st.dataframe(filtered_summary, use_container_width=True, column_config=CURRENCY_COLUMN_CONFIG)
+    st.caption(f"Page {page} of {page_count} ({totals['rows']:,} matching rows)")
+
     st.subheader("Doctor Charges Table")
     st.dataframe(doctor_df, use_container_width=True)
 
@@ -150,15 +202,12 @@ def main():
     st.markdown("---")
     st.subheader("Summary Statistics")
     
-    if not filtered_summary.empty:
-        # Convert currency strings back to numbers before summing
-        def convert_currency(s):
-            return float(s.replace('$', '').replace(',', '')) if isinstance(s, str) else s
-        
-        total_charges = filtered_summary["Doctor Charge"].apply(convert_currency).sum()
-        total_covered = filtered_summary["Insurance Pays"].apply(convert_currency).sum()
-        total_out_of_pocket = filtered_summary["Patient Pays"].apply(convert_currency).sum()
-        
+    if totals['rows']:
+        # Totals over every matching row, aggregated in SQL
+        total_charges = totals["Doctor Charge"]
+        total_covered = totals["Insurance Pays"]
+        total_out_of_pocket = totals["Patient Pays"]
+
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("Total Charges", f"${total_charges:,.2f}")
@@ -171,14 +220,14 @@ def main():
 
     # --- Pie chart: Distribution of Doctor Charges (Everyone) ---
     st.subheader("Doctor Charges Distribution (Pie Chart)")
-    fig2 = px.pie(filtered_summary, names="Patient Name", values="Doctor Charge", title="Doctor Charges per Patient")
+    fig2 = px.pie(filtered_summary, names="Patient Name", values="Doctor Charge", title="Doctor Charges per Patient (current page)")
     st.plotly_chart(fig2, use_container_width=True)
 
     # --- Download CSV (Everyone) ---
     st.markdown("---")
     st.subheader("Download Billing Summary")
-    csv = filtered_summary.to_csv(index=False).encode('utf-8')
-    st.download_button("Download as CSV", csv, "billing_summary.csv", "text/csv")
+    # Generated only when the button is clicked, not on every rerun
+    st.download_button("Download as CSV", lambda: billing_summary_csv_bytes(filters), "billing_summary.csv", "text/csv")
 
     # Show insurance rates and patient lookup to all users (no authentication implemented)
     st.header("Insurance Company Rates")
@@ -199,14 +248,25 @@ def main():
             st.dataframe(rates_df)
 
     st.header("All Patients in Database")
+    # One page at a time, filtered and paged in SQL like the billing summary
+    patients_version = db_utils.data_version('patients')
+    filter_col, size_col, page_col = st.columns(3)
+    with filter_col:
+        patient_name_filter = st.text_input("Filter patients by name (starts with)").strip() or None
+    patient_count = load_patient_count(patients_version, patient_name_filter)
+    with size_col:
+        patient_page_size = st.selectbox("Patients per page", [25, 50, 100, 250], index=1)
+    patient_page_count = max(1, -(-patient_count // patient_page_size))
+    with page_col:
+        patient_page = st.number_input("Patients page", min_value=1, max_value=patient_page_count, value=1, step=1)
+    patient_df = load_patient_page(
+        patients_version, patient_name_filter, patient_page_size, (patient_page - 1) * patient_page_size
+    )
     if not patient_df.empty:
         # Add assigned doctor name to the DataFrame for display
         doctor_id_to_name = {d['id']: d['name'] for d in doctors}
         patient_df['Assigned Doctor'] = patient_df['assigned_doctor_id'].map(doctor_id_to_name)
-        display_cols = [
-            col for col in ["id", "name", "disease", "icd_code", "Assigned Doctor", "insurance_provider", "email", "phone"]
-            if col in patient_df.columns
-        ]
+        display_cols = ["id", "name", "disease", "icd_code", "Assigned Doctor", "insurance_provider", "email", "phone"]
         col_rename = {
             "id": "Patient ID",
             "name": "Patient Name",
@@ -218,68 +278,53 @@ def main():
             "phone": "Phone"
         }
         st.dataframe(patient_df[display_cols].rename(columns=col_rename), use_container_width=True)
+        st.caption(f"Page {patient_page} of {patient_page_count} ({patient_count:,} matching patients)")
+    elif patient_name_filter:
+        st.info("No matching patients.")
     else:
         st.info("No patients found in the database.")
 
     # --- Doctor Custom Charge Input ---
     st.header("Doctor: Set Custom Charge for Patient's Disease")
-    if not patient_df.empty and not doctor_df.empty:
-        with st.form("set_custom_charge_form"):
-            patient_choices = patient_df[["id", "name", "disease", "icd_code", "assigned_doctor_id"]].copy()
-            patient_choices["desc"] = patient_choices.apply(lambda row: f"{row['name']} (ID: {row['id']}, Disease: {row['disease']}, ICD: {row['icd_code']})", axis=1)
-            selected_patient = st.selectbox("Select Patient", patient_choices["desc"].tolist())
-            # Extract patient info
-            selected_row = patient_choices[patient_choices["desc"] == selected_patient].iloc[0]
-            patient_id = selected_row["id"]
-            doctor_id = selected_row["assigned_doctor_id"]
-            icd_code = selected_row["icd_code"]
-            disease = selected_row["disease"]
-            custom_amount = st.number_input(f"Enter Custom Charge for {disease} (ICD: {icd_code})", min_value=0.0, step=1.0)
-            submit_custom = st.form_submit_button("Set Custom Charge")
-        if submit_custom:
-            try:
-                db_utils.set_custom_rate(patient_id, doctor_id, icd_code, custom_amount)
-                st.success(f"Custom charge of ${custom_amount:,.2f} set for patient {selected_row['name']} (Disease: {disease})")
-                # Reload patients and billing summary to reflect the change
-                patients = db_utils.get_patients()
-                patient_df = pd.DataFrame(patients) if patients else pd.DataFrame()
-                # Also reload summary rows
-                doctors = db_utils.get_doctors()
-                insurance_rates = db_utils.get_insurance_rates()
-                doctor_lookup = {d['id']: d for d in doctors}
-                insurance_lookup = {(r['provider'], r['icd_code']): r['rate'] for r in insurance_rates}
-                summary_rows = []
-                for p in patients:
-                    pid = p['id']
-                    did = p['assigned_doctor_id']
-                    icd = p['icd_code']
-                    dis = p['disease']
-                    ins = p['insurance_provider']
-                    pname = p['name']
-                    dname = doctor_lookup[did]['name'] if did in doctor_lookup else 'Unknown'
-                    custom_rate = db_utils.get_custom_rate(pid, did, icd)
-                    if custom_rate is not None:
-                        doctor_charge = custom_rate
-                    else:
-                        doctor_rates = doctor_lookup[did]['rates'] if did in doctor_lookup else []
-                        default_rate = next((r['default_rate'] for r in doctor_rates if r['icd_code'] == icd), None)
-                        doctor_charge = default_rate if default_rate is not None else 0.0
-                    insurance_rate = insurance_lookup.get((ins, icd), 0.0)
-                    patient_owes = doctor_charge - insurance_rate
-                    summary_rows.append({
-                        'Patient Name': pname,
-                        'Patient ID': pid,
-                        'Disease': dis,
-                        'ICD Code': icd,
-                        'Assigned Doctor': dname,
-                        'Doctor Charge': doctor_charge,
-                        'Insurance Provider': ins,
-                        'Insurance Pays': insurance_rate,
-                        'Patient Pays': patient_owes
-                    })
-                billing_summary = pd.DataFrame(summary_rows)
-            except Exception as e:
-                st.error(f"Error setting custom charge: {e}")
+    # Look the patient up by ID or name prefix instead of listing every patient
+    patient_lookup = st.text_input("Find patient by Patient ID or name (starts with)").strip()
+    if patient_lookup and not doctor_df.empty:
+        patient = db_utils.get_patient(patient_lookup)
+        matches = [patient] if patient else db_utils.query_patients(patient_lookup, limit=PATIENT_LOOKUP_LIMIT)
+        if not matches:
+            st.info("No matching patients.")
+        else:
+            with st.form("set_custom_charge_form"):
+                selected_row = st.selectbox(
+                    "Select Patient", matches,
+                    format_func=lambda row: f"{row['name']} (ID: {row['id']}, Disease: {row['disease']}, ICD: {row['icd_code']})",
+                )
+                patient_id = selected_row["id"]
+                doctor_id = selected_row["assigned_doctor_id"]
+                icd_code = selected_row["icd_code"]
+                disease = selected_row["disease"]
+                custom_amount = st.number_input(f"Enter Custom Charge for {disease} (ICD: {icd_code})", min_value=0.0, step=1.0)
+                submit_custom = st.form_submit_button("Set Custom Charge")
+            if len(matches) == PATIENT_LOOKUP_LIMIT:
+                st.caption(f"Showing the first {PATIENT_LOOKUP_LIMIT} matches; type more of the name to narrow them down.")
+            if submit_custom:
+                try:
+                    # Only this patient's summary row is recomputed; it comes back directly
+                    updated_row = db_utils.set_custom_rate(patient_id, doctor_id, icd_code, custom_amount)
+                    st.success(f"Custom charge of ${custom_amount:,.2f} set for patient {selected_row['name']} (Disease: {disease})")
+                    if updated_row is not None:
+                        st.dataframe(pd.DataFrame([updated_row]), use_container_width=True)
+                except Exception as e:
+                    st.error(f"Error setting custom charge: {e}")
+
+    if instrumentation.is_enabled():
+        show_instrumentation()
+
+def main():
+    # Each rerun is timed on its own; Streamlit runs every session's reruns
+    # in threads of one process, so the timings must not be process-wide
+    with instrumentation.recording():
+        render_dashboard()
 
 if __name__ == "__main__":
     main()
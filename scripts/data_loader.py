@@ -1,13 +1,98 @@
 import os
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 import pandas as pd
 from docx import Document
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from xml.sax.saxutils import escape as xml_escape
 
 from io import BytesIO
-import pandas as pd
-from docx import Document
-import os
 import numpy as np
 
+# --- Streaming DOCX table reader ---
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _main_document_part(zf):
+    rels = ET.fromstring(zf.read('_rels/.rels'))
+    for rel in rels:
+        if rel.get('Type', '').endswith('/officeDocument'):
+            return rel.get('Target').lstrip('/')
+    return 'word/document.xml'
+
+def _cell_text(tc):
+    # Same text as python-docx's cell.text: the cell's own paragraphs joined by
+    # newlines, nested tables excluded
+    paragraphs = []
+    for p in tc.findall(W_NS + 'p'):
+        parts = []
+        for run in p.iter(W_NS + 'r'):
+            for child in run:
+                if child.tag == W_NS + 't':
+                    parts.append(child.text or '')
+                elif child.tag == W_NS + 'tab':
+                    parts.append('\t')
+                elif child.tag in (W_NS + 'br', W_NS + 'cr'):
+                    parts.append('\n')
+        paragraphs.append(''.join(parts))
+    return '\n'.join(paragraphs)
+
+def iter_docx_table_rows(docx_file):
+    '''
+    Yield the rows of the first table in a .docx (path or file object) as
+    lists of cell texts, parsed straight out of the document XML.
+
+    Rows are read one at a time and discarded after use. Like python-docx's
+    row.cells, a horizontally merged cell is repeated for every grid column
+    it spans and a vertically merged cell repeats the text above it.
+    '''
+    with zipfile.ZipFile(docx_file) as zf, zf.open(_main_document_part(zf)) as xml:
+        stack = []
+        table = None
+        above = []
+        for event, el in ET.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                if table is None and el.tag == W_NS + 'tbl' and stack and stack[-1] == W_NS + 'body':
+                    table = el
+                stack.append(el.tag)
+                continue
+            stack.pop()
+            if el is table:
+                return
+            if table is None or el.tag != W_NS + 'tr' or stack[-1] != W_NS + 'tbl' or stack.count(W_NS + 'tbl') != 1:
+                continue
+            row = []
+            for tc in el.findall(W_NS + 'tc'):
+                span, merge = 1, None
+                tc_pr = tc.find(W_NS + 'tcPr')
+                if tc_pr is not None:
+                    grid_span = tc_pr.find(W_NS + 'gridSpan')
+                    if grid_span is not None:
+                        span = int(grid_span.get(W_NS + 'val'))
+                    v_merge = tc_pr.find(W_NS + 'vMerge')
+                    if v_merge is not None:
+                        merge = v_merge.get(W_NS + 'val', 'continue')
+                column = len(row)
+                text = above[column] if merge == 'continue' and column < len(above) else _cell_text(tc)
+                row.extend([text] * span)
+            above = row
+            table.remove(el)
+            yield row
+
+def _table_rows_to_df(rows):
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("no table found")
+    return pd.DataFrame([[cell.strip() for cell in row] for row in rows], columns=[cell.strip() for cell in header])
+
+@lru_cache(maxsize=64)
+def _cached_docx_table(path, mtime_ns, size):
+    # mtime_ns and size are only part of the key: a rewritten file misses the cache
+    return _table_rows_to_df(iter_docx_table_rows(path))
+
 def docx_table_to_df(docx_file=None):
     # Default to the correct path if not provided
     if docx_file is None:
@@ -15,13 +100,10 @@ def docx_table_to_df(docx_file=None):
         docx_file = os.path.abspath(os.path.join(script_dir, '..', 'data', 'insurance_rates', 'Medicaid_Insurance_Rates.docx'))
     try:
         if isinstance(docx_file, str):
-            doc = Document(docx_file)
-        else:
-            doc = Document(docx_file)
-        table = doc.tables[0]
-        data = [[cell.text.strip() for cell in row.cells] for row in table.rows]
-        df = pd.DataFrame(data[1:], columns=data[0])
-        return df
+            path = os.path.abspath(docx_file)
+            stat = os.stat(path)
+            return _cached_docx_table(path, stat.st_mtime_ns, stat.st_size).copy()
+        return _table_rows_to_df(iter_docx_table_rows(docx_file))
     except Exception as e:
         print(f"Error loading DOCX file '{docx_file}': {e}")
         return pd.DataFrame()  # Return empty DataFrame on error
@@ -29,8 +111,93 @@ def docx_table_to_df(docx_file=None):
 def csv_to_df(csv_file):
     return pd.read_csv(csv_file)
 
-def load_default_data():
-    """Load default files from data/ directory."""
+# Cleaned file name -> standard insurance company name
+INSURANCE_NAME_MAPPING = {
+    'aetna': 'Aetna',
+    'bluecross': 'BlueCross',
+    'medicare': 'Medicare',
+    'unitedhealthcare': 'UnitedHealthCare',
+    'medicaid': 'Medicaid'
+}
+
+def _insurance_name(insurance_file):
+    """Standard insurance company name for a rate file name, or None if unrecognized."""
+    # Clean up the insurance name:
+    # 1. Convert to lowercase
+    # 2. Remove '_rates' or '_insurance_rates'
+    # 3. Replace spaces with underscores
+    insurance_name = os.path.splitext(insurance_file)[0].lower()
+    if insurance_name.endswith('_rates'):
+        insurance_name = insurance_name[:-6]
+    elif insurance_name.endswith('_insurance_rates'):
+        insurance_name = insurance_name[:-15]
+    insurance_name = insurance_name.replace(' ', '_')
+    return INSURANCE_NAME_MAPPING.get(insurance_name), insurance_name
+
+def _load_insurance_file(insurance_path, debug=False):
+    """
+    Worker: read one insurer's rate table into {disease: rate}.
+    Returns (rates or None, messages); messages are printed by the caller in
+    file order so output from concurrent loads does not interleave.
+    """
+    insurance_file = os.path.basename(insurance_path)
+    messages = []
+    try:
+        if debug:
+            messages.append(f"\nLoading insurance file: {insurance_path}")
+        insurance_df = docx_table_to_df(insurance_path)
+        if debug:
+            messages.append(f"Columns in {insurance_file}: {insurance_df.columns.tolist()}")
+
+        # Check if required columns exist
+        required_columns = ['Disease Name', 'Insurance Rate']
+        missing_columns = [col for col in required_columns if col not in insurance_df.columns]
+        if missing_columns:
+            messages.append(f"Warning: Missing columns in {insurance_file}: {missing_columns}")
+            return None, messages
+
+        # Column-wise instead of iterrows; a non-numeric rate fails the whole file as before
+        rates = dict(zip(insurance_df['Disease Name'], insurance_df['Insurance Rate'].astype(float).tolist()))
+    except Exception as e:
+        messages.append(f"Error processing {insurance_file}: {str(e)}")
+        return None, messages
+    return rates, messages
+
+# Parsed insurance files of this process: path -> ((mtime_ns, size, debug), (rates, messages))
+_insurance_file_results = {}
+# Parsing takes ~3.5 ms per KB of .docx and a worker pool ~35 ms to start, so
+# below this much to parse (the bundled files are ~13 KB each) it runs inline
+PARALLEL_MIN_BYTES = 256 * 1024
+
+def _load_insurance_files(paths, max_workers, debug=False):
+    '''
+    (rates, messages) of every path, in order. Files unchanged since an
+    earlier call are not read again; the others are parsed in a process pool
+    when there is enough to parse and more than one CPU.
+    '''
+    keys = {}
+    for path in paths:
+        stat = os.stat(path)
+        keys[path] = (stat.st_mtime_ns, stat.st_size, debug)
+    stale = [path for path in paths if _insurance_file_results.get(path, (None,))[0] != keys[path]]
+    # Unzipping, iterparse and building the DataFrame are CPU-bound and hold
+    # the GIL, so threads would take turns; processes parse files in parallel
+    workers = min(max_workers, len(stale), os.cpu_count() or 1)
+    if workers > 1 and sum(keys[p][1] for p in stale) >= PARALLEL_MIN_BYTES:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_load_insurance_file, stale, repeat(debug)))
+    else:
+        results = [_load_insurance_file(path, debug) for path in stale]
+    for path, result in zip(stale, results):
+        _insurance_file_results[path] = (keys[path], result)
+    return [_insurance_file_results[path][1] for path in paths]
+
+def load_default_data(debug=False, max_workers=8):
+    """
+    Load default files from data/ directory.
+    Insurance rate files are parsed in parallel processes; debug=True also
+    prints the file paths, columns and every loaded rate.
+    """
     # Get absolute path to script directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
     data_dir = os.path.join(script_dir, '..', 'data')
@@ -61,171 +228,148 @@ def load_default_data():
     
     print(f"Found insurance files: {insurance_files}")
     
-    insurance_rates = {}
-    
+    to_load = []
     for insurance_file in insurance_files:
-        try:
-            # Get the insurance name from the filename (without extension)
-            insurance_name = os.path.splitext(insurance_file)[0]
-            
-            # Clean up the insurance name:
-            # 1. Convert to lowercase
-            # 2. Remove '_rates' or '_insurance_rates'
-            # 3. Replace spaces with underscores
-            insurance_name = insurance_name.lower()
-            if insurance_name.endswith('_rates'):
-                insurance_name = insurance_name[:-6]
-            elif insurance_name.endswith('_insurance_rates'):
-                insurance_name = insurance_name[:-15]
-            insurance_name = insurance_name.replace(' ', '_')
-            
-            # Map the cleaned name back to our standard names
-            name_mapping = {
-                'aetna': 'Aetna',
-                'bluecross': 'BlueCross',
-                'medicare': 'Medicare',
-                'unitedhealthcare': 'UnitedHealthCare',
-                'medicaid': 'Medicaid'
-            }
-            
-            if insurance_name in name_mapping:
-                insurance_name = name_mapping[insurance_name]
-            else:
-                print(f"Warning: Unrecognized insurance name: {insurance_name}")
-                continue
-            
-            # Skip if it's not one of our valid insurance companies
-            if insurance_name not in valid_insurances:
-                print(f"Skipping invalid insurance file: {insurance_file}")
-                continue
-            
-            insurance_path = os.path.join(insurance_rates_dir, insurance_file)
-            print(f"\nLoading insurance file: {insurance_path}")
-            
-            # Try to open and read the file
-            try:
-                insurance_df = docx_table_to_df(insurance_path)
-            except Exception as e:
-                print(f"Error reading {insurance_file}: {str(e)}")
-                continue
-            
-            # Print column names for debugging
-            print(f"Columns in {insurance_file}: {insurance_df.columns.tolist()}")
-            
-            # Check if required columns exist
-            required_columns = ['Disease Name', 'Insurance Rate']
-            missing_columns = [col for col in required_columns if col not in insurance_df.columns]
-            if missing_columns:
-                print(f"Warning: Missing columns in {insurance_file}: {missing_columns}")
-                continue
-            
-            # Create dictionary of coverage amounts for this insurance
-            insurance_rates[insurance_name] = {
-                row['Disease Name']: float(row['Insurance Rate'])
-                for _, row in insurance_df.iterrows()
-            }
-            
-            # Print loaded rates for debugging
+        insurance_name, cleaned_name = _insurance_name(insurance_file)
+        if insurance_name is None:
+            print(f"Warning: Unrecognized insurance name: {cleaned_name}")
+            continue
+        # Skip if it's not one of our valid insurance companies
+        if insurance_name not in valid_insurances:
+            print(f"Skipping invalid insurance file: {insurance_file}")
+            continue
+        to_load.append((insurance_name, os.path.join(insurance_rates_dir, insurance_file)))
+
+    insurance_rates = {}
+    results = _load_insurance_files([path for _, path in to_load], max_workers, debug)
+    for (insurance_name, _), (rates, messages) in zip(to_load, results):
+        for message in messages:
+            print(message)
+        if rates is None:
+            continue
+        insurance_rates[insurance_name] = rates
+        if debug:
             print(f"Loaded rates for {insurance_name}:")
-            for disease, rate in insurance_rates[insurance_name].items():
+            for disease, rate in rates.items():
                 print(f"  {disease}: ${rate:.2f}")
-                
-        except Exception as e:
-            print(f"Error processing {insurance_file}: {str(e)}")
-            continue
     
     billing_df = prepare_billing_summary(doctor_df, insurance_rates, patient_df)
     
     return doctor_df, insurance_rates, patient_df, billing_df
 
+CURRENCY_COLUMNS = ['Doctor Charge', 'Insurance Pays', 'Patient Pays']
+
 def prepare_billing_summary(doctor_df, insurance_rates, patient_df):
     """
     Prepare a billing summary that shows:
     1. Total charges for each doctor
     2. Insurance coverage for each patient
     3. Patient's out-of-pocket costs
+
+    Rows are grouped by doctor (in order of first appearance). The money
+    columns stay numeric; use format_currency() when rendering or exporting.
     """
-    billing_summary = []
-    
-    # Group patients by doctor
-    for doctor in patient_df['Assigned Doctor'].unique():
-        doctor_patients = patient_df[patient_df['Assigned Doctor'] == doctor]
-        
-        # For each patient, calculate their insurance coverage and out-of-pocket costs
-        for _, patient in doctor_patients.iterrows():
-            disease = patient['Disease']
-            insurance_company = patient['Insurance Company']
-            
-            # Get the insurance rate for this disease and company
-            insurance_pays = 0
-            if insurance_company in insurance_rates and disease in insurance_rates[insurance_company]:
-                insurance_pays = insurance_rates[insurance_company][disease]
-            else:
-                print(f"Warning: Disease '{disease}' not found in rates for {insurance_company}")
-            
-            # Get doctor charge and convert to float
-            try:
-                doctor_charge = float(patient['Doctor Charge'])
-            except (ValueError, TypeError):
-                print(f"Error converting doctor charge for patient {patient['Patient ID']}")
-                doctor_charge = 0
-            
-            # Calculate out of pocket (doctor charge - insurance pays)
-            out_of_pocket = doctor_charge - insurance_pays
-            
-            billing_summary.append({
-                'Doctor': doctor,
-                'Patient ID': patient['Patient ID'],
-                'Patient Name': patient['Patient Name'],
-                'Disease': disease,
-                'Doctor Charge': doctor_charge,
-                'Insurance Company': insurance_company,
-                'Insurance Pays': insurance_pays,
-                'Patient Pays': out_of_pocket
-            })
-    
-    # Create DataFrame and format currency columns
-    billing_df = pd.DataFrame(billing_summary)
-    currency_cols = ['Doctor Charge', 'Insurance Pays', 'Patient Pays']
-    
-    # Format currency columns
-    for col in currency_cols:
-        billing_df[col] = billing_df[col].apply(lambda x: f"${x:,.2f}" if pd.notna(x) else "")
-    
-    return billing_df
+    rates_df = pd.DataFrame(
+        [(company, disease, rate) for company, rates in insurance_rates.items() for disease, rate in rates.items()],
+        columns=['Insurance Company', 'Disease', 'Insurance Pays']
+    )
+
+    # Group patients by doctor: stable sort on the doctor's first-appearance rank
+    patients = patient_df[patient_df['Assigned Doctor'].notna()]
+    doctor_rank = pd.Categorical(patients['Assigned Doctor'], categories=patients['Assigned Doctor'].unique()).codes
+    patients = patients.iloc[np.argsort(doctor_rank, kind='stable')]
+
+    merged = patients.merge(rates_df, on=['Insurance Company', 'Disease'], how='left')
+    missing_rate = merged['Insurance Pays'].isna()
+    for disease, insurance_company in merged.loc[missing_rate, ['Disease', 'Insurance Company']].itertuples(index=False):
+        print(f"Warning: Disease '{disease}' not found in rates for {insurance_company}")
+    insurance_pays = merged['Insurance Pays'].fillna(0.0).astype(float)
+
+    # Get doctor charge as float; missing or unparseable charges count as 0
+    doctor_charge = pd.to_numeric(merged['Doctor Charge'], errors='coerce').astype(float)
+    for patient_id in merged.loc[doctor_charge.isna(), 'Patient ID']:
+        print(f"Error converting doctor charge for patient {patient_id}")
+    doctor_charge = doctor_charge.fillna(0.0)
+
+    return pd.DataFrame({
+        'Doctor': merged['Assigned Doctor'],
+        'Patient ID': merged['Patient ID'],
+        'Patient Name': merged['Patient Name'],
+        'Disease': merged['Disease'],
+        'Doctor Charge': doctor_charge,
+        'Insurance Company': merged['Insurance Company'],
+        'Insurance Pays': insurance_pays,
+        # Calculate out of pocket (doctor charge - insurance pays)
+        'Patient Pays': doctor_charge - insurance_pays,
+    })
 
-def df_to_docx_table(df, output_file):
+def format_currency(df, columns=CURRENCY_COLUMNS):
+    """Copy of df with the money columns rendered as "$1,234.00" strings, for display or export."""
+    formatted = df.copy()
+    for col in columns:
+        if col in formatted.columns:
+            formatted[col] = [f"${x:,.2f}" if pd.notna(x) else "" for x in formatted[col]]
+    return formatted
+
+# --- Bulk DOCX table writer ---
+def _docx_cell_text(value):
+    # Convert numeric values to string with proper formatting; nullable Int64/Float64
+    # columns yield NumPy scalars, which iterrows() used to hand over as Python numbers
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return f"{value:.2f}"
+    return str(value)
+
+def _docx_run_xml(text):
+    # What python-docx's cell.text setter produces: tabs and line breaks become
+    # <w:tab/> and <w:br/>, text with outer whitespace gets xml:space="preserve"
+    parts = []
+    for i, line in enumerate(text.replace('\r\n', '\n').replace('\r', '\n').split('\n')):
+        if i:
+            parts.append('<w:br/>')
+        for j, chunk in enumerate(line.split('\t')):
+            if j:
+                parts.append('<w:tab/>')
+            if chunk:
+                space = ' xml:space="preserve"' if chunk != chunk.strip() else ''
+                parts.append(f'<w:t{space}>{xml_escape(chunk)}</w:t>')
+    return f"<w:r>{''.join(parts)}</w:r>" if parts else '<w:r/>'
+
+def _write_docx_table(df, output_file, title):
+    doc = Document()
+    doc.add_heading(title, level=1)
+    table = doc.add_table(rows=1, cols=len(df.columns))
+    table.style = 'Table Grid'
+    hdr_cells = table.rows[0].cells
+    for i, col in enumerate(df.columns):
+        hdr_cells[i].text = str(col)
+
+    # Build every data row as one XML fragment instead of calling add_row() per row
+    tc_prs = [f'<w:tcPr><w:tcW w:type="dxa" w:w="{col.width.twips}"/></w:tcPr>' for col in table.columns]
+    rows_xml = ''.join(
+        '<w:tr>' + ''.join(
+            f'<w:tc>{tc_pr}<w:p>{_docx_run_xml(_docx_cell_text(value))}</w:p></w:tc>'
+            for tc_pr, value in zip(tc_prs, row)
+        ) + '</w:tr>'
+        for row in df.itertuples(index=False, name=None)
+    )
+    fragment = parse_xml(f'<w:tbl {nsdecls("w")}>{rows_xml}</w:tbl>')
+    table._tbl.extend(list(fragment))
+    doc.save(output_file)
+
+def df_to_docx_table(df, output_file, max_rows_per_document=None, title='Patient Disease Assignments'):
     """
     Save a pandas DataFrame to a Word document as a table.
+
+    With max_rows_per_document set, a larger DataFrame is split across
+    <name>_part1.docx, <name>_part2.docx, ... each with the header row.
     """
     try:
-        # Create a new Word document
-        doc = Document()
-        
-        # Add a title
-        doc.add_heading('Patient Disease Assignments', level=1)
-        
-        # Create a table
-        table = doc.add_table(rows=1, cols=len(df.columns))
-        table.style = 'Table Grid'
-        
-        # Add headers
-        hdr_cells = table.rows[0].cells
-        for i, col in enumerate(df.columns):
-            hdr_cells[i].text = str(col)
-        
-        # Add data rows
-        for _, row in df.iterrows():
-            row_cells = table.add_row().cells
-            for i, value in enumerate(row):
-                # Convert numeric values to string with proper formatting
-                if isinstance(value, (int, float)):
-                    row_cells[i].text = f"{value:.2f}"
-                else:
-                    row_cells[i].text = str(value)
-        
-        # Save the document
-        doc.save(output_file)
+        if max_rows_per_document is None or len(df) <= max_rows_per_document:
+            _write_docx_table(df, output_file, title)
+            return True
+        stem, ext = os.path.splitext(output_file)
+        for part, start in enumerate(range(0, len(df), max_rows_per_document), 1):
+            _write_docx_table(df.iloc[start:start + max_rows_per_document], f"{stem}_part{part}{ext}", title)
         return True
     except Exception as e:
         print(f"Error saving to Word document: {str(e)}")
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, event, Column, DateTime, Integer, String, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -19,7 +19,10 @@ class DoctorRate(Base):
     disease = Column(String, nullable=False)
     default_rate = Column(Float, nullable=False)
     doctor = relationship('Doctor', back_populates='rates')
-    __table_args__ = (UniqueConstraint('doctor_id', 'icd_code', name='_doctor_icd_uc'),)
+    __table_args__ = (
+        UniqueConstraint('doctor_id', 'icd_code', name='_doctor_icd_uc'),
+        Index('ix_doctor_rates_icd_code', 'icd_code'),
+    )
 
 class InsuranceRate(Base):
     __tablename__ = 'insurance_rates'
@@ -42,6 +45,12 @@ class Patient(Base):
     insurance_provider = Column(String, nullable=False)
     assigned_doctor = relationship('Doctor')
     custom_rates = relationship('PatientDoctorRate', back_populates='patient')
+    __table_args__ = (
+        Index('ix_patients_assigned_doctor_id', 'assigned_doctor_id'),
+        Index('ix_patients_insurance_icd', 'insurance_provider', 'icd_code'),
+        # Backs the dashboard's paged patient list and name-prefix lookup
+        Index('ix_patients_name_id', 'name', 'id'),
+    )
 
 class PatientDoctorRate(Base):
     __tablename__ = 'patient_doctor_rates'
@@ -54,18 +63,189 @@ class PatientDoctorRate(Base):
     doctor = relationship('Doctor')
     __table_args__ = (UniqueConstraint('patient_id', 'doctor_id', 'icd_code', name='_pat_doc_icd_uc'),)
 
+class BillingSummary(Base):
+    '''Materialized billing summary, one row per patient; kept current by db_utils writes.'''
+    __tablename__ = 'billing_summary'
+    patient_id = Column(String, ForeignKey('patients.id'), primary_key=True)
+    patient_name = Column(String, nullable=False)
+    disease = Column(String, nullable=False)
+    icd_code = Column(String, nullable=False)
+    doctor_name = Column(String, nullable=False)
+    doctor_charge = Column(Float, nullable=False)
+    insurance_provider = Column(String, nullable=False)
+    insurance_pays = Column(Float, nullable=False)
+    patient_pays = Column(Float, nullable=False)
+    # Back the dashboard's doctor / patient / insurance filters
+    __table_args__ = (
+        Index('ix_billing_summary_doctor_name', 'doctor_name'),
+        Index('ix_billing_summary_patient_name', 'patient_name'),
+        Index('ix_billing_summary_insurance_provider', 'insurance_provider'),
+    )
+
+class StatementSend(Base):
+    '''Durable log of emailed statements: a (patient, statement hash) marked sent (or left sending) is not sent again.'''
+    __tablename__ = 'statement_sends'
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(String, ForeignKey('patients.id'), nullable=False)
+    statement_hash = Column(String, nullable=False)  # render_statements input hash
+    recipient = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # 'sending', 'sent' or 'failed'
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(String)
+    updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (UniqueConstraint('patient_id', 'statement_hash', name='_statement_send_uc'),)
+
+class ProcedureCode(Base):
+    '''CPT code a diagnosis is billed under: remittances code their lines by CPT, claims here by ICD.'''
+    __tablename__ = 'procedure_codes'
+    icd_code = Column(String, primary_key=True)
+    cpt_code = Column(String, nullable=False)
+
+class PayerMember(Base):
+    '''A patient's member ID with their insurer, the "Insured ID #" EOB lines carry.'''
+    __tablename__ = 'payer_members'
+    id = Column(Integer, primary_key=True)
+    insurance_provider = Column(String, nullable=False)
+    member_id = Column(String, nullable=False)
+    patient_id = Column(String, ForeignKey('patients.id'), nullable=False)
+    __table_args__ = (
+        UniqueConstraint('insurance_provider', 'member_id', name='_payer_member_uc'),
+        Index('ix_payer_members_member_id', 'member_id'),
+    )
+
+class ReconciliationException(Base):
+    '''An EOB line flagged by reconcile_eob.py: underpaid, denied or matching no billed claim.'''
+    __tablename__ = 'reconciliation_exceptions'
+    id = Column(Integer, primary_key=True)
+    source_hash = Column(String, nullable=False)  # SHA-256 of the reconciled EOB file
+    source_file = Column(String, nullable=False)
+    line_number = Column(Integer, nullable=False)  # 1-based line item number within the source
+    member_id = Column(String)  # the EOB's patient (insured) ID
+    patient_id = Column(String)  # resolved through payer_members; None when the member is unknown
+    code = Column(String)
+    exception_type = Column(String, nullable=False)  # 'underpaid', 'denied' or 'unmatched'
+    denial_code = Column(String)
+    amount_billed = Column(Float)
+    amount_paid = Column(Float)
+    expected_paid = Column(Float)  # insurance_pays from billing_summary; None when unmatched
+    difference = Column(Float)  # expected_paid - amount_paid
+    created_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index('ix_reconciliation_exceptions_source_hash', 'source_hash'),
+        Index('ix_reconciliation_exceptions_patient_id', 'patient_id'),
+    )
+
 # Utility function to create the database
 
+import contextlib
 import os
+import threading
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, 'billing.db')
+
+# Applied to every new SQLite connection. The workload is read-heavy
+# (dashboard reruns), so WAL lets readers run next to the occasional writer
+# and NORMAL sync is safe under WAL. cache_size is negative, i.e. in KiB.
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64 * 1024),
+)
 
-def init_db(db_path=None):
-    # Always create DB inside the project data/ directory
-    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_dir = os.path.join(base_dir, 'data')
-    os.makedirs(data_dir, exist_ok=True)
-    db_file = os.path.join(data_dir, 'billing.db')
-    engine = create_engine(f'sqlite:///{db_file}')
+# Pool settings that can be overridden from the environment
+POOL_ENV_VARS = {
+    'pool_size': 'BILLING_DB_POOL_SIZE',
+    'max_overflow': 'BILLING_DB_MAX_OVERFLOW',
+    'pool_timeout': 'BILLING_DB_POOL_TIMEOUT',
+}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+def create_db_engine(db_path=None, **pool_options):
+    '''
+    Build an engine for db_path (default: $BILLING_DB_PATH, else data/billing.db).
+    Pool options come from the BILLING_DB_* environment variables unless passed in.
+    '''
+    db_file = db_path or os.environ.get('BILLING_DB_PATH') or DEFAULT_DB_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+    options = {key: int(os.environ[env]) for key, env in POOL_ENV_VARS.items() if os.environ.get(env)}
+    options.update(pool_options)
+    engine = create_engine(f'sqlite:///{db_file}', **options)
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+def init_db(db_path=None, **pool_options):
+    engine = create_db_engine(db_path, **pool_options)
     Base.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add indexes introduced
+    # after a database was first created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
     return engine
 
 Session = sessionmaker()
+
+_engine = None
+_engine_pid = None
+# Set by configure_engine so a forked child rebuilds the same engine
+_engine_db_path = None
+_engine_pool_options = {}
+_engine_lock = threading.Lock()
+
+def get_engine():
+    '''
+    Process-wide engine, created (and the schema ensured) on first use.
+    A child process that inherited the parent's engine gets its own.
+    '''
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine_pid != os.getpid():
+                if _engine is not None:
+                    # Drop the parent's pooled connections without closing them
+                    _engine.dispose(close=False)
+                _engine = init_db(_engine_db_path, **_engine_pool_options)
+                _engine_pid = os.getpid()
+                Session.configure(bind=_engine)
+    return _engine
+
+def configure_engine(db_path=None, **pool_options):
+    '''Replace the process-wide engine, e.g. to use another database file or pool size.'''
+    global _engine, _engine_pid, _engine_db_path, _engine_pool_options
+    with _engine_lock:
+        if _engine is not None and _engine_pid == os.getpid():
+            _engine.dispose()
+        _engine = init_db(db_path, **pool_options)
+        _engine_db_path = db_path
+        _engine_pool_options = dict(pool_options)
+        _engine_pid = os.getpid()
+        Session.configure(bind=_engine)
+    return _engine
+
+@contextlib.contextmanager
+def temporary_engine(db_path, **pool_options):
+    '''
+    Use db_path as the process-wide engine inside the block. Afterwards its
+    engine is disposed and the previous configuration is back in place; an
+    engine that was never created is left to get_engine() to create lazily.
+    '''
+    global _engine, _engine_pid, _engine_db_path, _engine_pool_options
+    with _engine_lock:
+        previous = (_engine, _engine_pid, _engine_db_path, _engine_pool_options)
+    engine = configure_engine(db_path, **pool_options)
+    try:
+        yield engine
+    finally:
+        with _engine_lock:
+            engine.dispose()
+            _engine, _engine_pid, _engine_db_path, _engine_pool_options = previous
+            if _engine is not None:
+                Session.configure(bind=_engine)
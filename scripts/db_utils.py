@@ -1,110 +1,616 @@
 import hashlib
-from sqlalchemy.orm import sessionmaker
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pandas as pd
+from sqlalchemy import and_, bindparam, delete, event, func, insert, literal_column, or_, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 try:
+    from scripts import instrumentation
     from scripts.db_models import (
-        init_db, Doctor, DoctorRate, InsuranceRate, Patient, PatientDoctorRate, Base
+        get_engine, Session, Doctor, DoctorRate, InsuranceRate, Patient, PatientDoctorRate, StatementSend,
+        ProcedureCode, PayerMember, ReconciliationException, Base
     )
 except ImportError:
+    import instrumentation
     from db_models import (
-        init_db, Doctor, DoctorRate, InsuranceRate, Patient, PatientDoctorRate, Base
+        get_engine, Session, Doctor, DoctorRate, InsuranceRate, Patient, PatientDoctorRate, StatementSend,
+        ProcedureCode, PayerMember, ReconciliationException, Base
     )
 
 def get_session():
-    engine = init_db()
-    Session = sessionmaker(bind=engine)
+    '''New session on the process-wide engine (the caller must close it).'''
+    get_engine()
     return Session()
 
+@contextmanager
+def session_scope():
+    '''Session for a block of work: commits on success, rolls back on error, always closes.'''
+    session = get_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+# --- Change tracking ---
+# Committed writes made through db_utils sessions bump a counter per table.
+# Writes from anywhere else (another process, the sqlite3 shell, a second
+# copy of this module) are caught with SQLite's PRAGMA data_version, read
+# on a dedicated connection: it changes whenever any *other* connection
+# commits. Around each of our own commits the value is checked before (so
+# earlier outside writes are not booked as ours) and recorded after, so only
+# later changes count as outside writes.
+_table_versions = {}
+_outside_writes = 0
+_seen_data_version = None
+_version_lock = threading.Lock()
+_version_conn = None
+_version_conn_key = None  # (pid, database file) the connection was opened for
+
+def _read_data_version():
+    '''PRAGMA data_version of the engine's current database (call with _version_lock held).'''
+    global _version_conn, _version_conn_key, _outside_writes
+    key = (os.getpid(), get_engine().url.database)
+    if _version_conn is None or _version_conn_key != key:
+        if _version_conn is not None:
+            # Another database (configure_engine()) or process: every earlier token is
+            # stale. A parent's connection is dropped without closing, like get_engine()
+            if _version_conn_key[0] == key[0]:
+                _version_conn.close()
+            _outside_writes += 1
+        _version_conn = sqlite3.connect(key[1], check_same_thread=False)
+        _version_conn_key = key
+    return _version_conn.execute('PRAGMA data_version').fetchone()[0]
+
+@event.listens_for(Session, 'after_flush')
+def _mark_flush_write(session, flush_context):
+    written = session.info.setdefault('written_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        written.add(obj.__table__.name)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _mark_statement_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        written = orm_execute_state.session.info.setdefault('written_tables', set())
+        written.add(orm_execute_state.statement.table.name)
+
+def _check_outside_writes():
+    # Call with _version_lock held
+    global _outside_writes, _seen_data_version
+    current = _read_data_version()
+    if current != _seen_data_version:
+        _outside_writes += 1
+        _seen_data_version = current
+
+def _own_data_version(dbapi_connection):
+    return dbapi_connection.execute('PRAGMA data_version').fetchone()[0]
+
+@event.listens_for(Session, 'before_commit')
+def _note_data_version(session):
+    # Flush now, so the commit's writes are known and hold SQLite's write lock:
+    # no other connection can commit until ours does, and anything the dedicated
+    # connection sees as changed happened before our commit.
+    session.flush()
+    if not session.info.get('written_tables'):
+        return
+    dbapi_connection = session.connection().connection.driver_connection
+    with _version_lock:
+        _check_outside_writes()
+    # data_version on the session's own connection ignores its own commit, so it
+    # tells whether anyone else committed between our commit and the read below
+    session.info['own_connection'] = (dbapi_connection, _own_data_version(dbapi_connection))
+
+@event.listens_for(Session, 'after_commit')
+def _count_write(session):
+    global _seen_data_version, _outside_writes
+    written = session.info.pop('written_tables', None)
+    own_connection = session.info.pop('own_connection', None)
+    if written:
+        with _version_lock:
+            for table in written:
+                _table_versions[table] = _table_versions.get(table, 0) + 1
+            _seen_data_version = _read_data_version()
+            # The connection is still checked out by this session (it goes back
+            # to the pool after after_commit), so it is safe to use here
+            if own_connection is not None:
+                dbapi_connection, before = own_connection
+                if _own_data_version(dbapi_connection) != before:
+                    _outside_writes += 1
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_writes(session):
+    session.info.pop('written_tables', None)
+    session.info.pop('own_connection', None)
+
+def data_version(*tables):
+    '''
+    Token that changes after every committed write; use it as a cache key.
+    Given table names, writes made through db_utils only change it when they
+    touch one of those tables; outside writes always change it.
+    '''
+    with _version_lock:
+        _check_outside_writes()
+        names = tables or sorted(_table_versions)
+        return (_outside_writes, tuple(_table_versions.get(t, 0) for t in names))
+
 def generate_patient_id(name, email, phone):
     raw = f"{name.lower()}-{email.lower()}-{phone}"
     return hashlib.sha256(raw.encode()).hexdigest()[:10]
 
+# --- Materialized billing summary upkeep ---
+def _billing_engine():
+    # Imported lazily: billing_engine itself imports db_utils
+    try:
+        from scripts import billing_engine
+    except ImportError:
+        import billing_engine
+    return billing_engine
+
+def _refresh_billing_summary(session, criterion):
+    '''Recompute the billing_summary rows of patients matching criterion in this transaction.'''
+    session.flush()
+    _billing_engine().refresh_summary_rows(session, criterion)
+
+def _refresh_billing_summary_for_pairs(session, columns, pairs):
+    '''Refresh patients whose (columns) values are in pairs, e.g. (provider, icd_code).'''
+    pairs = list(set(pairs))
+    chunk_size = max(1, MAX_IN_PARAMS // len(columns))
+    for start in range(0, len(pairs), chunk_size):
+        _refresh_billing_summary(session, tuple_(*columns).in_(pairs[start:start + chunk_size]))
+
+def _refresh_billing_summary_for_patients(session, patient_ids):
+    patient_ids = list(set(patient_ids))
+    for start in range(0, len(patient_ids), MAX_IN_PARAMS):
+        _refresh_billing_summary(session, Patient.id.in_(patient_ids[start:start + MAX_IN_PARAMS]))
+
 # --- Doctor functions ---
 def add_doctor(name, rates):
     '''rates: list of dicts [{icd_code, disease, default_rate}]'''
-    session = get_session()
-    doctor = Doctor(name=name)
-    session.add(doctor)
-    session.flush()  # To get doctor.id
-    for r in rates:
-        dr_rate = DoctorRate(doctor_id=doctor.id, icd_code=r['icd_code'], disease=r['disease'], default_rate=r['default_rate'])
-        session.add(dr_rate)
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        doctor = Doctor(name=name)
+        session.add(doctor)
+        session.flush()  # To get doctor.id
+        for r in rates:
+            dr_rate = DoctorRate(doctor_id=doctor.id, icd_code=r['icd_code'], disease=r['disease'], default_rate=r['default_rate'])
+            session.add(dr_rate)
+        _refresh_billing_summary(session, Patient.assigned_doctor_id == doctor.id)
 
 def get_doctors():
-    session = get_session()
-    doctors = session.query(Doctor).all()
-    result = []
-    for d in doctors:
-        rates = [ {'icd_code': r.icd_code, 'disease': r.disease, 'default_rate': r.default_rate} for r in d.rates ]
-        result.append({'id': d.id, 'name': d.name, 'rates': rates})
-    session.close()
+    with session_scope() as session:
+        doctors = session.query(Doctor).all()
+        result = []
+        for d in doctors:
+            rates = [ {'icd_code': r.icd_code, 'disease': r.disease, 'default_rate': r.default_rate} for r in d.rates ]
+            result.append({'id': d.id, 'name': d.name, 'rates': rates})
     return result
 
 # --- Insurance functions ---
 def add_insurance_rate(provider, disease, icd_code, rate):
-    session = get_session()
-    ins = InsuranceRate(insurance_provider=provider, disease=disease, icd_code=icd_code, rate=rate)
-    session.add(ins)
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        ins = InsuranceRate(insurance_provider=provider, disease=disease, icd_code=icd_code, rate=rate)
+        session.add(ins)
+        _refresh_billing_summary(session, and_(Patient.insurance_provider == provider, Patient.icd_code == icd_code))
 
 def get_insurance_rates():
-    session = get_session()
-    rates = session.query(InsuranceRate).all()
-    result = [ {'provider': r.insurance_provider, 'disease': r.disease, 'icd_code': r.icd_code, 'rate': r.rate} for r in rates ]
-    session.close()
+    with session_scope() as session:
+        rates = session.query(InsuranceRate).all()
+        result = [ {'provider': r.insurance_provider, 'disease': r.disease, 'icd_code': r.icd_code, 'rate': r.rate} for r in rates ]
     return result
 
 # --- Patient functions ---
 def add_patient(name, email, phone, disease, icd_code, doctor_id, insurance_provider):
-    session = get_session()
     patient_id = generate_patient_id(name, email, phone)
-    # Ensure uniqueness
-    existing = session.query(Patient).filter_by(id=patient_id).first()
-    if existing:
-        session.close()
-        raise ValueError('Patient already exists!')
-    patient = Patient(
-        id=patient_id, name=name, email=email, phone=phone,
-        disease=disease, icd_code=icd_code,
-        assigned_doctor_id=doctor_id, insurance_provider=insurance_provider
-    )
-    session.add(patient)
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        # Ensure uniqueness
+        existing = session.query(Patient).filter_by(id=patient_id).first()
+        if existing:
+            raise ValueError('Patient already exists!')
+        patient = Patient(
+            id=patient_id, name=name, email=email, phone=phone,
+            disease=disease, icd_code=icd_code,
+            assigned_doctor_id=doctor_id, insurance_provider=insurance_provider
+        )
+        session.add(patient)
+        _refresh_billing_summary(session, Patient.id == patient_id)
     return patient_id
 
+def _patient_dict(p):
+    return {
+        'id': p.id, 'name': p.name, 'email': p.email, 'phone': p.phone,
+        'disease': p.disease, 'icd_code': p.icd_code,
+        'assigned_doctor_id': p.assigned_doctor_id,
+        'insurance_provider': p.insurance_provider
+    }
+
 def get_patients():
-    session = get_session()
-    patients = session.query(Patient).all()
-    result = []
-    for p in patients:
-        result.append({
-            'id': p.id, 'name': p.name, 'email': p.email, 'phone': p.phone,
-            'disease': p.disease, 'icd_code': p.icd_code,
-            'assigned_doctor_id': p.assigned_doctor_id,
-            'insurance_provider': p.insurance_provider
-        })
-    session.close()
+    with session_scope() as session:
+        patients = session.query(Patient).all()
+        result = [_patient_dict(p) for p in patients]
     return result
 
+def _patient_criteria(name=None):
+    # A name prefix, matched as a range so the (name, id) index is used
+    if not name:
+        return []
+    return [Patient.name >= name, Patient.name < name + '\U0010ffff']
+
+def query_patients(name=None, limit=50, offset=0):
+    '''
+    One page of patients (dicts like get_patients()), filtered and paged in SQL.
+    name is a name prefix; matches come in name order, otherwise table order.
+    '''
+    order = (Patient.name, Patient.id) if name else (literal_column('patients.rowid'),)
+    with session_scope() as session:
+        query = session.query(Patient).filter(*_patient_criteria(name)).order_by(*order)
+        if limit is not None:
+            query = query.limit(limit).offset(offset)
+        return [_patient_dict(p) for p in query]
+
+def count_patients(name=None):
+    with session_scope() as session:
+        return session.scalar(select(func.count()).select_from(Patient).where(*_patient_criteria(name)))
+
+def get_patient(patient_id):
+    '''One patient as a dict like get_patients() returns, or None.'''
+    with session_scope() as session:
+        patient = session.get(Patient, patient_id)
+        return _patient_dict(patient) if patient is not None else None
+
 # --- Custom patient-doctor rates ---
 def set_custom_rate(patient_id, doctor_id, icd_code, custom_rate):
-    session = get_session()
-    existing = session.query(PatientDoctorRate).filter_by(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code).first()
-    if existing:
-        existing.custom_rate = custom_rate
-    else:
-        new_rate = PatientDoctorRate(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code, custom_rate=custom_rate)
-        session.add(new_rate)
-    session.commit()
-    session.close()
+    '''
+    Store a patient's custom charge and return the patient's recomputed
+    billing summary row (a dict keyed like the summary DataFrame), or None
+    if the patient does not exist.
+    '''
+    doctor_id = _optional_int(doctor_id)
+    with session_scope() as session:
+        existing = session.query(PatientDoctorRate).filter_by(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code).first()
+        if existing:
+            existing.custom_rate = custom_rate
+        else:
+            new_rate = PatientDoctorRate(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code, custom_rate=custom_rate)
+            session.add(new_rate)
+        _refresh_billing_summary(session, Patient.id == patient_id)
+        return _billing_engine().summary_row(session, patient_id)
 
 def get_custom_rate(patient_id, doctor_id, icd_code):
-    session = get_session()
-    rate = session.query(PatientDoctorRate).filter_by(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code).first()
-    session.close()
-    if rate:
-        return rate.custom_rate
+    with session_scope() as session:
+        rate = session.query(PatientDoctorRate).filter_by(patient_id=patient_id, doctor_id=doctor_id, icd_code=icd_code).first()
+        if rate:
+            return rate.custom_rate
     return None
+
+# --- Statement send log ---
+def get_sent_statements():
+    '''Set of (patient_id, statement_hash) pairs already emailed.'''
+    with session_scope() as session:
+        rows = session.execute(
+            select(StatementSend.patient_id, StatementSend.statement_hash).where(StatementSend.status == 'sent')
+        )
+        return {tuple(r) for r in rows}
+
+def get_statement_send_status():
+    '''{(patient_id, statement_hash): status} of every statement in the send log.'''
+    with session_scope() as session:
+        rows = session.execute(select(StatementSend.patient_id, StatementSend.statement_hash, StatementSend.status))
+        return {(patient_id, digest): status for patient_id, digest, status in rows}
+
+def record_statement_send(patient_id, statement_hash, recipient, status, attempts, error=None):
+    '''
+    Record the state of emailing one statement: 'sending' (written before the
+    SMTP call, so a crash before the outcome is known leaves it behind),
+    'sent' or 'failed'. attempts add up across runs.
+    '''
+    row = {
+        'patient_id': patient_id, 'statement_hash': statement_hash, 'recipient': recipient,
+        'status': status, 'attempts': attempts, 'last_error': error,
+        'updated_at': datetime.now(timezone.utc).replace(tzinfo=None),
+    }
+    stmt = sqlite_insert(StatementSend).values(**row)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['patient_id', 'statement_hash'],
+        set_={
+            'recipient': stmt.excluded.recipient, 'status': stmt.excluded.status,
+            'attempts': StatementSend.attempts + stmt.excluded.attempts,
+            'last_error': stmt.excluded.last_error, 'updated_at': stmt.excluded.updated_at,
+        },
+    )
+    with session_scope() as session:
+        session.execute(stmt)
+
+# --- Claim keys for reconciliation ---
+def upsert_procedure_codes_bulk(codes):
+    '''codes: list of dicts [{icd_code, cpt_code}]; an ICD code already mapped gets the new CPT code.'''
+    rows = [{'icd_code': c['icd_code'], 'cpt_code': c['cpt_code']} for c in codes]
+    with session_scope() as session:
+        return _upsert_rows(session, ProcedureCode, rows, ['icd_code'], ['cpt_code'])
+
+def get_procedure_codes():
+    '''{icd_code: cpt_code} of every mapped diagnosis.'''
+    with session_scope() as session:
+        return dict(session.execute(select(ProcedureCode.icd_code, ProcedureCode.cpt_code)).all())
+
+def upsert_payer_members_bulk(members):
+    '''members: list of dicts [{insurance_provider, member_id, patient_id}]'''
+    rows = [
+        {'insurance_provider': m['insurance_provider'], 'member_id': str(m['member_id']), 'patient_id': m['patient_id']}
+        for m in members
+    ]
+    with session_scope() as session:
+        return _upsert_rows(session, PayerMember, rows, ['insurance_provider', 'member_id'], ['patient_id'])
+
+def get_payer_members(member_ids=None, insurance_provider=None):
+    '''
+    (insurance_provider, member_id, patient_id) rows, all of them or those
+    of the given member IDs (looked up in chunks), optionally of one insurer.
+    '''
+    columns = (PayerMember.insurance_provider, PayerMember.member_id, PayerMember.patient_id)
+    criteria = [PayerMember.insurance_provider == insurance_provider] if insurance_provider is not None else []
+    with session_scope() as session:
+        if member_ids is None:
+            return [tuple(r) for r in session.execute(select(*columns).where(*criteria))]
+        member_ids = list(member_ids)
+        rows = []
+        for start in range(0, len(member_ids), MAX_IN_PARAMS):
+            chunk = member_ids[start:start + MAX_IN_PARAMS]
+            rows.extend(tuple(r) for r in session.execute(
+                select(*columns).where(PayerMember.member_id.in_(chunk), *criteria)
+            ))
+        return rows
+
+def claim_key_counts():
+    '''Rows in the tables reconciliation matches EOB lines through: {'procedure_codes': n, 'payer_members': n}.'''
+    with session_scope() as session:
+        return {
+            model.__tablename__: session.scalar(select(func.count()).select_from(model))
+            for model in (ProcedureCode, PayerMember)
+        }
+
+# --- Reconciliation exceptions ---
+def clear_reconciliation_exceptions(source_hash):
+    '''Drop the exceptions of an earlier reconciliation of the same EOB file. Returns the row count.'''
+    with session_scope() as session:
+        return session.execute(
+            delete(ReconciliationException).where(ReconciliationException.source_hash == source_hash)
+        ).rowcount
+
+def add_reconciliation_exceptions(rows):
+    '''Insert exception rows (dicts keyed by ReconciliationException columns) in one executemany.'''
+    if not rows:
+        return 0
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    with session_scope() as session:
+        session.execute(insert(ReconciliationException), [{'created_at': created_at, **r} for r in rows])
+    return len(rows)
+
+def get_reconciliation_exceptions(source_hash=None, exception_type=None):
+    with session_scope() as session:
+        stmt = select(ReconciliationException).order_by(ReconciliationException.id)
+        if source_hash is not None:
+            stmt = stmt.where(ReconciliationException.source_hash == source_hash)
+        if exception_type is not None:
+            stmt = stmt.where(ReconciliationException.exception_type == exception_type)
+        return [
+            {c.name: getattr(r, c.name) for c in ReconciliationException.__table__.columns}
+            for r in session.scalars(stmt)
+        ]
+
+# --- Bulk charge resolution ---
+# SQLite caps the number of bound parameters per statement, so long
+# patient_id lists are resolved in chunks of this size.
+MAX_IN_PARAMS = 900
+
+def doctor_charge_column():
+    '''Effective doctor charge: custom rate first, then the doctor's default rate, then 0.0.'''
+    return func.coalesce(PatientDoctorRate.custom_rate, DoctorRate.default_rate, 0.0)
+
+def join_doctor_charge(stmt):
+    '''Outer-join the rate tables doctor_charge_column() reads onto a SELECT from patients.'''
+    return (
+        stmt
+        .outerjoin(PatientDoctorRate, and_(
+            PatientDoctorRate.patient_id == Patient.id,
+            PatientDoctorRate.doctor_id.is_not_distinct_from(Patient.assigned_doctor_id),
+            PatientDoctorRate.icd_code == Patient.icd_code,
+        ))
+        .outerjoin(DoctorRate, and_(
+            DoctorRate.doctor_id == Patient.assigned_doctor_id,
+            DoctorRate.icd_code == Patient.icd_code,
+        ))
+    )
+
+def resolve_doctor_charges(patient_ids=None):
+    '''
+    Return {patient_id: effective doctor charge} for many patients at once.
+    patient_ids=None resolves every patient; unknown ids are left out.
+    '''
+    stmt = join_doctor_charge(select(Patient.id, doctor_charge_column()).select_from(Patient))
+    with session_scope() as session:
+        if patient_ids is None:
+            return dict(session.execute(stmt).all())
+        patient_ids = list(patient_ids)
+        result = {}
+        for start in range(0, len(patient_ids), MAX_IN_PARAMS):
+            chunk = patient_ids[start:start + MAX_IN_PARAMS]
+            result.update(session.execute(stmt.where(Patient.id.in_(chunk))).all())
+        return result
+
+# --- Bulk insert / upsert ---
+def _upsert_rows(session, model, rows, key_columns, update_columns):
+    '''
+    Write rows (dicts keyed by column name) with INSERT ... ON CONFLICT in one
+    executemany. Returns {'inserted', 'updated', 'skipped'} where skipped
+    counts rows identical to what is stored and repeated keys in the input
+    (the last occurrence wins).
+
+    A NULL key column never matches in IN or ON CONFLICT, so keys holding a
+    None are looked up with IS and written with a plain UPDATE or INSERT,
+    like the single-row functions' filter_by() does.
+    '''
+    table = model.__table__
+    by_key = {}
+    for row in rows:
+        by_key[tuple(row[c] for c in key_columns)] = row
+    counts = {'inserted': 0, 'updated': 0, 'skipped': len(rows) - len(by_key)}
+    if not by_key:
+        return counts
+
+    # Fetch the stored version of every incoming key
+    key_cols = [table.c[c] for c in key_columns]
+    value_cols = [table.c[c] for c in update_columns]
+    keys = [key for key in by_key if None not in key]
+    null_keys = [key for key in by_key if None in key]
+    existing = {}
+    chunk_size = max(1, MAX_IN_PARAMS // len(key_columns))
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        stmt = select(*key_cols, *value_cols).where(tuple_(*key_cols).in_(chunk))
+        for r in session.execute(stmt):
+            existing[tuple(r[:len(key_columns)])] = tuple(r[len(key_columns):])
+    for start in range(0, len(null_keys), chunk_size):
+        chunk = null_keys[start:start + chunk_size]
+        stmt = select(*key_cols, *value_cols).where(or_(*(
+            and_(*(col.is_not_distinct_from(value) for col, value in zip(key_cols, key))) for key in chunk
+        )))
+        for r in session.execute(stmt):
+            existing[tuple(r[:len(key_columns)])] = tuple(r[len(key_columns):])
+
+    pending, null_inserts, null_updates = [], [], []
+    for key, row in by_key.items():
+        if key not in existing:
+            counts['inserted'] += 1
+            (null_inserts if None in key else pending).append(row)
+        elif existing[key] != tuple(row[c] for c in update_columns):
+            counts['updated'] += 1
+            (null_updates if None in key else pending).append(row)
+        else:
+            counts['skipped'] += 1
+
+    if pending:
+        stmt = sqlite_insert(table)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={c: stmt.excluded[c] for c in update_columns},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=key_columns)
+        session.execute(stmt, pending)
+    if null_inserts:
+        session.execute(insert(table), null_inserts)
+    if null_updates:
+        stmt = (
+            update(table)
+            .where(and_(*(col.is_not_distinct_from(bindparam(f'key_{col.name}')) for col in key_cols)))
+            .values({c: bindparam(f'new_{c}') for c in update_columns})
+        )
+        session.connection().execute(stmt, [
+            {**{f'key_{c}': row[c] for c in key_columns}, **{f'new_{c}': row[c] for c in update_columns}}
+            for row in null_updates
+        ])
+    return counts
+
+def _optional_int(value):
+    # numpy integers would otherwise be stored as BLOBs by sqlite3; a float
+    # id column from pandas holds NaN (or <NA>) where there is no doctor
+    return None if value is None or pd.isna(value) else int(value)
+
+def _upsert_doctor_rates(session, rates):
+    rows = [
+        {'doctor_id': _optional_int(r['doctor_id']), 'icd_code': r['icd_code'],
+         'disease': r['disease'], 'default_rate': float(r['default_rate'])}
+        for r in rates
+    ]
+    counts = _upsert_rows(session, DoctorRate, rows, ['doctor_id', 'icd_code'], ['disease', 'default_rate'])
+    return counts, rows
+
+def upsert_doctor_rates_bulk(rates):
+    '''rates: list of dicts [{doctor_id, icd_code, disease, default_rate}]'''
+    with session_scope() as session:
+        counts, rows = _upsert_doctor_rates(session, rates)
+        _refresh_billing_summary_for_pairs(
+            session, (Patient.assigned_doctor_id, Patient.icd_code),
+            [(r['doctor_id'], r['icd_code']) for r in rows]
+        )
+        return counts
+
+def add_doctors_bulk(doctors):
+    '''
+    doctors: list of dicts [{name, rates: [{icd_code, disease, default_rate}]}]
+    Existing doctors are matched by name and their rates upserted.
+    Returns {'doctors': counts, 'rates': counts}.
+    '''
+    with session_scope() as session:
+        doctor_counts = _upsert_rows(session, Doctor, [{'name': d['name']} for d in doctors], ['name'], [])
+        names = [d['name'] for d in doctors]
+        ids = {}
+        for start in range(0, len(names), MAX_IN_PARAMS):
+            chunk = names[start:start + MAX_IN_PARAMS]
+            ids.update(session.execute(select(Doctor.name, Doctor.id).where(Doctor.name.in_(chunk))).all())
+        rates = [{**r, 'doctor_id': ids[d['name']]} for d in doctors for r in d.get('rates', [])]
+        rate_counts, _ = _upsert_doctor_rates(session, rates)
+        doctor_ids = list(set(ids.values()))
+        for start in range(0, len(doctor_ids), MAX_IN_PARAMS):
+            _refresh_billing_summary(session, Patient.assigned_doctor_id.in_(doctor_ids[start:start + MAX_IN_PARAMS]))
+    return {'doctors': doctor_counts, 'rates': rate_counts}
+
+def add_insurance_rates_bulk(rates):
+    '''
+    rates: list of dicts [{provider, disease, icd_code, rate}] (the shape
+    get_insurance_rates returns). Existing (provider, icd_code) rows are updated.
+    '''
+    rows = [
+        {'insurance_provider': r['provider'], 'disease': r['disease'],
+         'icd_code': r['icd_code'], 'rate': float(r['rate'])}
+        for r in rates
+    ]
+    with session_scope() as session:
+        counts = _upsert_rows(session, InsuranceRate, rows, ['insurance_provider', 'icd_code'], ['disease', 'rate'])
+        _refresh_billing_summary_for_pairs(
+            session, (Patient.insurance_provider, Patient.icd_code),
+            [(r['insurance_provider'], r['icd_code']) for r in rows]
+        )
+        return counts
+
+def upsert_patients_bulk(patients):
+    '''
+    patients: list of dicts with add_patient's arguments
+    [{name, email, phone, disease, icd_code, doctor_id, insurance_provider}].
+    The patient id is generated the same way add_patient does it.
+    '''
+    rows = []
+    for p in patients:
+        rows.append({
+            'id': generate_patient_id(p['name'], p['email'], p['phone']),
+            'name': p['name'], 'email': p['email'], 'phone': p['phone'],
+            'disease': p['disease'], 'icd_code': p['icd_code'],
+            'assigned_doctor_id': _optional_int(p['doctor_id']),
+            'insurance_provider': p['insurance_provider'],
+        })
+    update_columns = ['name', 'email', 'phone', 'disease', 'icd_code', 'assigned_doctor_id', 'insurance_provider']
+    with session_scope() as session:
+        counts = _upsert_rows(session, Patient, rows, ['id'], update_columns)
+        _refresh_billing_summary_for_patients(session, [r['id'] for r in rows])
+        return counts
+
+def set_custom_rates_bulk(rates):
+    '''rates: list of dicts [{patient_id, doctor_id, icd_code, custom_rate}]'''
+    rows = [
+        {'patient_id': r['patient_id'], 'doctor_id': _optional_int(r['doctor_id']),
+         'icd_code': r['icd_code'], 'custom_rate': float(r['custom_rate'])}
+        for r in rates
+    ]
+    with session_scope() as session:
+        counts = _upsert_rows(session, PatientDoctorRate, rows, ['patient_id', 'doctor_id', 'icd_code'], ['custom_rate'])
+        _refresh_billing_summary_for_patients(session, [r['patient_id'] for r in rows])
+        return counts
+
+# Per-function timing and call counts, recorded only while instrumentation is enabled
+instrumentation.instrument_module(globals(), exclude=('session_scope',))
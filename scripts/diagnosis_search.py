@@ -0,0 +1,122 @@
+import argparse
+import os
+import re
+import sqlite3
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, 'diagnosis_codes.db')
+DEFAULT_EXCEL_PATH = os.path.join(DATA_DIR, 'diagnosis_codes.xlsx')
+
+RESULT_COLUMNS = ['Diagnosis Code', 'Diagnosis Name', 'Status']
+
+def _has_fts5(conn):
+    return conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0] == 1
+
+def build_search_index(conn):
+    '''
+    (Re)build the search index over the diagnosis_codes table of an open
+    connection: a NOCASE index on the code for exact/prefix code lookups and,
+    when SQLite has FTS5, a diagnosis_fts table for token/prefix text search.
+    '''
+    conn.execute('CREATE INDEX IF NOT EXISTS ix_diagnosis_code_nocase ON diagnosis_codes ("Diagnosis Code" COLLATE NOCASE)')
+    if _has_fts5(conn):
+        conn.execute('DROP TABLE IF EXISTS diagnosis_fts')
+        # '.' is part of a token so codes such as "S80.01XS" stay whole
+        conn.execute(
+            "CREATE VIRTUAL TABLE diagnosis_fts USING fts5("
+            "code, name, status, prefix='2 3', tokenize=\"unicode61 tokenchars '.'\")"
+        )
+        conn.execute(
+            'INSERT INTO diagnosis_fts (rowid, code, name, status) '
+            'SELECT rowid, "Diagnosis Code", "Diagnosis Name", "Status" FROM diagnosis_codes'
+        )
+    conn.commit()
+
+def write_diagnosis_db(df, db_path):
+    '''Replace the diagnosis_codes table in db_path with df and index it for search.'''
+    conn = sqlite3.connect(db_path)
+    try:
+        df.to_sql('diagnosis_codes', conn, if_exists='replace', index=False)
+        build_search_index(conn)
+    finally:
+        conn.close()
+
+def _index_exists(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'ix_diagnosis_code_nocase'"
+    ).fetchone() is not None
+
+def _like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def diagnosis_db_version(db_path=DEFAULT_DB_PATH):
+    '''(mtime_ns, size) of the diagnosis database, or None if it does not exist; changes when it is rewritten.'''
+    try:
+        stat = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def search_diagnosis(query, limit=20, db_path=DEFAULT_DB_PATH):
+    '''
+    Search diagnosis codes by code prefix and by description/status tokens
+    (each token may be a prefix, all must match). Exact code matches rank
+    first, then code prefix matches, then text matches by relevance.
+    Returns a DataFrame with RESULT_COLUMNS.
+    '''
+    query = query.strip()
+    if not os.path.exists(db_path) and db_path == DEFAULT_DB_PATH and os.path.exists(DEFAULT_EXCEL_PATH):
+        # Only the Excel export is checked in; build the database from it once
+        write_diagnosis_db(pd.read_excel(DEFAULT_EXCEL_PATH, dtype=str), db_path)
+    if not query or not os.path.exists(db_path):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    conn = sqlite3.connect(db_path)
+    try:
+        if not _index_exists(conn):
+            build_search_index(conn)
+        # Exact and prefix code matches, straight off the NOCASE index
+        rows = conn.execute(
+            'SELECT rowid, "Diagnosis Code", "Diagnosis Name", "Status" FROM diagnosis_codes '
+            "WHERE \"Diagnosis Code\" LIKE ? ESCAPE '\\' "
+            'ORDER BY "Diagnosis Code" = ? COLLATE NOCASE DESC, length("Diagnosis Code"), "Diagnosis Code" '
+            'LIMIT ?',
+            (_like_escape(query) + '%', query, limit)
+        ).fetchall()
+        seen = {r[0] for r in rows}
+        tokens = [t for t in re.split(r'[^\w.]+', query) if t]
+        if len(rows) < limit and tokens and _has_fts5(conn):
+            match = ' '.join(f'"{t}"*' for t in tokens)
+            text_rows = conn.execute(
+                'SELECT rowid, code, name, status FROM diagnosis_fts WHERE diagnosis_fts MATCH ? '
+                'ORDER BY bm25(diagnosis_fts) LIMIT ?',
+                (match, limit + len(seen))
+            ).fetchall()
+            rows += [r for r in text_rows if r[0] not in seen][:limit - len(rows)]
+        elif len(rows) < limit:
+            # No FTS5: fall back to a substring scan of the description
+            pattern = '%' + _like_escape(query) + '%'
+            text_rows = conn.execute(
+                'SELECT rowid, "Diagnosis Code", "Diagnosis Name", "Status" FROM diagnosis_codes '
+                "WHERE \"Diagnosis Name\" LIKE ? ESCAPE '\\' LIMIT ?",
+                (pattern, limit + len(seen))
+            ).fetchall()
+            rows += [r for r in text_rows if r[0] not in seen][:limit - len(rows)]
+    finally:
+        conn.close()
+    return pd.DataFrame([r[1:] for r in rows], columns=RESULT_COLUMNS)
+
+def main():
+    parser = argparse.ArgumentParser(description='Search the diagnosis code table by code or description.')
+    parser.add_argument('query', nargs='+')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    args = parser.parse_args()
+    results = search_diagnosis(' '.join(args.query), args.limit, args.db)
+    if results.empty:
+        print("No results found.")
+    else:
+        print(results.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import smtplib
+from email.message import EmailMessage
+try:
+    from scripts import db_utils
+    from scripts.render_statements import MANIFEST_NAME, statement_filename
+except ImportError:
+    import db_utils
+    from render_statements import MANIFEST_NAME, statement_filename
+
+DOCX_MIME = ('application', 'vnd.openxmlformats-officedocument.wordprocessingml.document')
+
+def smtp_settings(host=None, port=None, user=None, password=None, starttls=None, sender=None):
+    '''SMTP settings from the arguments, falling back to the SMTP_* environment variables.'''
+    env = os.environ.get
+    return {
+        'host': host or env('SMTP_HOST', 'localhost'),
+        'port': int(port or env('SMTP_PORT', 25)),
+        'user': user or env('SMTP_USER'),
+        'password': password or env('SMTP_PASSWORD'),
+        'starttls': starttls if starttls is not None else env('SMTP_STARTTLS', '') == '1',
+        'sender': sender or env('SMTP_FROM', 'billing@localhost'),
+    }
+
+def build_message(sender, recipient, patient_name, statement_path):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg['Subject'] = 'Your billing statement'
+    msg.set_content(f"Dear {patient_name},\n\nPlease find your billing statement attached.\n")
+    with open(statement_path, 'rb') as f:
+        msg.add_attachment(f.read(), maintype=DOCX_MIME[0], subtype=DOCX_MIME[1],
+                           filename=os.path.basename(statement_path))
+    return msg
+
+def _in_thread(func, *args):
+    '''asyncio.to_thread for Python 3.8: run func in the default executor with a copy of the current context.'''
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(None, context.run, func, *args)
+
+# --- SMTP connection pool ---
+class SmtpPool:
+    '''
+    Up to `size` open smtplib connections, reused across messages. smtplib is
+    blocking, so connecting and sending run in worker threads (_in_thread).
+    A connection that raised is closed and replaced on next use.
+    '''
+    def __init__(self, settings, size=2, timeout=30):
+        self.settings = settings
+        self.timeout = timeout
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(None)  # None: slot without an open connection yet
+
+    def _connect(self):
+        s = self.settings
+        conn = smtplib.SMTP(s['host'], s['port'], timeout=self.timeout)
+        if s['starttls']:
+            conn.starttls()
+        if s['user']:
+            conn.login(s['user'], s['password'])
+        return conn
+
+    async def send(self, msg):
+        conn = await self._idle.get()
+        try:
+            if conn is None:
+                conn = await _in_thread(self._connect)
+            await _in_thread(conn.send_message, msg)
+        except BaseException:
+            if conn is not None:
+                await _in_thread(_close_quietly, conn)
+            self._idle.put_nowait(None)
+            raise
+        self._idle.put_nowait(conn)
+
+    async def close(self):
+        while not self._idle.empty():
+            conn = self._idle.get_nowait()
+            if conn is not None:
+                await _in_thread(_close_quietly, conn)
+
+def _close_quietly(conn):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+
+def _is_permanent(error):
+    # 5xx replies (bad recipient, rejected message) will not succeed on retry
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and code >= 500
+
+async def _send_with_retry(pool, msg, retries, backoff):
+    '''Send msg, retrying transient failures with exponential backoff. Returns the attempt count.'''
+    for attempt in range(1, retries + 1):
+        try:
+            await pool.send(msg)
+            return attempt
+        except (smtplib.SMTPException, OSError) as e:
+            if attempt == retries or _is_permanent(e):
+                e.attempts = attempt
+                raise
+            await asyncio.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random() / 2))
+
+# --- Dispatch queue ---
+def pending_statements(statements_dir, retry_unconfirmed=False):
+    '''
+    Jobs for every rendered statement not yet emailed: dicts with patient_id,
+    statement_hash, recipient, name and path. The hash comes from the
+    render_statements manifest, so a re-rendered statement is sent again.
+
+    A statement left 'sending' by an interrupted run may already have been
+    delivered, so it is only included with retry_unconfirmed=True.
+    '''
+    manifest_path = os.path.join(statements_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    skip = {'sent'} if retry_unconfirmed else {'sent', 'sending'}
+    status = db_utils.get_statement_send_status()
+    jobs = []
+    unconfirmed = 0
+    for p in db_utils.get_patients():
+        digest = manifest.get(p['id'])
+        path = os.path.join(statements_dir, statement_filename(p['id']))
+        if digest is None or not p['email'] or not os.path.exists(path):
+            continue
+        if status.get((p['id'], digest)) in skip:
+            unconfirmed += status[(p['id'], digest)] == 'sending'
+            continue
+        jobs.append({'patient_id': p['id'], 'statement_hash': digest, 'recipient': p['email'],
+                     'name': p['name'], 'path': path})
+    if unconfirmed:
+        print(f"Skipping {unconfirmed} statement(s) an interrupted run may already have sent "
+              f"(use --retry-unconfirmed to send them again).")
+    return jobs
+
+async def dispatch_statements(jobs, settings, pool_size=2, concurrency=8, retries=3, backoff=1.0):
+    '''
+    Email every job (see pending_statements) through a shared SmtpPool.
+
+    `concurrency` workers take jobs off an asyncio queue; at most pool_size
+    messages are on the wire at once. Each statement is logged as 'sending'
+    before it goes to the SMTP server and as 'sent' or 'failed' once the
+    outcome is known, so an interrupted run can be restarted without sending
+    anything twice. A statement that cannot be read counts as failed.
+    Returns {'sent': n, 'failed': {patient_id: error}}.
+    '''
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    pool = SmtpPool(settings, size=pool_size)
+    result = {'sent': 0, 'failed': {}}
+
+    async def record(job, status, attempts, error=None):
+        await _in_thread(db_utils.record_statement_send, job['patient_id'], job['statement_hash'],
+                         job['recipient'], status, attempts, error)
+
+    async def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                msg = await _in_thread(build_message, settings['sender'], job['recipient'], job['name'],
+                                       job['path'])
+                await record(job, 'sending', 0)
+                attempts = await _send_with_retry(pool, msg, retries, backoff)
+            except (smtplib.SMTPException, OSError) as e:
+                # OSError also covers a statement file that went missing or is unreadable
+                result['failed'][job['patient_id']] = str(e)
+                await record(job, 'failed', getattr(e, 'attempts', 0), str(e))
+                print(f"Failed to email statement to {job['recipient']}: {e}")
+            else:
+                result['sent'] += 1
+                await record(job, 'sent', attempts)
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, min(concurrency, len(jobs))))])
+    finally:
+        await pool.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Email rendered billing statements to patients.')
+    parser.add_argument('--statements-dir', default='statements', help='Output directory of render_statements.py')
+    parser.add_argument('--host', help='SMTP host (default: $SMTP_HOST or localhost)')
+    parser.add_argument('--port', type=int, help='SMTP port (default: $SMTP_PORT or 25)')
+    parser.add_argument('--sender', help='From address (default: $SMTP_FROM)')
+    parser.add_argument('--starttls', action='store_true', default=None)
+    parser.add_argument('--pool-size', type=int, default=2, help='SMTP connections kept open')
+    parser.add_argument('--concurrency', type=int, default=8, help='Messages being prepared/sent at once')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=1.0, help='Initial retry delay in seconds')
+    parser.add_argument('--retry-unconfirmed', action='store_true',
+                        help='Also send statements an interrupted run left in the sending state (may send twice)')
+    args = parser.parse_args()
+
+    jobs = pending_statements(args.statements_dir, args.retry_unconfirmed)
+    if not jobs:
+        print("No statements to send.")
+        return
+    settings = smtp_settings(args.host, args.port, sender=args.sender, starttls=args.starttls)
+    result = asyncio.run(dispatch_statements(jobs, settings, args.pool_size, args.concurrency, args.retries, args.backoff))
+    print(f"Sent {result['sent']} statement(s), {len(result['failed'])} failed.")
+    if result['failed']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
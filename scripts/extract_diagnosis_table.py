@@ -1,77 +1,253 @@
 import pdfplumber
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
 import pandas as pd
-import sqlite3
 import os
-
 import re
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+try:
+    from scripts.diagnosis_search import DATA_DIR, search_diagnosis, write_diagnosis_db
+except ImportError:
+    from diagnosis_search import DATA_DIR, search_diagnosis, write_diagnosis_db
+
+# Code at start, then description, then owner, discontinued, modified, icd10 (all optional)
+DIAGNOSIS_LINE_RE = re.compile(r"^(\S+)\s+(.+?)\s+[A-Z]\s+([0-9/\-]*)\s*([0-9/\-]*)\s*[A-Z0-9]*$")
+
+DIAGNOSIS_COLUMNS = ['Diagnosis Code', 'Diagnosis Name', 'Status']
+
+DEFAULT_CACHE_DIR = os.path.join(DATA_DIR, 'diagnosis_cache')
+
+def _parse_page_text(text):
+    rows = []
+    for line in text.split('\n') if text else []:
+        match = DIAGNOSIS_LINE_RE.match(line)
+        if match:
+            code, desc, discontinued, _ = match.groups()[:4]
+            status = 'Active' if not discontinued else 'Discontinued'
+            rows.append({
+                'Diagnosis Code': code.strip(),
+                'Diagnosis Name': desc.strip(),
+                'Status': status
+            })
+    return rows
 
-def extract_diagnosis_table(pdf_path):
-    data = []
+def _extract_pages(pdf_path, page_numbers):
+    '''Worker: {page number: rows} for the given 1-based page numbers.'''
     with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, 1):
-            print(f"Processing page {page_num}...")
-            text = page.extract_text()
-            if not text:
-                continue
-            lines = text.split('\n')
-            for line in lines:
-                # Regex: code at start, then description, then owner, discontinued, modified, icd10 (all optional)
-                match = re.match(r"^(\S+)\s+(.+?)\s+[A-Z]\s+([0-9/\-]*)\s*([0-9/\-]*)\s*[A-Z0-9]*$", line)
-                if match:
-                    code, desc, discontinued, _ = match.groups()[:4]
-                    status = 'Active' if not discontinued else 'Discontinued'
-                    data.append({
-                        'Diagnosis Code': code.strip(),
-                        'Diagnosis Name': desc.strip(),
-                        'Status': status
-                    })
-    return pd.DataFrame(data)
+        return {n: _parse_page_text(pdf.pages[n - 1].extract_text()) for n in page_numbers}
+
+# --- Per-page cache ---
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _object_digest(obj, memo):
+    '''
+    SHA-256 of a PDF object and everything it references (fonts with their
+    ToUnicode maps and font files, form XObjects, images). Indirect objects
+    are hashed once per document: memo maps object id -> digest.
+    '''
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in memo:
+            memo[obj.objid] = b'cycle'  # seen again while it is still being hashed
+            memo[obj.objid] = _object_digest(obj.resolve(), memo)
+        return memo[obj.objid]
+    digest = hashlib.sha256()
+    if isinstance(obj, PDFStream):
+        digest.update(b'stream' + _object_digest(obj.attrs, memo))
+        # Encoded bytes where still available: cheaper than decoding, as good for a hash
+        raw = obj.get_rawdata()
+        digest.update(raw if raw is not None else obj.get_data())
+    elif isinstance(obj, dict):
+        digest.update(b'dict')
+        for key in sorted(obj, key=str):
+            digest.update(str(key).encode() + _object_digest(obj[key], memo))
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b'list')
+        for item in obj:
+            digest.update(_object_digest(item, memo))
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+def _page_keys(pdf_path):
+    '''
+    Cache key of every page: its number plus a hash of its content streams
+    and of its resources, so a revision that only changes fonts or ToUnicode
+    maps (and so the extracted text) gets new keys. Reading the raw objects is
+    far cheaper than text extraction, and pages that did not change between
+    two versions of the PDF keep their key.
+    '''
+    keys = []
+    memo = {}
+    with pdfplumber.open(pdf_path) as pdf:
+        for n, page in enumerate(pdf.pages, 1):
+            digest = hashlib.sha256(str(n).encode())
+            contents = page.page_obj.contents
+            for stream in contents if isinstance(contents, list) else [contents]:
+                if stream is not None:
+                    digest.update(resolve1(stream).get_data())
+            digest.update(_object_digest(page.page_obj.resources, memo))
+            keys.append(f"{n:05d}-{digest.hexdigest()}")
+    return keys
+
+def _write_json(data, path):
+    # Temp file plus rename, so an interrupted run never leaves a torn entry
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# One index per PDF version, named after its SHA-256: {'path': ..., 'pages': [page keys]}
+PDF_INDEX_RE = re.compile(r'^[0-9a-f]{64}\.json$')
+
+def _read_pdf_index(path):
+    index = _read_json(path)
+    # Indexes written before they recorded the PDF path were plain key lists
+    return index if isinstance(index, dict) else None
+
+def prune_cache(cache_dir=DEFAULT_CACHE_DIR, pdf_path=None, keep=None):
+    '''
+    Remove the indexes of PDFs that no longer exist and, given pdf_path, of
+    its earlier versions (every index of that path except the file named
+    keep), then every cached page no remaining index refers to. Returns the
+    number of pages removed.
+    '''
+    pdf_path = os.path.abspath(pdf_path) if pdf_path else None
+    live_keys = set()
+    for name in os.listdir(cache_dir):
+        if not PDF_INDEX_RE.match(name):
+            continue
+        index_path = os.path.join(cache_dir, name)
+        index = _read_pdf_index(index_path)
+        if name != keep and (index is None or index['path'] == pdf_path or not os.path.exists(index['path'])):
+            os.remove(index_path)
+            continue
+        live_keys.update(index['pages'])
+    pages_dir = os.path.join(cache_dir, 'pages')
+    removed = 0
+    for name in os.listdir(pages_dir) if os.path.isdir(pages_dir) else []:
+        if name[:-len('.json')] not in live_keys:
+            os.remove(os.path.join(pages_dir, name))
+            removed += 1
+    return removed
+
+def extract_diagnosis_table(pdf_path, workers=None, cache_dir=DEFAULT_CACHE_DIR, pages_per_chunk=20):
+    '''
+    Extract the diagnosis table from pdf_path, reusing per-page results cached
+    in cache_dir. A PDF seen before (same SHA-256) is served from the cache
+    without opening it; otherwise only pages whose content or resources
+    changed are re-parsed, in a process pool of `workers` processes. Cached
+    pages of earlier versions of the PDF, or of deleted PDFs, are pruned.
+    '''
+    pages_dir = os.path.join(cache_dir, 'pages')
+    os.makedirs(pages_dir, exist_ok=True)
+    index_name = _file_sha256(pdf_path) + '.json'
+    pdf_index_path = os.path.join(cache_dir, index_name)
+    index = _read_pdf_index(pdf_index_path) if os.path.exists(pdf_index_path) else None
+    keys = index['pages'] if index else _page_keys(pdf_path)
+
+    pages = {}
+    missing = []
+    for n, key in enumerate(keys, 1):
+        page_path = os.path.join(pages_dir, key + '.json')
+        if os.path.exists(page_path):
+            pages[n] = _read_json(page_path)
+        else:
+            missing.append(n)
+    if missing:
+        print(f"Parsing {len(missing)} of {len(keys)} pages ({len(keys) - len(missing)} cached)...")
+        chunks = [missing[i:i + pages_per_chunk] for i in range(0, len(missing), pages_per_chunk)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(_extract_pages, repeat(pdf_path), chunks):
+                for n, rows in result.items():
+                    _write_json(rows, os.path.join(pages_dir, keys[n - 1] + '.json'))
+                    pages[n] = rows
+    else:
+        print(f"All {len(keys)} pages served from cache.")
+    _write_json({'path': os.path.abspath(pdf_path), 'pages': keys}, pdf_index_path)
+    removed = prune_cache(cache_dir, pdf_path, keep=index_name)
+    if removed:
+        print(f"Pruned {removed} stale cached page(s).")
+    return pd.DataFrame([row for n in sorted(pages) for row in pages[n]], columns=DIAGNOSIS_COLUMNS)
+
+# --- Outputs ---
+def table_digest(df):
+    return hashlib.sha256(df.to_json(orient='values').encode('utf-8')).hexdigest()
+
+def output_is_current(path, digest, cache_dir=DEFAULT_CACHE_DIR):
+    '''True if path still holds the table with this digest, as recorded by mark_output_written.'''
+    state_path = os.path.join(cache_dir, 'outputs.json')
+    if not os.path.exists(path) or not os.path.exists(state_path):
+        return False
+    entry = _read_json(state_path).get(os.path.abspath(path))
+    return entry == {'digest': digest, 'mtime': os.path.getmtime(path)}
 
+def mark_output_written(path, digest, cache_dir=DEFAULT_CACHE_DIR):
+    state_path = os.path.join(cache_dir, 'outputs.json')
+    state = _read_json(state_path) if os.path.exists(state_path) else {}
+    state[os.path.abspath(path)] = {'digest': digest, 'mtime': os.path.getmtime(path)}
+    _write_json(state, state_path)
 
 def save_to_sqlite(df, db_path):
-    conn = sqlite3.connect(db_path)
-    df.to_sql('diagnosis_codes', conn, if_exists='replace', index=False)
-    conn.close()
+    write_diagnosis_db(df, db_path)
 
 def save_to_excel(df, excel_path):
     df.to_excel(excel_path, index=False)
 
-def search_cli(df):
+def search_cli(db_path, limit=20):
     print("\nDiagnosis Table Search CLI")
     while True:
         query = input("\nEnter code/description/status to search (or 'exit' to quit): ").strip()
         if query.lower() == 'exit':
             break
-        mask = (
-            df['Diagnosis Code'].str.contains(query, case=False, na=False) |
-            df['Diagnosis Name'].str.contains(query, case=False, na=False) |
-            df['Status'].str.contains(query, case=False, na=False)
-        )
-        results = df[mask]
+        results = search_diagnosis(query, limit, db_path)
         if results.empty:
             print("No results found.")
         else:
             print(results.to_string(index=False))
 
 def main():
-    pdf_path = 'diagnosistable.pdf'
-    db_path = 'diagnosis_codes.db'
-    excel_path = 'diagnosis_codes.xlsx'
+    parser = argparse.ArgumentParser(description='Extract the diagnosis code table from a PDF.')
+    parser.add_argument('pdf_path', nargs='?', default=os.path.join(DATA_DIR, 'diagnosistable.pdf'))
+    parser.add_argument('--workers', type=int, default=None, help='Processes for page parsing (default: CPU count)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--no-search', action='store_true', help='Exit instead of starting the search prompt')
+    args = parser.parse_args()
+    pdf_path = args.pdf_path
+    db_path = os.path.join(DATA_DIR, 'diagnosis_codes.db')
+    excel_path = os.path.join(DATA_DIR, 'diagnosis_codes.xlsx')
 
     if not os.path.exists(pdf_path):
         print(f"PDF file not found: {pdf_path}")
         return
 
-    df = extract_diagnosis_table(pdf_path)
+    df = extract_diagnosis_table(pdf_path, workers=args.workers, cache_dir=args.cache_dir)
     if df.empty:
         print("No diagnosis codes extracted.")
         return
 
-    save_to_sqlite(df, db_path)
-    save_to_excel(df, excel_path)
     print(f"Extracted {len(df)} diagnosis codes.")
-    print(f"Saved to {db_path} and {excel_path}.")
-    search_cli(df)
+    digest = table_digest(df)
+    for path, save in ((db_path, save_to_sqlite), (excel_path, save_to_excel)):
+        if output_is_current(path, digest, args.cache_dir):
+            print(f"{path} is up to date.")
+            continue
+        save(df, path)
+        mark_output_written(path, digest, args.cache_dir)
+        print(f"Saved to {path}.")
+    if not args.no_search:
+        search_cli(db_path)
 
 if __name__ == '__main__':
     main()
@@ -2,57 +2,295 @@ import pdfplumber
 import pandas as pd
 import re
 import os
+import csv
 import json
+import argparse
+import contextlib
+import hashlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import deque
+from itertools import islice
+try:
+    from scripts.columnar_export import BATCH_EOB_COLUMN_TYPES, EOB_COLUMN_TYPES, ColumnarWriter
+except ImportError:
+    from columnar_export import BATCH_EOB_COLUMN_TYPES, EOB_COLUMN_TYPES, ColumnarWriter
 
-def extract_eob_data(pdf_path):
-    data = []
-    patient_name = None
-    patient_id = None
+PATIENT_NAME_RE = re.compile(r'Patient:\s*([\w\-, ]+)')
+PATIENT_ID_RE = re.compile(r'Insured ID #:\s*(\w+)')
+CPT_LINE_RE = re.compile(r'([A-Z0-9,]+)\s+(\d+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+([A-Z0-9]+)')
+SERVICE_DATE_RE = re.compile(r'(\d{2}/\d{2}/\d{4}) to (\d{2}/\d{2}/\d{4})')
+
+EOB_COLUMNS = [
+    'Patient Name', 'Patient ID', 'CPT Code', 'Units', 'Service Date',
+    'Amount Billed', 'Amount Paid', 'Patient Responsibility', 'Denial Code'
+]
+
+def _parse_page(lines, state):
+    '''
+    Yield the line items on one page. state holds the patient name and ID,
+    which are taken from their first occurrence and carried across pages.
+    '''
+    for i, line in enumerate(lines):
+        # Search Patient by name
+        if not state['Patient Name']:
+            m = PATIENT_NAME_RE.search(line)
+            if m:
+                state['Patient Name'] = m.group(1).strip()
+        # Search Patient by ID
+        if not state['Patient ID']:
+            m = PATIENT_ID_RE.search(line)
+            if m:
+                state['Patient ID'] = m.group(1).strip()
+        # CPT code line
+        m = CPT_LINE_RE.match(line)
+        if m:
+            # Next line is service date (optional)
+            service_date = ''
+            if i+1 < len(lines):
+                date_match = SERVICE_DATE_RE.match(lines[i+1])
+                if date_match:
+                    service_date = date_match.group(0)
+            yield {
+                'Patient Name': state['Patient Name'],
+                'Patient ID': state['Patient ID'],
+                'CPT Code': m.group(1),
+                'Units': m.group(2),
+                'Service Date': service_date,
+                'Amount Billed': m.group(3),
+                'Amount Paid': m.group(6),
+                'Patient Responsibility': m.group(5),
+                'Denial Code': m.group(10)
+            }
+
+def _iter_pages(pdf, start=0, stop=None):
+    for page in pdf.pages[start:stop]:
+        text = page.extract_text()
+        if text:
+            yield text.split('\n')
+
+def _extract_page_range(pdf_path, page_range):
+    '''Worker: parse pages [start, stop) starting from an empty patient state.'''
+    start, stop = page_range
+    state = {'Patient Name': None, 'Patient ID': None}
     with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, 1):
-            text = page.extract_text()
-            if not text:
-                continue
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
-                # Search Patient by name
-                if not patient_name:
-                    m = re.search(r'Patient:\s*([\w\-, ]+)', line)
-                    if m:
-                        patient_name = m.group(1).strip()
-                # Search Patient by ID
-                if not patient_id:
-                    m = re.search(r'Insured ID #:\s*(\w+)', line)
-                    if m:
-                        patient_id = m.group(1).strip()
-                # CPT code line
-                m = re.match(r'([A-Z0-9,]+)\s+(\d+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+\$([\d,.]+)\s+([A-Z0-9]+)', line)
-                if m:
-                    cpt = m.group(1)
-                    units = m.group(2)
-                    billed = m.group(3)
-                    allowed = m.group(4)
-                    paid = m.group(6)
-                    patient_resp = m.group(5)
-                    denial_code = m.group(10)
-                    # Next line is service date (optional)
-                    service_date = ''
-                    if i+1 < len(lines):
-                        date_match = re.match(r'(\d{2}/\d{2}/\d{4}) to (\d{2}/\d{2}/\d{4})', lines[i+1])
-                        if date_match:
-                            service_date = date_match.group(0)
-                    data.append({
-                        'Patient Name': patient_name,
-                        'Patient ID': patient_id,
-                        'CPT Code': cpt,
-                        'Units': units,
-                        'Service Date': service_date,
-                        'Amount Billed': billed,
-                        'Amount Paid': paid,
-                        'Patient Responsibility': patient_resp,
-                        'Denial Code': denial_code
-                    })
-    return pd.DataFrame(data)
+        items = [item for lines in _iter_pages(pdf, start, stop) for item in _parse_page(lines, state)]
+    return items, state
+
+def iter_eob_line_items(pdf_path, workers=1, pages_per_chunk=50):
+    '''
+    Yield EOB line items (dicts keyed by EOB_COLUMNS) page by page.
+
+    With workers > 1, ranges of pages_per_chunk pages are parsed in a
+    process pool, at most 2 * workers ranges ahead of the consumer. Each
+    range starts without a patient name/ID; results are consumed in page
+    order and the values found in earlier ranges are applied to later ones,
+    so the output matches a sequential run.
+    '''
+    if workers <= 1:
+        state = {'Patient Name': None, 'Patient ID': None}
+        with pdfplumber.open(pdf_path) as pdf:
+            for lines in _iter_pages(pdf):
+                yield from _parse_page(lines, state)
+        return
+
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+    ranges = ((start, min(start + pages_per_chunk, page_count)) for start in range(0, page_count, pages_per_chunk))
+    carried = {'Patient Name': None, 'Patient ID': None}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # At most 2 * workers ranges are in flight or waiting to be yielded, so
+        # memory stays bounded however many pages the PDF has
+        pending = deque(pool.submit(_extract_page_range, pdf_path, r) for r in islice(ranges, 2 * workers))
+        while pending:
+            items, chunk_state = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(_extract_page_range, pdf_path, next_range))
+            for item in items:
+                for key, value in carried.items():
+                    if value:
+                        item[key] = value
+                yield item
+            for key, value in chunk_state.items():
+                if not carried[key]:
+                    carried[key] = value
+
+def extract_eob_data(pdf_path, workers=1):
+    return pd.DataFrame(list(iter_eob_line_items(pdf_path, workers=workers)), columns=EOB_COLUMNS)
+
+def write_csv_and_jsonl(items, base_filename, columnar=None):
+    '''
+    Write line items to <base>.csv and <base>.jsonl as they arrive. With
+    columnar='parquet' or 'arrow', also to a typed <base>.parquet/.arrow
+    (numeric amounts, dictionary-encoded codes; needs pyarrow). Returns the item count.
+    '''
+    csv_path = base_filename + '.csv'
+    jsonl_path = base_filename + '.jsonl'
+    count = 0
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file, \
+            open(jsonl_path, 'w', encoding='utf-8') as jsonl_file, \
+            _columnar_writer(base_filename, columnar, EOB_COLUMN_TYPES) as columnar_writer:
+        writer = csv.DictWriter(csv_file, fieldnames=EOB_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for item in items:
+            writer.writerow(item)
+            jsonl_file.write(json.dumps(item) + '\n')
+            if columnar_writer is not None:
+                columnar_writer.write(item)
+            count += 1
+    return count
+
+def _columnar_writer(base_filename, columnar, column_types):
+    if columnar is None:
+        return contextlib.nullcontext()
+    return ColumnarWriter(f"{base_filename}.{columnar}", column_types)
+
+# --- Batch ingestion of a directory of EOB PDFs ---
+MANIFEST_NAME = 'eob_manifest.json'
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_manifest(manifest, path):
+    # Written to a temp file and renamed, so a crash never leaves half a manifest
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _extract_to_part(pdf_path, part_base):
+    '''Worker: extract one PDF to <part_base>.csv/.jsonl, renamed into place only when complete.'''
+    tmp_base = part_base + '.tmp'
+    try:
+        count = write_csv_and_jsonl(iter_eob_line_items(pdf_path), tmp_base)
+    except Exception:
+        for ext in ('.csv', '.jsonl'):
+            if os.path.exists(tmp_base + ext):
+                os.remove(tmp_base + ext)
+        raise
+    os.replace(tmp_base + '.csv', part_base + '.csv')
+    os.replace(tmp_base + '.jsonl', part_base + '.jsonl')
+    return count
+
+def _remove_if_exists(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def _prune_manifest(manifest, current, output_dir):
+    '''
+    Keep only the manifest entries of content still in the input directory.
+    current maps digest -> names of the files with that content. Entries of
+    edited or removed files are dropped together with their parts and error
+    files; the others follow renames.
+    '''
+    current_names = {name for names in current.values() for name in names}
+    for digest in [d for d in manifest if d not in current]:
+        entry = manifest.pop(digest)
+        print(f"Dropping results for {entry['file']} (changed or removed)")
+        for ext in ('.csv', '.jsonl'):
+            _remove_if_exists(os.path.join(output_dir, 'parts', digest + ext))
+        if entry['file'] not in current_names:
+            _remove_if_exists(os.path.join(output_dir, 'errors', entry['file'] + '.txt'))
+    for digest, entry in manifest.items():
+        if entry['file'] not in current[digest]:
+            _remove_if_exists(os.path.join(output_dir, 'errors', entry['file'] + '.txt'))
+            entry['file'] = current[digest][0]
+
+def _merge_parts(manifest, output_dir, base_name, columnar=None):
+    '''Concatenate every finished part into <base>.csv/.jsonl (and .parquet/.arrow) with a Source File column.'''
+    columns = ['Source File'] + EOB_COLUMNS
+    done = sorted((entry['file'], digest) for digest, entry in manifest.items() if entry['status'] == 'done')
+    base = os.path.join(output_dir, base_name)
+    with open(base + '.csv', 'w', newline='', encoding='utf-8') as csv_file, \
+            open(base + '.jsonl', 'w', encoding='utf-8') as jsonl_file, \
+            _columnar_writer(base, columnar, BATCH_EOB_COLUMN_TYPES) as columnar_writer:
+        writer = csv.DictWriter(csv_file, fieldnames=columns, lineterminator='\n')
+        writer.writeheader()
+        for file_name, digest in done:
+            with open(os.path.join(output_dir, 'parts', digest + '.jsonl'), encoding='utf-8') as part:
+                for line in part:
+                    item = {'Source File': file_name, **json.loads(line)}
+                    writer.writerow(item)
+                    jsonl_file.write(json.dumps(item) + '\n')
+                    if columnar_writer is not None:
+                        columnar_writer.write(item)
+
+def extract_eob_directory(input_dir, output_dir, workers=4, base_name='eob_data', columnar=None):
+    '''
+    Extract every PDF in input_dir with a process pool.
+
+    Each file is keyed by the SHA-256 of its content in output_dir/eob_manifest.json,
+    which is rewritten after every file. Files already marked done are skipped,
+    so a rerun (or a restart after a crash) only processes new, changed or
+    previously failed files; results of files that were since edited or removed
+    are dropped. Per-file results live in output_dir/parts/, failures
+    are written to output_dir/errors/<file>.txt, and all finished parts are merged
+    into <base_name>.csv and <base_name>.jsonl (plus <base_name>.parquet or
+    .arrow with columnar='parquet'/'arrow'). Returns the manifest.
+    '''
+    parts_dir = os.path.join(output_dir, 'parts')
+    errors_dir = os.path.join(output_dir, 'errors')
+    os.makedirs(parts_dir, exist_ok=True)
+    os.makedirs(errors_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+
+    digests = {}
+    for file_name in sorted(os.listdir(input_dir)):
+        pdf_path = os.path.join(input_dir, file_name)
+        if file_name.lower().endswith('.pdf') and os.path.isfile(pdf_path):
+            digests[file_name] = file_sha256(pdf_path)
+    current = {}
+    for file_name, digest in digests.items():
+        current.setdefault(digest, []).append(file_name)
+    _prune_manifest(manifest, current, output_dir)
+    _save_manifest(manifest, manifest_path)
+
+    pending = {}
+    for file_name, digest in digests.items():
+        pdf_path = os.path.join(input_dir, file_name)
+        entry = manifest.get(digest)
+        if entry and entry['status'] == 'done':
+            print(f"Skipping {file_name} (already processed as {entry['file']})")
+            continue
+        pending.setdefault(digest, (file_name, pdf_path))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_extract_to_part, pdf_path, os.path.join(parts_dir, digest)): (digest, file_name)
+                for digest, (file_name, pdf_path) in pending.items()
+            }
+            for future in as_completed(futures):
+                digest, file_name = futures[future]
+                error_path = os.path.join(errors_dir, file_name + '.txt')
+                try:
+                    count = future.result()
+                except Exception as e:
+                    with open(error_path, 'w', encoding='utf-8') as f:
+                        f.write(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+                    manifest[digest] = {'file': file_name, 'status': 'error', 'error': str(e)}
+                    print(f"Error processing {file_name}: {e}")
+                else:
+                    if os.path.exists(error_path):
+                        os.remove(error_path)
+                    manifest[digest] = {'file': file_name, 'status': 'done', 'items': count}
+                    print(f"Extracted {count} line items from {file_name}")
+                _save_manifest(manifest, manifest_path)
+
+    _merge_parts(manifest, output_dir, base_name, columnar)
+    return manifest
 
 def save_to_csv_and_json(df, base_filename):
     csv_path = base_filename + '.csv'
@@ -63,17 +301,38 @@ def save_to_csv_and_json(df, base_filename):
     print(f"Saved JSON to {json_path}")
 
 def main():
-    pdf_path = 'uhc eob.pdf'
-    base_filename = 'uhc_eob_data'
-    if not os.path.exists(pdf_path):
-        print(f"PDF file not found: {pdf_path}")
+    parser = argparse.ArgumentParser(description='Extract line items from an EOB PDF.')
+    parser.add_argument('pdf_path', nargs='?', default='uhc eob.pdf')
+    parser.add_argument('--output', default='uhc_eob_data', help='Output path without extension')
+    parser.add_argument('--workers', type=int, default=1, help='Processes to spread page ranges (or files) across')
+    parser.add_argument('--pages-per-chunk', type=int, default=50)
+    parser.add_argument('--batch-dir', help='Process every PDF in this directory instead of pdf_path')
+    parser.add_argument('--output-dir', default='eob_output', help='Batch mode: manifest, parts, errors and merged output')
+    parser.add_argument('--columnar', choices=['parquet', 'arrow'],
+                        help='Also write a typed Parquet or Arrow file (needs pyarrow)')
+    args = parser.parse_args()
+
+    if args.batch_dir:
+        manifest = extract_eob_directory(args.batch_dir, args.output_dir, workers=max(args.workers, 1),
+                                         columnar=args.columnar)
+        done = sum(1 for entry in manifest.values() if entry['status'] == 'done')
+        failed = sum(1 for entry in manifest.values() if entry['status'] == 'error')
+        print(f"{done} file(s) processed, {failed} failed. Merged output in {args.output_dir}.")
+        return
+
+    if not os.path.exists(args.pdf_path):
+        print(f"PDF file not found: {args.pdf_path}")
         return
-    df = extract_eob_data(pdf_path)
-    if df.empty:
+    items = iter_eob_line_items(args.pdf_path, workers=args.workers, pages_per_chunk=args.pages_per_chunk)
+    count = write_csv_and_jsonl(items, args.output, args.columnar)
+    if count == 0:
         print("No EOB data extracted.")
         return
-    print(f"Extracted {len(df)} EOB line items.")
-    save_to_csv_and_json(df, base_filename)
+    print(f"Extracted {count} EOB line items.")
+    print(f"Saved CSV to {args.output}.csv")
+    print(f"Saved JSON Lines to {args.output}.jsonl")
+    if args.columnar:
+        print(f"Saved {args.columnar.capitalize()} to {args.output}.{args.columnar}")
 
 if __name__ == '__main__':
     main()
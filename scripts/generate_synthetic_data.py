@@ -0,0 +1,185 @@
+import argparse
+import csv
+import random
+import numpy as np
+import pandas as pd
+try:
+    from scripts import billing_engine, db_utils
+    from scripts.db_models import configure_engine
+    from scripts.extract_eob_data import EOB_COLUMNS
+except ImportError:
+    import billing_engine
+    import db_utils
+    from db_models import configure_engine
+    from extract_eob_data import EOB_COLUMNS
+
+BATCH_SIZE = 5000
+
+# CPT/HCPCS codes the synthetic diagnoses are billed under: office visits,
+# an injection and drugs, as on a real remittance
+SYNTHETIC_CPT_CODES = ('99203', '99204', '99213', '99214', '99215', '96372', 'J0696', 'J1100')
+# Billed on no synthetic claim, for remittance lines that match nothing
+UNBILLED_CPT_CODE = '36415'
+
+def synthetic_member_id(i):
+    '''Nine-digit payer member ID ("Insured ID #") of the i-th synthetic patient.'''
+    return f"{100000000 + i:09d}"
+
+def synthetic_icd_codes(count):
+    '''ICD-10 style codes H00.0, H00.1, ... with a placeholder disease name each.'''
+    return [(f"H{i // 10:02d}.{i % 10}", f"DISEASE {i:04d}") for i in range(count)]
+
+def generate_synthetic_data(patients=10000, doctors=20, icd_codes=50, insurers=8,
+                            custom_rate_fraction=0.1, seed=0, batch_size=BATCH_SIZE):
+    '''
+    Fill the current database with reproducible synthetic data through the
+    db_utils bulk APIs (so the billing_summary table is kept current too).
+
+    Every doctor charges for about 90% of the ICD codes and every insurer
+    covers about 85% of them; patients get a random doctor, code and insurer,
+    and custom_rate_fraction of them a custom charge. Every ICD code is billed
+    under a CPT code and every patient has a member ID with their insurer, so
+    remittances can be reconciled. Returns the counts of each bulk call.
+    '''
+    rng = random.Random(seed)
+    codes = synthetic_icd_codes(icd_codes)
+    counts = {'procedure_codes': db_utils.upsert_procedure_codes_bulk([
+        # Picked by position, so the seeded draws below stay as they were
+        {'icd_code': icd, 'cpt_code': SYNTHETIC_CPT_CODES[i % len(SYNTHETIC_CPT_CODES)]}
+        for i, (icd, _) in enumerate(codes)
+    ])}
+    doctor_rows = [
+        {'name': f"Doctor {i:04d}", 'rates': [
+            {'icd_code': icd, 'disease': disease, 'default_rate': float(rng.randint(50, 500))}
+            for icd, disease in codes if rng.random() < 0.9
+        ]}
+        for i in range(doctors)
+    ]
+    counts['doctors'] = db_utils.add_doctors_bulk(doctor_rows)
+
+    providers = [f"Insurer {i:03d}" for i in range(insurers)]
+    counts['insurance_rates'] = db_utils.add_insurance_rates_bulk([
+        {'provider': provider, 'disease': disease, 'icd_code': icd, 'rate': round(rng.uniform(10, 300), 2)}
+        for provider in providers for icd, disease in codes if rng.random() < 0.85
+    ])
+
+    doctor_ids = [d['id'] for d in db_utils.get_doctors() if d['name'] in {r['name'] for r in doctor_rows}]
+    counts['patients'] = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    counts['custom_rates'] = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    counts['payer_members'] = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    for start in range(0, patients, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, patients)):
+            icd, disease = rng.choice(codes)
+            batch.append({
+                'name': f"Patient {i:07d}", 'email': f"patient{i}@example.com", 'phone': f"555{i:07d}",
+                'disease': disease, 'icd_code': icd, 'doctor_id': rng.choice(doctor_ids),
+                'insurance_provider': rng.choice(providers),
+            })
+        for key, value in db_utils.upsert_patients_bulk(batch).items():
+            counts['patients'][key] += value
+        members = [
+            {'insurance_provider': p['insurance_provider'], 'member_id': synthetic_member_id(i),
+             'patient_id': db_utils.generate_patient_id(p['name'], p['email'], p['phone'])}
+            for i, p in enumerate(batch, start)
+        ]
+        for key, value in db_utils.upsert_payer_members_bulk(members).items():
+            counts['payer_members'][key] += value
+        custom = [
+            {'patient_id': db_utils.generate_patient_id(p['name'], p['email'], p['phone']),
+             'doctor_id': p['doctor_id'], 'icd_code': p['icd_code'],
+             'custom_rate': float(rng.randint(50, 900))}
+            for p in batch if rng.random() < custom_rate_fraction
+        ]
+        if custom:
+            for key, value in db_utils.set_custom_rates_bulk(custom).items():
+                counts['custom_rates'][key] += value
+    return counts
+
+def synthetic_eob_claims():
+    '''
+    Billed claims as a payer sees them: patient name, member ID, the CPT code
+    the claim is billed under, the doctor charge and the insurer's share.
+    Claims without a member ID or CPT code are left out.
+    '''
+    claims = billing_engine.read_billing_summary()
+    members = pd.DataFrame(db_utils.get_payer_members(), columns=['Insurance Provider', 'Member ID', 'Patient ID'])
+    claims = claims.merge(members, on=['Insurance Provider', 'Patient ID'])
+    claims['CPT Code'] = claims['ICD Code'].map(db_utils.get_procedure_codes())
+    claims = claims.dropna(subset=['CPT Code']).drop_duplicates('Patient ID')
+    return claims[['Patient Name', 'Member ID', 'CPT Code', 'Doctor Charge', 'Insurance Pays']].reset_index(drop=True)
+
+def write_synthetic_eob(path, lines, seed=0, underpaid=0.05, denied=0.03, unmatched=0.02, chunk_size=100000):
+    '''
+    Write an extract_eob_data style CSV of `lines` remittance lines for random
+    billed claims in the current database, chunk by chunk. Lines carry the
+    patient's member ID and the claim's CPT code, with a ",25" modifier on
+    some office visits. The given fractions of lines are underpaid (80% of a
+    non-zero insurer share), denied (CO45, nothing paid) or match no claim
+    (alternately an unknown member ID and a CPT code billed on no claim); the
+    rest pay the insurer's share exactly. Returns the line count of each kind.
+    '''
+    claims = synthetic_eob_claims()
+    if claims.empty:
+        raise ValueError('No billed claims with a member ID and CPT code; run generate_synthetic_data first')
+    rng = np.random.default_rng(seed)
+    counts = {'lines': lines, 'underpaid': 0, 'denied': 0, 'unmatched': 0}
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(EOB_COLUMNS)
+        for start in range(0, lines, chunk_size):
+            n = min(chunk_size, lines - start)
+            sample = claims.iloc[rng.integers(0, len(claims), n)]
+            kind = rng.random(n)
+            paid = sample['Insurance Pays'].to_numpy().copy()
+            is_underpaid = (kind < underpaid) & (paid > 0)
+            is_denied = (kind >= underpaid) & (kind < underpaid + denied)
+            is_unmatched = (kind >= underpaid + denied) & (kind < underpaid + denied + unmatched)
+            paid[is_underpaid] = np.round(paid[is_underpaid] * 0.8, 2)
+            paid[is_denied] = 0.0
+            line_numbers = start + np.arange(n)
+            unknown_member = is_unmatched & (line_numbers % 2 == 0)
+            # Member IDs from 9 on are never handed out to synthetic patients
+            member_ids = np.where(unknown_member, np.char.add('9', (line_numbers % 10 ** 8).astype(str)),
+                                  sample['Member ID'].to_numpy(dtype=str))
+            cpt_codes = sample['CPT Code'].to_numpy(dtype=str)
+            with_modifier = np.char.startswith(cpt_codes, '99') & (rng.random(n) < 0.3)
+            cpt_codes = np.where(with_modifier, np.char.add(cpt_codes, ',25'), cpt_codes)
+            cpt_codes = np.where(is_unmatched & ~unknown_member, UNBILLED_CPT_CODE, cpt_codes)
+            billed = sample['Doctor Charge'].to_numpy()
+            writer.writerows(zip(
+                sample['Patient Name'], member_ids, cpt_codes, ['1'] * n,
+                ['01/25/2022 to 01/25/2022'] * n, [f"{v:,.2f}" for v in billed], [f"{v:,.2f}" for v in paid],
+                [f"{max(b - p, 0):,.2f}" for b, p in zip(billed, paid)], np.where(is_denied, 'CO45', 'PR1'),
+            ))
+            counts['underpaid'] += int(is_underpaid.sum())
+            counts['denied'] += int(is_denied.sum())
+            counts['unmatched'] += int(is_unmatched.sum())
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a billing database with synthetic data.')
+    parser.add_argument('--db', help='Database file (default: $BILLING_DB_PATH or data/billing.db)')
+    parser.add_argument('--patients', type=int, default=10000)
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--icd-codes', type=int, default=50)
+    parser.add_argument('--insurers', type=int, default=8)
+    parser.add_argument('--custom-rate-fraction', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--eob-output', help='Only write a synthetic EOB CSV for the billed claims in the database')
+    parser.add_argument('--eob-lines', type=int, default=100000)
+    args = parser.parse_args()
+    if args.db:
+        configure_engine(args.db)
+    if args.eob_output:
+        counts = write_synthetic_eob(args.eob_output, args.eob_lines, args.seed)
+        print(f"Wrote {counts['lines']} synthetic EOB lines to {args.eob_output} "
+              f"({counts['underpaid']} underpaid, {counts['denied']} denied, {counts['unmatched']} unmatched)")
+        return
+    counts = generate_synthetic_data(args.patients, args.doctors, args.icd_codes, args.insurers,
+                                     args.custom_rate_fraction, args.seed)
+    for table, table_counts in counts.items():
+        print(f"{table}: {table_counts}")
+
+if __name__ == '__main__':
+    main()
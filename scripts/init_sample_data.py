@@ -10,8 +10,8 @@ sys.path.insert(0, parent_dir)
 spec = importlib.util.spec_from_file_location("db_utils", os.path.join(script_dir, "db_utils.py"))
 db_utils = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(db_utils)
-add_doctor = db_utils.add_doctor
-add_insurance_rate = db_utils.add_insurance_rate
+add_doctors_bulk = db_utils.add_doctors_bulk
+add_insurance_rates_bulk = db_utils.add_insurance_rates_bulk
 
 doctors = [
     {
@@ -51,11 +51,13 @@ rates = [
     {'icd_code': 'H01.009', 'disease': 'BLEPHARITIS'}
 ]
 
-# Add doctors and their rates
-for doc in doctors:
-    add_doctor(doc['name'], doc['rates'])
+# Add doctors and their rates in one transaction
+counts = add_doctors_bulk(doctors)
+print(f"Doctors: {counts['doctors']}")
+print(f"Doctor rates: {counts['rates']}")
 
 # Generate insurance rates for each insurance, disease
+insurance_rows = []
 for ins in insurances:
     for r in rates:
         # Example: Medicaid covers 80% of Doctor Kelvin Nkansa's default rate for each disease
@@ -71,4 +73,7 @@ for ins in insurances:
             rate_val = default['default_rate'] * 0.7
         elif ins == 'Blue Cross Blue Shield':
             rate_val = default['default_rate'] * 0.65
-        add_insurance_rate(ins, r['disease'], r['icd_code'], round(rate_val, 2))
+        insurance_rows.append({'provider': ins, 'disease': r['disease'], 'icd_code': r['icd_code'], 'rate': round(rate_val, 2)})
+
+counts = add_insurance_rates_bulk(insurance_rows)
+print(f"Insurance rates: {counts}")
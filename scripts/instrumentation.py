@@ -0,0 +1,169 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Opt-in: off unless BILLING_INSTRUMENTATION=1 or enable() is called. While
+# off, every hook below returns after a single flag check.
+_enabled = os.environ.get('BILLING_INSTRUMENTATION', '') == '1'
+
+class Recorder:
+    '''Timings of one run: per function, per SQL statement and per stage.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.functions = {}
+        self.queries = {}
+        self.stages = {}
+
+# Timings go to the recorder of the current run (see recording()), else to
+# the process-wide one. Context variables are per thread and per asyncio
+# task, so concurrent runs (e.g. Streamlit sessions) never see each other's.
+_process_recorder = Recorder()
+_current_recorder = contextvars.ContextVar('instrumentation_recorder', default=None)
+
+def _recorder():
+    return _current_recorder.get() or _process_recorder
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    '''Forget everything recorded so far in the current run (or process-wide, outside recording()).'''
+    recorder = _recorder()
+    with recorder.lock:
+        recorder.functions.clear()
+        recorder.queries.clear()
+        recorder.stages.clear()
+
+@contextmanager
+def recording():
+    '''
+    Record the block's timings into a fresh Recorder of its own, which is
+    yielded. Work the block hands to other threads is only included if they
+    run in a copy of its context (asyncio.to_thread does, thread pools do not).
+    '''
+    recorder = Recorder()
+    token = _current_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current_recorder.reset(token)
+
+def _record(kind, key, seconds):
+    recorder = _recorder()
+    with recorder.lock:
+        table = getattr(recorder, kind)
+        entry = table.get(key)
+        if entry is None:
+            table[key] = {'calls': 1, 'total': seconds, 'max': seconds}
+        else:
+            entry['calls'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+
+# --- Function timing ---
+def timed(func, name=None):
+    '''Wrap func so each call's wall time is recorded under name (default module.function).'''
+    key = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record('functions', key, time.perf_counter() - start)
+    return wrapper
+
+def instrument_module(namespace, exclude=()):
+    '''
+    Replace every public function defined in a module (pass its globals()) by
+    a timed wrapper. Calls between the module's own functions go through the
+    wrappers too, since they are looked up in the same namespace.
+    '''
+    module_name = namespace['__name__']
+    for name, obj in list(namespace.items()):
+        if name.startswith('_') or name in exclude or not inspect.isfunction(obj):
+            continue
+        if obj.__module__ == module_name:
+            namespace[name] = timed(obj)
+
+# --- Pipeline stages ---
+@contextmanager
+def stage(name):
+    '''Time a block, e.g. one stage of the billing summary computation.'''
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record('stages', name, time.perf_counter() - start)
+
+# --- SQL statements (every engine) ---
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _enabled:
+        conn.info.setdefault('instrumentation_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('instrumentation_start')
+    if starts:
+        # Same statement text = same query shape, as parameters are bound
+        _record('queries', ' '.join(statement.split()), time.perf_counter() - starts.pop())
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('instrumentation_start'):
+        conn.info['instrumentation_start'].pop()
+
+# --- Reporting ---
+def _rows(recorder, kind, name_key):
+    with recorder.lock:
+        items = [(key, dict(entry)) for key, entry in getattr(recorder, kind).items()]
+    rows = [
+        {name_key: key, 'calls': e['calls'], 'total_ms': e['total'] * 1000,
+         'mean_ms': e['total'] * 1000 / e['calls'], 'max_ms': e['max'] * 1000}
+        for key, e in items
+    ]
+    return sorted(rows, key=lambda r: r['total_ms'], reverse=True)
+
+def snapshot(recorder=None):
+    '''
+    Everything recorded so far (by default in the current run): functions,
+    stages and SQL statements, slowest first.
+    '''
+    recorder = recorder or _recorder()
+    queries = _rows(recorder, 'queries', 'statement')
+    return {
+        'enabled': _enabled,
+        'query_count': sum(q['calls'] for q in queries),
+        'query_total_ms': sum(q['total_ms'] for q in queries),
+        'functions': _rows(recorder, 'functions', 'function'),
+        'stages': _rows(recorder, 'stages', 'stage'),
+        'queries': queries,
+    }
+
+def write_json(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
@@ -1,65 +1,85 @@
+import argparse
+import contextlib
 import os
 import pandas as pd
 try:
-    from scripts import db_utils
+    from scripts import billing_engine, instrumentation
+    from scripts.columnar_export import BILLING_SUMMARY_COLUMN_TYPES, ColumnarWriter
 except ImportError:
-    import db_utils
+    import billing_engine
+    import instrumentation
+    from columnar_export import BILLING_SUMMARY_COLUMN_TYPES, ColumnarWriter
 
-def main():
-    # Load data from the database
-    patients = db_utils.get_patients()
-    doctors = db_utils.get_doctors()
-    insurance_rates = db_utils.get_insurance_rates()
-
-    # Build lookup dictionaries for quick access
-    doctor_lookup = {d['id']: d for d in doctors}
-    insurance_lookup = {}
-    for rate in insurance_rates:
-        key = (rate['provider'], rate['icd_code'])
-        insurance_lookup[key] = rate['rate']
-
-    summary_rows = []
-    for p in patients:
-        patient_id = p['id']
-        doctor_id = p['assigned_doctor_id']
-        icd_code = p['icd_code']
-        disease = p['disease']
-        insurance_provider = p['insurance_provider']
-        patient_name = p['name']
-        doctor_name = doctor_lookup[doctor_id]['name'] if doctor_id in doctor_lookup else 'Unknown'
+PREVIEW_ROWS = 5
 
-        # Check for custom rate
-        custom_rate = db_utils.get_custom_rate(patient_id, doctor_id, icd_code)
-        if custom_rate is not None:
-            doctor_charge = custom_rate
-        else:
-            # Find default rate for this doctor and ICD code
-            doctor_rates = doctor_lookup[doctor_id]['rates'] if doctor_id in doctor_lookup else []
-            default_rate = next((r['default_rate'] for r in doctor_rates if r['icd_code'] == icd_code), None)
-            doctor_charge = default_rate if default_rate is not None else 0.0
+def to_demo_layout(summary, providers=None):
+    '''
+    Reshape the engine's summary into this script's CSV layout: one
+    "<provider> Rate" column per insurance provider (in order of first
+    appearance, unless given) and the patient's share as "Patient Owes".
+    '''
+    demo = summary[['Patient Name', 'Patient ID', 'Disease', 'ICD Code', 'Assigned Doctor', 'Doctor Charge']].copy()
+    if providers is None:
+        providers = summary['Insurance Provider'].unique().tolist()
+    for i, provider in enumerate(providers):
+        demo[f'{provider} Rate'] = summary['Insurance Pays'].where(summary['Insurance Provider'] == provider)
+        if i == 0:
+            demo['Patient Owes'] = summary['Patient Pays']
+    return demo
 
-        # Find insurance rate
-        insurance_rate = insurance_lookup.get((insurance_provider, icd_code), 0.0)
-        patient_owes = doctor_charge - insurance_rate
-        summary_rows.append({
-            'Patient Name': patient_name,
-            'Patient ID': patient_id,
-            'Disease': disease,
-            'ICD Code': icd_code,
-            'Assigned Doctor': doctor_name,
-            'Doctor Charge': doctor_charge,
-            f'{insurance_provider} Rate': insurance_rate,
-            'Patient Owes': patient_owes
-        })
+def _columnar_writer(path):
+    if path is None:
+        return contextlib.nullcontext()
+    return ColumnarWriter(path, BILLING_SUMMARY_COLUMN_TYPES)
 
-    summary = pd.DataFrame(summary_rows)
-    print("\nBilling Summary:")
-    print(summary.to_string(index=False))
+def main():
+    parser = argparse.ArgumentParser(description='Print the billing summary and save it to data/billing_summary.csv.')
+    parser.add_argument('--instrument-json', metavar='PATH',
+                        help='Record function, stage and SQL timings and write them to PATH as JSON')
+    parser.add_argument('--columnar-output', metavar='PATH',
+                        help='Also write the billing summary to a typed .parquet or .arrow file (needs pyarrow)')
+    parser.add_argument('--chunk-size', type=int, default=billing_engine.EXPORT_CHUNK_SIZE,
+                        help='Rows read from the database at a time')
+    args = parser.parse_args()
+    if args.instrument_json:
+        instrumentation.enable()
+        instrumentation.reset()
 
-    # Save to CSV
+    # Stream the materialized billing summary from the database to CSV, one chunk at a time
     data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
-    summary.to_csv(os.path.join(data_dir, 'billing_summary.csv'), index=False)
+    providers = billing_engine.insurance_providers_in_table_order()
+    preview = None
+    with open(os.path.join(data_dir, 'billing_summary.csv'), 'w', newline='', encoding='utf-8') as csv_file, \
+            _columnar_writer(args.columnar_output) as columnar_writer:
+        for chunk in billing_engine.iter_billing_summary_chunks(chunk_size=args.chunk_size):
+            engine_chunk = pd.DataFrame(chunk, columns=billing_engine.SUMMARY_COLUMNS)
+            demo_chunk = to_demo_layout(engine_chunk, providers)
+            demo_chunk.to_csv(csv_file, index=False, header=preview is None)
+            if preview is None:
+                preview = demo_chunk.head(PREVIEW_ROWS)
+            if columnar_writer is not None:
+                # The engine's layout (one Insurance Provider column), not the per-provider CSV columns
+                columnar_writer.write_frame(engine_chunk)
+        if preview is None:
+            # No rows: still write the header
+            to_demo_layout(pd.DataFrame(columns=billing_engine.SUMMARY_COLUMNS), providers).to_csv(csv_file, index=False)
+
+    # A short summary instead of printing every row
+    totals = billing_engine.billing_summary_totals()
+    print(f"\nBilling Summary: {totals['rows']:,} patients, {len(providers)} insurance providers")
+    print(f"  Total charges:        ${totals['Doctor Charge']:,.2f}")
+    print(f"  Covered by insurance: ${totals['Insurance Pays']:,.2f}")
+    print(f"  Patients owe:         ${totals['Patient Pays']:,.2f}")
+    if preview is not None and not preview.empty:
+        print(f"\nFirst {len(preview)} rows:")
+        print(preview.to_string(index=False))
     print("\nSaved summary to data/billing_summary.csv")
+    if args.columnar_output:
+        print(f"Saved typed summary to {args.columnar_output}")
+
+    if args.instrument_json:
+        instrumentation.write_json(args.instrument_json)
+        print(f"Saved instrumentation to {args.instrument_json}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,186 @@
+import argparse
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+try:
+    from scripts import billing_engine, db_utils
+    from scripts.db_models import DoctorRate, InsuranceRate, PatientDoctorRate
+except ImportError:
+    import billing_engine
+    import db_utils
+    from db_models import DoctorRate, InsuranceRate, PatientDoctorRate
+
+class RateMatrix:
+    '''
+    Doctor charges and insurance rates held in NumPy arrays.
+
+    ICD codes, doctor IDs and payer names are interned to integer positions;
+    default doctor rates live in a doctors x ICD array and insurance rates in
+    a payers x ICD array (NaN where no rate exists). Custom patient charges
+    (patient_doctor_rates) are a sparse overlay: a dict for single lookups and
+    sorted integer keys for cohort gathers.
+
+    Charges resolve exactly like db_utils.doctor_charge_column(): the custom
+    rate first, then the doctor's default rate, then 0.0. A missing insurance
+    rate counts as 0.0.
+    '''
+    def __init__(self, doctor_rates, insurance_rates, custom_rates):
+        '''
+        doctor_rates: [(doctor_id, icd_code, default_rate)]
+        insurance_rates: [(provider, icd_code, rate)]
+        custom_rates: [(patient_id, doctor_id or None, icd_code, custom_rate)]
+        '''
+        # Interned in order of first appearance; doctor IDs are opaque keys, as
+        # old rows may hold them as BLOBs (which, like in SQL, match only BLOBs)
+        self.icd_codes = list(dict.fromkeys([r[1] for r in doctor_rates] + [r[1] for r in insurance_rates]
+                                            + [r[2] for r in custom_rates]))
+        self.doctor_ids = list(dict.fromkeys([r[0] for r in doctor_rates]
+                                             + [r[1] for r in custom_rates if r[1] is not None]))
+        self.payers = list(dict.fromkeys(r[0] for r in insurance_rates))
+        self.icd_index = {code: i for i, code in enumerate(self.icd_codes)}
+        self.doctor_index = {doctor_id: i for i, doctor_id in enumerate(self.doctor_ids)}
+        self.payer_index = {payer: i for i, payer in enumerate(self.payers)}
+        # Hash indexes for vectorized interning of whole columns
+        self._icd_lookup = pd.Index(self.icd_codes, dtype=object)
+        self._doctor_lookup = pd.Index(self.doctor_ids, dtype=object)
+        self._payer_lookup = pd.Index(self.payers, dtype=object)
+
+        self.doctor_rates = np.full((len(self.doctor_ids), len(self.icd_codes)), np.nan)
+        for doctor_id, icd_code, rate in doctor_rates:
+            self.doctor_rates[self.doctor_index[doctor_id], self.icd_index[icd_code]] = rate
+        self.payer_rates = np.full((len(self.payers), len(self.icd_codes)), np.nan)
+        for payer, icd_code, rate in insurance_rates:
+            self.payer_rates[self.payer_index[payer], self.icd_index[icd_code]] = rate
+
+        # Overlay keyed by (patient position, doctor position + 1, ICD position)
+        # packed into one int64; doctor position 0 stands for "no doctor"
+        self.custom_rates = {(p, d, c): rate for p, d, c, rate in custom_rates}
+        self._custom_patients = pd.Index(list(dict.fromkeys(key[0] for key in self.custom_rates)), dtype=object)
+        patient_pos = {p: i for i, p in enumerate(self._custom_patients)}
+        keys = np.array([
+            self._pack(patient_pos[p], self.doctor_index[d] if d is not None else -1, self.icd_index[c])
+            for p, d, c in self.custom_rates
+        ], dtype=np.int64)
+        order = np.argsort(keys)
+        self._custom_keys = keys[order]
+        self._custom_values = np.array(list(self.custom_rates.values()), dtype=float)[order]
+
+    def _pack(self, patient_pos, doctor_pos, icd_pos):
+        return (patient_pos * (len(self.doctor_ids) + 1) + (doctor_pos + 1)) * len(self.icd_codes) + icd_pos
+
+    # --- Single lookups ---
+    def doctor_charge(self, patient_id, doctor_id, icd_code):
+        custom = self.custom_rates.get((patient_id, doctor_id, icd_code))
+        if custom is not None:
+            return custom
+        d = self.doctor_index.get(doctor_id)
+        c = self.icd_index.get(icd_code)
+        if d is None or c is None:
+            return 0.0
+        rate = self.doctor_rates[d, c]
+        return 0.0 if rate != rate else float(rate)  # NaN: no default rate
+
+    def insurance_pays(self, payer, icd_code):
+        p = self.payer_index.get(payer)
+        c = self.icd_index.get(icd_code)
+        if p is None or c is None:
+            return 0.0
+        rate = self.payer_rates[p, c]
+        return 0.0 if rate != rate else float(rate)
+
+    # --- Cohort gathers ---
+    def _positions(self, lookup, values):
+        # -1 for values that were never interned (and for None/NaN)
+        return lookup.get_indexer(pd.Index(values, dtype=object))
+
+    def _gather(self, matrix, rows, cols):
+        result = np.full(len(rows), np.nan)
+        ok = (rows >= 0) & (cols >= 0)
+        result[ok] = matrix[rows[ok], cols[ok]]
+        return result
+
+    def doctor_charges(self, patient_ids, doctor_ids, icd_codes):
+        '''Effective doctor charge of every (patient, doctor, ICD code) triple, as a float array.'''
+        d = self._positions(self._doctor_lookup, doctor_ids)
+        c = self._positions(self._icd_lookup, icd_codes)
+        charges = self._gather(self.doctor_rates, d, c)
+        if len(self._custom_keys):
+            p = self._positions(self._custom_patients, patient_ids)
+            # d == -1 is "no doctor" only where the patient really has none
+            no_doctor = pd.isna(pd.Series(doctor_ids, dtype=object)).to_numpy()
+            candidates = np.flatnonzero((p >= 0) & (c >= 0) & ((d >= 0) | no_doctor))
+            keys = self._pack(p[candidates], d[candidates], c[candidates])
+            found = np.searchsorted(self._custom_keys, keys)
+            found[found == len(self._custom_keys)] = 0
+            hit = self._custom_keys[found] == keys
+            charges[candidates[hit]] = self._custom_values[found[hit]]
+        return np.nan_to_num(charges, nan=0.0)
+
+    def insurance_payments(self, payers, icd_codes):
+        '''Insurance rate of every (payer, ICD code) pair, as a float array.'''
+        p = self._positions(self._payer_lookup, payers)
+        c = self._positions(self._icd_lookup, icd_codes)
+        return np.nan_to_num(self._gather(self.payer_rates, p, c), nan=0.0)
+
+    def price_patients(self, patients):
+        '''
+        Doctor Charge, Insurance Pays and Patient Pays for a DataFrame of
+        patients with id, assigned_doctor_id, icd_code and insurance_provider
+        columns (as from db_utils.get_patients()). Returns a DataFrame on the
+        same index.
+        '''
+        charges = self.doctor_charges(patients['id'], patients['assigned_doctor_id'], patients['icd_code'])
+        covered = self.insurance_payments(patients['insurance_provider'], patients['icd_code'])
+        return pd.DataFrame({'Doctor Charge': charges, 'Insurance Pays': covered,
+                             'Patient Pays': charges - covered}, index=patients.index)
+
+def load_rate_matrix():
+    '''Build a RateMatrix from the current database.'''
+    with db_utils.session_scope() as session:
+        doctor_rates = session.execute(select(DoctorRate.doctor_id, DoctorRate.icd_code, DoctorRate.default_rate)).all()
+        insurance_rates = session.execute(
+            select(InsuranceRate.insurance_provider, InsuranceRate.icd_code, InsuranceRate.rate)
+        ).all()
+        custom_rates = session.execute(select(
+            PatientDoctorRate.patient_id, PatientDoctorRate.doctor_id,
+            PatientDoctorRate.icd_code, PatientDoctorRate.custom_rate,
+        )).all()
+    return RateMatrix([tuple(r) for r in doctor_rates], [tuple(r) for r in insurance_rates],
+                      [tuple(r) for r in custom_rates])
+
+RATE_TABLES = ('doctors', 'doctor_rates', 'patient_doctor_rates', 'insurance_rates')
+
+@lru_cache(maxsize=1)
+def _cached_rate_matrix(version):
+    return load_rate_matrix()
+
+def get_rate_matrix():
+    '''The RateMatrix of the current database, rebuilt only after a write to a rate table.'''
+    return _cached_rate_matrix(db_utils.data_version(*RATE_TABLES))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the rate matrix and check it against the billing summary.')
+    parser.parse_args()
+    start = time.perf_counter()
+    matrix = load_rate_matrix()
+    print(f"Built rate matrix in {time.perf_counter() - start:.3f}s: {len(matrix.doctor_ids)} doctors, "
+          f"{len(matrix.payers)} payers, {len(matrix.icd_codes)} ICD codes, {len(matrix.custom_rates)} custom rates")
+
+    patients = pd.DataFrame(db_utils.get_patients(),
+                            columns=['id', 'assigned_doctor_id', 'icd_code', 'insurance_provider'])
+    start = time.perf_counter()
+    priced = matrix.price_patients(patients)
+    print(f"Priced {len(patients)} patients in {time.perf_counter() - start:.3f}s")
+
+    summary = billing_engine.read_billing_summary().set_index('Patient ID')
+    expected = summary.loc[patients['id'], ['Doctor Charge', 'Insurance Pays', 'Patient Pays']].to_numpy()
+    mismatched = int((~np.isclose(priced.to_numpy(), expected)).any(axis=1).sum())
+    if mismatched:
+        print(f"{mismatched} patient(s) priced differently from the billing summary.")
+        raise SystemExit(1)
+    print("Rate matrix matches the billing summary.")
+
+if __name__ == '__main__':
+    main()
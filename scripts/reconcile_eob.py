@@ -0,0 +1,256 @@
+import argparse
+import csv
+import json
+import os
+from itertools import islice
+import pandas as pd
+try:
+    from scripts import billing_engine, db_utils
+    from scripts.columnar_export import is_columnar_path, iter_columnar_batches
+    from scripts.db_models import ReconciliationException
+    from scripts.extract_eob_data import EOB_COLUMNS, file_sha256, iter_eob_line_items
+except ImportError:
+    import billing_engine
+    import db_utils
+    from columnar_export import is_columnar_path, iter_columnar_batches
+    from db_models import ReconciliationException
+    from extract_eob_data import EOB_COLUMNS, file_sha256, iter_eob_line_items
+
+CHUNK_SIZE = 50000
+# Claim adjustment reason codes that mean the line was denied; a line paying
+# nothing on a claim that expects an insurance payment counts as denied too
+DENIAL_CODES = ('CO16', 'CO29', 'CO45', 'CO50', 'CO96', 'CO97')
+EXCEPTION_TYPES = ('unmatched', 'denied', 'underpaid')
+
+# --- Reading EOB lines in chunks ---
+def iter_eob_chunks(path, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the line items of an EOB PDF or of extract_eob_data output (.csv,
+    .jsonl, .parquet, .arrow) as DataFrames of up to chunk_size rows.
+    '''
+    lower = path.lower()
+    if lower.endswith('.pdf'):
+        items = iter_eob_line_items(path)
+        while chunk := list(islice(items, chunk_size)):
+            yield pd.DataFrame(chunk, columns=EOB_COLUMNS)
+    elif lower.endswith('.csv'):
+        yield from pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    elif lower.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            while lines := list(islice(f, chunk_size)):
+                yield pd.DataFrame([json.loads(line) for line in lines])
+    elif is_columnar_path(path):
+        yield from iter_columnar_batches(path, chunk_size)
+    else:
+        raise ValueError(f"Unsupported EOB input: {path} (use .pdf, .csv, .jsonl, .parquet or .arrow)")
+
+def _text(column):
+    return column.astype('string').str.strip()
+
+def _amount(column):
+    # Extracted amounts are strings like "1,234.00"; typed outputs are already numeric
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    return pd.to_numeric(_text(column).str.replace(r'[,$]', '', regex=True), errors='coerce').astype(float)
+
+def normalize_chunk(chunk, line_counts, default_source):
+    '''
+    Reduce a chunk to the columns reconciliation needs, with numeric amounts and
+    1-based line numbers within each source file. line_counts (source file ->
+    lines seen in earlier chunks) carries the numbering across chunks and is updated.
+    '''
+    codes = _text(chunk['CPT Code'])
+    if 'Source File' in chunk:
+        source = _text(chunk['Source File']).replace('', pd.NA).fillna(default_source)
+    else:
+        source = pd.Series(default_source, index=chunk.index, dtype='string')
+    earlier = source.map(line_counts).fillna(0).astype(int)
+    line_numbers = earlier + source.groupby(source).cumcount() + 1
+    for name, count in source.value_counts().items():
+        line_counts[name] = line_counts.get(name, 0) + int(count)
+    return pd.DataFrame({
+        'line_number': line_numbers,
+        'source_file': source,
+        # The payer's "Insured ID #", not our patient ID
+        'member_id': _text(chunk['Patient ID']),
+        # CPT codes may carry modifiers ("99214,25"); they are matched on the base code
+        'code': codes,
+        'match_code': codes.str.split(',').str[0].str.strip(),
+        'denial_code': _text(chunk['Denial Code']),
+        'amount_billed': _amount(chunk['Amount Billed']),
+        'amount_paid': _amount(chunk['Amount Paid']),
+    })
+
+# --- Matching ---
+def missing_claim_keys():
+    '''
+    Why no EOB line can be matched to a claim, or None. Lines are matched
+    on the payer's member ID (through payer_members) and the CPT code
+    (through the procedure_codes the claims' ICD codes are billed under).
+    '''
+    counts = db_utils.claim_key_counts()
+    if not counts['procedure_codes']:
+        return 'no CPT on claims (procedure_codes is empty)'
+    if not counts['payer_members']:
+        return 'no payer member IDs mapped to patients (payer_members is empty)'
+    return None
+
+def member_patients(member_ids, payer=None):
+    '''
+    member_id -> patient_id for the given member IDs, of one payer if given.
+    A member ID held by patients of several payers is ambiguous and left out.
+    '''
+    members = pd.DataFrame(db_utils.get_payer_members(member_ids, payer),
+                           columns=['insurance_provider', 'member_id', 'patient_id'])
+    members = members.drop_duplicates(['member_id', 'patient_id'])
+    members = members[~members['member_id'].duplicated(keep=False)]
+    return members[['member_id', 'patient_id']].astype('string')
+
+def billed_claims(patient_ids, procedure_codes):
+    '''
+    The billed claims of the given patients: patient_id, claim_code and
+    expected_paid. The billing summary holds one claim per patient, coded by
+    ICD code; claim_code is the CPT code it is billed under (<NA> when the
+    ICD code has none) and the claim expects the insurer's share.
+    '''
+    summary = billing_engine.query_billing_summary_for_patients(patient_ids)
+    return pd.DataFrame({
+        'patient_id': summary['Patient ID'].astype('string'),
+        'claim_code': summary['ICD Code'].map(procedure_codes).astype('string'),
+        'expected_paid': summary['Insurance Pays'].astype(float),
+    })
+
+def classify_lines(lines, members, claims, denial_codes=DENIAL_CODES, tolerance=0.01):
+    '''
+    Hash-join EOB lines with the member mapping on member_id and with the
+    billed claims on patient_id, then label each line: 'unmatched' (unknown
+    member, or a CPT code other than the claim's), 'denied' (a denial code,
+    or nothing paid where the claim expects a payment), 'underpaid' (paid
+    more than tolerance below the claim's insurance share) or None. Lines
+    whose claim has no CPT code cannot be checked and are marked unkeyed.
+    '''
+    merged = lines.merge(members, on='member_id', how='left').merge(claims, on='patient_id', how='left')
+    merged['unkeyed'] = merged['patient_id'].notna() & merged['expected_paid'].notna() & merged['claim_code'].isna()
+    matched = (merged['match_code'] == merged['claim_code']).fillna(False).astype(bool)
+    unmatched = ~matched & ~merged['unkeyed']
+    # Only a matched line is held to the claim's expected payment
+    merged.loc[~matched, 'expected_paid'] = float('nan')
+    denied = merged['denial_code'].isin(denial_codes).fillna(False).astype(bool) | (
+        (merged['amount_paid'] == 0) & (merged['expected_paid'] > tolerance)
+    )
+    underpaid = merged['amount_paid'] < merged['expected_paid'] - tolerance
+    merged['exception_type'] = None
+    merged.loc[underpaid & matched, 'exception_type'] = 'underpaid'
+    merged.loc[denied & matched, 'exception_type'] = 'denied'
+    merged.loc[unmatched, 'exception_type'] = 'unmatched'
+    merged['difference'] = merged['expected_paid'] - merged['amount_paid']
+    return merged.drop(columns=['claim_code'])
+
+def _exception_rows(classified, source_hash):
+    flagged = classified[classified['exception_type'].notna()]
+    columns = [c.name for c in ReconciliationException.__table__.columns if c.name not in ('id', 'created_at')]
+    flagged = flagged.assign(source_hash=source_hash)[columns]
+    # None instead of NaN/<NA>, so SQLite stores NULLs
+    return [
+        {k: (None if pd.isna(v) else v) for k, v in row.items()}
+        for row in flagged.astype(object).to_dict('records')
+    ]
+
+def reconcile_eob(path, chunk_size=CHUNK_SIZE, denial_codes=DENIAL_CODES, tolerance=0.01, payer=None):
+    '''
+    Reconcile an EOB file (from payer, if given) against the billing summary in billing.db.
+
+    Lines are read chunk_size at a time; each chunk is joined against the
+    member IDs and billed claims of just the patients it mentions (looked up
+    through indexes), so memory stays bounded by the chunk size however many
+    remittance lines there are. Flagged lines are written to the
+    reconciliation_exceptions table, replacing those of an earlier run on the
+    same file. Returns counts per exception type plus totals; without any
+    claim keys nothing is matched or flagged and 'cannot_match' says why.
+    '''
+    source_hash = file_sha256(path)
+    default_source = os.path.basename(path)
+    db_utils.clear_reconciliation_exceptions(source_hash)
+    summary = {'source_hash': source_hash, 'cannot_match': missing_claim_keys(), 'lines': 0, 'matched': 0,
+               'unkeyed': 0, **{t: 0 for t in EXCEPTION_TYPES}, 'underpaid_amount': 0.0}
+    if summary['cannot_match']:
+        return summary
+    procedure_codes = db_utils.get_procedure_codes()
+    line_counts = {}
+    for chunk in iter_eob_chunks(path, chunk_size):
+        lines = normalize_chunk(chunk, line_counts, default_source)
+        members = member_patients(lines['member_id'].dropna().unique().tolist(), payer)
+        claims = billed_claims(members['patient_id'].unique().tolist(), procedure_codes)
+        classified = classify_lines(lines, members, claims, denial_codes, tolerance)
+        db_utils.add_reconciliation_exceptions(_exception_rows(classified, source_hash))
+
+        counts = classified['exception_type'].value_counts()
+        summary['lines'] += len(classified)
+        summary['unkeyed'] += int(classified['unkeyed'].sum())
+        summary['matched'] += int((~classified['unkeyed'] & (classified['exception_type'] != 'unmatched')).sum())
+        for exception_type in EXCEPTION_TYPES:
+            summary[exception_type] += int(counts.get(exception_type, 0))
+        summary['underpaid_amount'] += float(
+            classified.loc[classified['exception_type'] == 'underpaid', 'difference'].sum()
+        )
+    return summary
+
+def write_exceptions_csv(source_hash, path):
+    rows = db_utils.get_reconciliation_exceptions(source_hash)
+    columns = [c.name for c in ReconciliationException.__table__.columns]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+def load_claim_keys(procedure_codes_csv=None, members_csv=None):
+    '''
+    Import claim keys from CSV files: procedure codes with icd_code,cpt_code
+    columns and payer members with insurance_provider,member_id,patient_id.
+    Returns the upsert counts per table.
+    '''
+    counts = {}
+    for table, path, upsert in (('procedure_codes', procedure_codes_csv, db_utils.upsert_procedure_codes_bulk),
+                                ('payer_members', members_csv, db_utils.upsert_payer_members_bulk)):
+        if path:
+            with open(path, newline='', encoding='utf-8') as f:
+                counts[table] = upsert([{k: v.strip() for k, v in row.items()} for row in csv.DictReader(f)])
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile EOB line items against the billing summary in billing.db.')
+    parser.add_argument('eob_path', help='EOB PDF or extract_eob_data output (.csv, .jsonl, .parquet, .arrow)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='EOB lines processed at a time')
+    parser.add_argument('--denial-codes', default=','.join(DENIAL_CODES), help='Comma-separated denial codes')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='Underpayments up to this amount are ignored')
+    parser.add_argument('--exceptions-csv', help='Also write the flagged lines to this CSV')
+    parser.add_argument('--payer', help='Insurance provider that sent the EOB; member IDs are looked up among its patients')
+    parser.add_argument('--procedure-codes', help='First import the CPT code of each ICD code from this CSV (icd_code,cpt_code)')
+    parser.add_argument('--members', help='First import payer member IDs from this CSV (insurance_provider,member_id,patient_id)')
+    args = parser.parse_args()
+    if not os.path.exists(args.eob_path):
+        print(f"EOB file not found: {args.eob_path}")
+        raise SystemExit(1)
+
+    for table, counts in load_claim_keys(args.procedure_codes, args.members).items():
+        print(f"{table}: {counts}")
+    denial_codes = tuple(code.strip() for code in args.denial_codes.split(',') if code.strip())
+    summary = reconcile_eob(args.eob_path, args.chunk_size, denial_codes, args.tolerance, args.payer)
+    if summary['cannot_match']:
+        print(f"Cannot match: {summary['cannot_match']}. No exceptions were recorded.")
+        print("Import claim keys with --procedure-codes and --members.")
+        raise SystemExit(1)
+    print(f"Reconciled {summary['lines']:,} EOB lines ({summary['matched']:,} matched a billed claim):")
+    print(f"  underpaid: {summary['underpaid']:,} (${summary['underpaid_amount']:,.2f} short)")
+    print(f"  denied:    {summary['denied']:,}")
+    print(f"  unmatched: {summary['unmatched']:,}")
+    if summary['unkeyed']:
+        print(f"  not checked: {summary['unkeyed']:,} (their claim's ICD code has no CPT code in procedure_codes)")
+    print("Exceptions saved to the reconciliation_exceptions table.")
+    if args.exceptions_csv:
+        count = write_exceptions_csv(summary['source_hash'], args.exceptions_csv)
+        print(f"Saved {count} exception(s) to {args.exceptions_csv}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.sax.saxutils import escape as xml_escape
+from docx import Document
+try:
+    from scripts import billing_engine
+except ImportError:
+    import billing_engine
+
+MANIFEST_NAME = 'statements_manifest.json'
+DOCUMENT_PART = 'word/document.xml'
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+PLACEHOLDER_RE = re.compile(r'\{\{(\w+)\}\}')
+
+# Placeholder -> billing summary column; money columns are formatted when rendered
+STATEMENT_FIELDS = {
+    'patient_name': 'Patient Name',
+    'patient_id': 'Patient ID',
+    'disease': 'Disease',
+    'icd_code': 'ICD Code',
+    'doctor_name': 'Assigned Doctor',
+    'insurance_provider': 'Insurance Provider',
+    'doctor_charge': 'Doctor Charge',
+    'insurance_pays': 'Insurance Pays',
+    'patient_pays': 'Patient Pays',
+}
+MONEY_FIELDS = {'doctor_charge', 'insurance_pays', 'patient_pays'}
+
+def build_statement_template():
+    '''
+    The default statement layout as .docx bytes, with {{field}} placeholders
+    (see STATEMENT_FIELDS). Each placeholder sits in a single run, so it can
+    be replaced in the document XML directly.
+    '''
+    doc = Document()
+    doc.add_heading('Billing Statement', level=1)
+    doc.add_paragraph('Patient: {{patient_name}}')
+    doc.add_paragraph('Patient ID: {{patient_id}}')
+    table = doc.add_table(rows=0, cols=2)
+    table.style = 'Table Grid'
+    for label, placeholder in [
+        ('Disease', 'disease'), ('ICD Code', 'icd_code'), ('Assigned Doctor', 'doctor_name'),
+        ('Insurance Provider', 'insurance_provider'), ('Doctor Charge', 'doctor_charge'),
+        ('Insurance Pays', 'insurance_pays'), ('Amount Due', 'patient_pays'),
+    ]:
+        cells = table.add_row().cells
+        cells[0].text = label
+        cells[1].text = '{{' + placeholder + '}}'
+    doc.add_paragraph('Please pay the amount due of {{patient_pays}}.')
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def check_template(template_bytes):
+    '''
+    Raise ValueError unless every {{field}} placeholder in the template is a
+    known STATEMENT_FIELDS name held in a single run (only those are replaced
+    in the document XML), and at least one is present. Word often splits
+    text typed as one placeholder across several runs.
+    '''
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as zf:
+        root = ET.fromstring(zf.read(DOCUMENT_PART))
+    in_runs, in_text = Counter(), Counter()
+    for paragraph in root.iter(W_NS + 'p'):
+        texts = [t.text or '' for t in paragraph.iter(W_NS + 't')]
+        for text in texts:
+            in_runs.update(PLACEHOLDER_RE.findall(text))
+        text = ''.join(texts)
+        in_text.update(PLACEHOLDER_RE.findall(text))
+        if '{{' in PLACEHOLDER_RE.sub('', text):
+            raise ValueError(f"Malformed placeholder in template paragraph: {text!r}")
+    unknown = sorted(set(in_text) - set(STATEMENT_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown template placeholder(s): {', '.join('{{' + name + '}}' for name in unknown)}")
+    split = sorted(in_text - in_runs)
+    if split:
+        raise ValueError(f"Template placeholder(s) split across formatting runs: "
+                         f"{', '.join('{{' + name + '}}' for name in split)} (retype each in one go, without formatting changes)")
+    if not in_runs:
+        raise ValueError(f"Template has no placeholders (expected some of: {', '.join(STATEMENT_FIELDS)})")
+
+def statement_values(row):
+    '''Placeholder values for one billing summary row (a dict keyed by SUMMARY_COLUMNS).'''
+    values = {}
+    for field, column in STATEMENT_FIELDS.items():
+        value = row[column]
+        if field in MONEY_FIELDS:
+            values[field] = f"${value:,.2f}" if value is not None else ''
+        else:
+            values[field] = '' if value is None else str(value)
+    return values
+
+def statement_filename(patient_id):
+    return re.sub(r'[^\w.-]', '_', str(patient_id)) + '.docx'
+
+def template_hash(template_bytes):
+    '''Hash of the template's parts, ignoring docProps/core.xml (its timestamps change on every save).'''
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as zf:
+        for name in sorted(zf.namelist()):
+            if name != 'docProps/core.xml':
+                digest.update(name.encode('utf-8') + b'\0' + zf.read(name))
+    return digest.hexdigest()
+
+def input_hash(template_digest, values):
+    '''Hash of everything a statement is rendered from; unchanged hash means the file can be skipped.'''
+    payload = json.dumps(values, sort_keys=True)
+    return hashlib.sha256((template_digest + payload).encode('utf-8')).hexdigest()
+
+# --- Worker side ---
+_template = None
+
+def _init_worker(template_bytes):
+    # Prepare the template once per process: every part except document.xml
+    # is compressed once into a base archive, and each statement only appends
+    # its filled-in document.xml to a copy of it (zipfile's append mode keeps
+    # existing entries as they are, so styles etc. are never recompressed)
+    global _template
+    base = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as src, zipfile.ZipFile(base, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            if info.filename == DOCUMENT_PART:
+                document_info = info
+                document_xml = src.read(info).decode('utf-8')
+            else:
+                dst.writestr(info, src.read(info), zipfile.ZIP_DEFLATED)
+    _template = (base.getvalue(), document_info, document_xml)
+
+def _render_statement(values, output_path):
+    base, document_info, document_xml = _template
+    missing = {name for name in PLACEHOLDER_RE.findall(document_xml) if name not in values}
+    if missing:
+        # Never save (and later email) a statement with a literal placeholder in it
+        raise ValueError(f"No value for placeholder(s): {', '.join(sorted(missing))}")
+    filled = PLACEHOLDER_RE.sub(lambda m: xml_escape(values[m.group(1)]), document_xml)
+    buffer = io.BytesIO(base)
+    with zipfile.ZipFile(buffer, 'a', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(document_info, filled.encode('utf-8'), zipfile.ZIP_DEFLATED)
+    # Written next to the target and renamed, so a crash never leaves a partial statement
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _render_batch(jobs):
+    '''Worker: render [(patient_id, digest, values, output_path)]; returns [(patient_id, digest, error)].'''
+    results = []
+    for patient_id, digest, values, output_path in jobs:
+        try:
+            _render_statement(values, output_path)
+            results.append((patient_id, digest, None))
+        except Exception as e:
+            results.append((patient_id, digest, str(e)))
+    return results
+
+# --- Manifest ---
+def _load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_manifest(manifest, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def render_statements(output_dir, workers=4, template_path=None, batch_size=100, force=False):
+    '''
+    Render one statement per patient in the billing summary into output_dir.
+
+    output_dir/statements_manifest.json maps each patient ID to the hash of
+    the template and the values its statement was rendered from. Statements
+    whose hash is unchanged and whose file still exists are skipped, so a
+    rerun (or a restart after a crash) only renders new or changed patients.
+    A template with unknown or split placeholders raises ValueError (see
+    check_template) before anything is rendered.
+    Returns {'rendered': n, 'skipped': n, 'failed': {patient_id: error}}.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    if template_path:
+        with open(template_path, 'rb') as f:
+            template_bytes = f.read()
+    else:
+        template_bytes = build_statement_template()
+    check_template(template_bytes)
+    template_digest = template_hash(template_bytes)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {} if force else _load_manifest(manifest_path)
+
+    summary = billing_engine.read_billing_summary()
+    jobs = []
+    skipped = 0
+    for row in summary.to_dict('records'):
+        values = statement_values(row)
+        digest = input_hash(template_digest, values)
+        output_path = os.path.join(output_dir, statement_filename(row['Patient ID']))
+        if manifest.get(row['Patient ID']) == digest and os.path.exists(output_path):
+            skipped += 1
+            continue
+        jobs.append((row['Patient ID'], digest, values, output_path))
+
+    rendered = 0
+    failed = {}
+    if jobs:
+        batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template_bytes,)) as pool:
+            for future in as_completed([pool.submit(_render_batch, batch) for batch in batches]):
+                for patient_id, digest, error in future.result():
+                    if error is None:
+                        manifest[patient_id] = digest
+                        rendered += 1
+                    else:
+                        manifest.pop(patient_id, None)
+                        failed[patient_id] = error
+                        print(f"Error rendering statement for {patient_id}: {error}")
+                # Saved after every batch so an interrupted run resumes where it stopped
+                _save_manifest(manifest, manifest_path)
+    else:
+        _save_manifest(manifest, manifest_path)
+    return {'rendered': rendered, 'skipped': skipped, 'failed': failed}
+
+def main():
+    parser = argparse.ArgumentParser(description='Render one billing statement (.docx) per patient from billing.db.')
+    parser.add_argument('--output-dir', default='statements')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--template', help='A .docx with {{field}} placeholders (default: built-in layout)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Statements per worker task')
+    parser.add_argument('--force', action='store_true', help='Re-render every statement')
+    args = parser.parse_args()
+    try:
+        result = render_statements(args.output_dir, workers=args.workers, template_path=args.template,
+                                   batch_size=args.batch_size, force=args.force)
+    except ValueError as e:
+        print(f"Invalid template: {e}")
+        raise SystemExit(1)
+    print(f"Rendered {result['rendered']} statement(s), skipped {result['skipped']} unchanged, "
+          f"{len(result['failed'])} failed. Output in {args.output_dir}.")
+    if result['failed']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# Run from anywhere: make the repository root importable, so tests use the
+# same `from scripts import ...` imports as the scripts themselves
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts import db_models
+
+@pytest.fixture
+def billing_db(tmp_path, monkeypatch):
+    '''A fresh, empty billing database, used as the process-wide engine for one test.'''
+    path = str(tmp_path / 'billing.db')
+    # Anything that falls back to the default path lands here, not in data/
+    monkeypatch.setenv('BILLING_DB_PATH', path)
+    engine = db_models.configure_engine(path)
+    yield path
+    engine.dispose()
@@ -0,0 +1,87 @@
+import pandas as pd
+from scripts import billing_engine, db_utils
+
+def legacy_billing_summary():
+    '''The per-patient loop dashboard.py and process_billing_demo.py used before billing_engine.'''
+    patients = db_utils.get_patients()
+    doctors = db_utils.get_doctors()
+    insurance_rates = db_utils.get_insurance_rates()
+    doctor_lookup = {d['id']: d for d in doctors}
+    insurance_lookup = {(r['provider'], r['icd_code']): r['rate'] for r in insurance_rates}
+    summary_rows = []
+    for p in patients:
+        patient_id = p['id']
+        doctor_id = p['assigned_doctor_id']
+        icd_code = p['icd_code']
+        doctor_name = doctor_lookup[doctor_id]['name'] if doctor_id in doctor_lookup else 'Unknown'
+        custom_rate = db_utils.get_custom_rate(patient_id, doctor_id, icd_code)
+        if custom_rate is not None:
+            doctor_charge = custom_rate
+        else:
+            doctor_rates = doctor_lookup[doctor_id]['rates'] if doctor_id in doctor_lookup else []
+            default_rate = next((r['default_rate'] for r in doctor_rates if r['icd_code'] == icd_code), None)
+            doctor_charge = default_rate if default_rate is not None else 0.0
+        insurance_rate = insurance_lookup.get((p['insurance_provider'], icd_code), 0.0)
+        summary_rows.append({
+            'Patient Name': p['name'],
+            'Patient ID': patient_id,
+            'Disease': p['disease'],
+            'ICD Code': icd_code,
+            'Assigned Doctor': doctor_name,
+            'Doctor Charge': doctor_charge,
+            'Insurance Provider': p['insurance_provider'],
+            'Insurance Pays': insurance_rate,
+            'Patient Pays': doctor_charge - insurance_rate,
+        })
+    return pd.DataFrame(summary_rows)
+
+def add_sample_data():
+    '''Patients covering every charge path. Returns their ids by role.'''
+    flu = {'icd_code': 'J10', 'disease': 'Flu', 'default_rate': 120.0}
+    cold = {'icd_code': 'J00', 'disease': 'Cold', 'default_rate': 80.0}
+    db_utils.add_doctor('Dr. Smith', [flu, cold])
+    db_utils.add_doctor('Dr. Jones', [dict(flu, default_rate=150.0)])
+    smith, jones = (d['id'] for d in db_utils.get_doctors())
+    db_utils.add_insurance_rate('Medicaid', 'Flu', 'J10', 90.0)
+    db_utils.add_insurance_rate('Aetna', 'Cold', 'J00', 50.0)
+
+    ids = {
+        'default rate': db_utils.add_patient('Ann', 'ann@example.com', '1', 'Flu', 'J10', smith, 'Medicaid'),
+        'custom rate': db_utils.add_patient('Bob', 'bob@example.com', '2', 'Flu', 'J10', jones, 'Medicaid'),
+        'no doctor rate': db_utils.add_patient('Cy', 'cy@example.com', '3', 'Cold', 'J00', jones, 'Aetna'),
+        'no insurance rate': db_utils.add_patient('Di', 'di@example.com', '4', 'Cold', 'J00', smith, 'Cigna'),
+        'no doctor': db_utils.add_patient('Ed', 'ed@example.com', '5', 'Flu', 'J10', None, 'Medicaid'),
+        'no doctor, custom rate': db_utils.add_patient('Flo', 'flo@example.com', '6', 'Cold', 'J00', None, 'Aetna'),
+    }
+    db_utils.set_custom_rate(ids['custom rate'], jones, 'J10', 99.0)
+    db_utils.set_custom_rate(ids['no doctor, custom rate'], None, 'J00', 70.0)
+    # A custom rate for another doctor than the assigned one does not apply
+    db_utils.set_custom_rate(ids['default rate'], jones, 'J10', 1.0)
+    return ids
+
+def test_compute_billing_summary_matches_legacy_loop(billing_db):
+    ids = add_sample_data()
+    expected = legacy_billing_summary()
+    summary = billing_engine.compute_billing_summary()
+    pd.testing.assert_frame_equal(summary, expected, check_dtype=False)
+
+    charges = summary.set_index('Patient ID')['Doctor Charge']
+    assert charges[ids['default rate']] == 120.0
+    assert charges[ids['custom rate']] == 99.0
+    assert charges[ids['no doctor rate']] == 0.0
+    assert charges[ids['no doctor']] == 0.0
+    assert charges[ids['no doctor, custom rate']] == 70.0
+    assert summary.set_index('Patient ID').loc[ids['no doctor'], 'Assigned Doctor'] == 'Unknown'
+
+def test_materialized_summary_matches_legacy_loop(billing_db):
+    add_sample_data()
+    stored = billing_engine.read_billing_summary().sort_values('Patient ID', ignore_index=True)
+    expected = legacy_billing_summary().sort_values('Patient ID', ignore_index=True)
+    pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+
+def test_unsorted_pages_cover_every_row_once(billing_db):
+    add_sample_data()
+    pages = [billing_engine.query_billing_summary(limit=2, offset=offset) for offset in (0, 2, 4)]
+    paged = pd.concat(pages, ignore_index=True)
+    pd.testing.assert_frame_equal(paged, billing_engine.read_billing_summary())
+    assert paged['Patient ID'].is_unique
@@ -0,0 +1,26 @@
+import pandas as pd
+from scripts import data_loader
+
+def test_missing_doctor_charge_counts_as_zero(capsys):
+    insurance_rates = {'UHC': {'Flu': 60.0}}
+    patient_df = pd.DataFrame({
+        'Patient ID': [1, 2, 3], 'Patient Name': ['A', 'B', 'C'], 'Disease': ['Flu'] * 3,
+        'Assigned Doctor': ['Dr. Smith'] * 3, 'Insurance Company': ['UHC'] * 3,
+        'Doctor Charge': ['100.00', None, 'n/a'],
+    })
+    summary = data_loader.prepare_billing_summary(None, insurance_rates, patient_df)
+    assert summary['Doctor Charge'].tolist() == [100.0, 0.0, 0.0]
+    assert summary['Patient Pays'].tolist() == [40.0, -60.0, -60.0]
+    out = capsys.readouterr().out
+    assert 'patient 2' in out and 'patient 3' in out
+
+def test_docx_table_formats_nullable_numbers_like_floats(tmp_path):
+    df = pd.DataFrame({
+        'Name': ['A', 'B'],
+        'Count': pd.array([1, None], dtype='Int64'),
+        'Charge': pd.array([2.5, None], dtype='Float64'),
+    })
+    path = str(tmp_path / 'table.docx')
+    data_loader.df_to_docx_table(df, path)
+    rows = data_loader.docx_table_to_df(path).values.tolist()
+    assert rows == [['A', '1.00', '2.50'], ['B', '<NA>', '<NA>']]
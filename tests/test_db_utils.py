@@ -0,0 +1,113 @@
+import sqlite3
+import pandas as pd
+from sqlalchemy import event
+from scripts import billing_engine, db_models, db_utils
+
+def test_data_version_follows_configure_engine(billing_db, tmp_path):
+    db_utils.add_insurance_rate('Medicaid', 'Flu', 'J10', 90.0)
+    first = db_utils.data_version('insurance_rates')
+    assert db_utils.data_version('insurance_rates') == first
+
+    # Pointing the app at another file invalidates every earlier token ...
+    other = str(tmp_path / 'other.db')
+    db_models.configure_engine(other)
+    second = db_utils.data_version('insurance_rates')
+    assert second != first
+
+    # ... and outside writes are now watched on the new file
+    with sqlite3.connect(other) as conn:
+        conn.execute("INSERT INTO insurance_rates (insurance_provider, disease, icd_code, rate) "
+                     "VALUES ('Aetna', 'Cold', 'J00', 50.0)")
+    assert db_utils.data_version('insurance_rates') != second
+
+def outside_insert(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO insurance_rates (insurance_provider, disease, icd_code, rate) "
+                     "VALUES ('Cigna', 'Cough', 'R05', 10.0)")
+
+def test_outside_write_before_own_commit_is_not_booked_as_ours(billing_db):
+    db_utils.add_doctor('Dr. Smith', [])
+    token = db_utils.data_version('insurance_rates')
+    outside_insert(billing_db)
+    db_utils.add_doctor('Dr. Jones', [])  # does not touch insurance_rates
+    assert db_utils.data_version('insurance_rates') != token
+
+def test_outside_write_right_after_own_commit_is_not_booked_as_ours(billing_db):
+    db_utils.add_doctor('Dr. Smith', [])
+    token = db_utils.data_version('insurance_rates')
+
+    # Commit from another connection between our commit and its bookkeeping
+    def commit_in_between(session):
+        outside_insert(billing_db)
+    event.listen(db_models.Session, 'after_commit', commit_in_between, insert=True)
+    try:
+        db_utils.add_doctor('Dr. Jones', [])
+    finally:
+        event.remove(db_models.Session, 'after_commit', commit_in_between)
+    assert db_utils.data_version('insurance_rates') != token
+
+def test_own_writes_only_change_their_tables(billing_db):
+    db_utils.add_doctor('Dr. Smith', [])
+    token = db_utils.data_version('insurance_rates')
+    db_utils.add_doctor('Dr. Jones', [])
+    assert db_utils.data_version('insurance_rates') == token
+    db_utils.add_insurance_rate('Medicaid', 'Flu', 'J10', 90.0)
+    assert db_utils.data_version('insurance_rates') != token
+
+def test_child_process_keeps_configured_database(billing_db, tmp_path, monkeypatch):
+    other = str(tmp_path / 'other.db')
+    db_models.configure_engine(other, pool_size=3)
+    db_utils.add_insurance_rate('Medicaid', 'Flu', 'J10', 90.0)
+    # Without the environment fallback only the configured path can be picked up
+    monkeypatch.delenv('BILLING_DB_PATH')
+    # Look like a forked child that inherited the parent's engine
+    monkeypatch.setattr(db_models, '_engine_pid', -1)
+    engine = db_models.get_engine()
+    assert engine.url.database == other
+    assert engine.pool.size() == 3
+    assert len(db_utils.get_insurance_rates()) == 1
+
+def test_temporary_engine_restores_configured_database(billing_db, tmp_path):
+    db_utils.add_insurance_rate('Medicaid', 'Flu', 'J10', 90.0)
+    scratch = str(tmp_path / 'scratch.db')
+    with db_models.temporary_engine(scratch):
+        assert db_models.get_engine().url.database == scratch
+        assert db_utils.get_insurance_rates() == []
+    assert db_models.get_engine().url.database == billing_db
+    assert len(db_utils.get_insurance_rates()) == 1
+
+def test_bulk_custom_rate_without_doctor_updates_in_place(billing_db):
+    db_utils.add_insurance_rate('Aetna', 'Cold', 'J00', 50.0)
+    patient_id = db_utils.add_patient('Flo', 'flo@example.com', '6', 'Cold', 'J00', None, 'Aetna')
+    rate = {'patient_id': patient_id, 'doctor_id': None, 'icd_code': 'J00', 'custom_rate': 50.0}
+    assert db_utils.set_custom_rates_bulk([rate])['inserted'] == 1
+    assert db_utils.set_custom_rates_bulk([dict(rate, custom_rate=60.0)]) == {'inserted': 0, 'updated': 1, 'skipped': 0}
+    assert db_utils.set_custom_rates_bulk([dict(rate, custom_rate=60.0)]) == {'inserted': 0, 'updated': 0, 'skipped': 1}
+
+    with db_utils.session_scope() as session:
+        assert session.query(db_models.PatientDoctorRate).count() == 1
+    assert db_utils.get_custom_rate(patient_id, None, 'J00') == 60.0
+    assert billing_engine.compute_billing_summary()['Doctor Charge'].tolist() == [60.0]
+
+def test_query_patients_pages_in_sql(billing_db):
+    db_utils.upsert_patients_bulk([
+        {'name': name, 'email': f'{name}@example.com', 'phone': '1', 'disease': 'Flu', 'icd_code': 'J10',
+         'doctor_id': None, 'insurance_provider': 'UHC'}
+        for name in ['Cy', 'Ann', 'Bob', 'Abe']
+    ])
+    # Table order without a filter, name order within a name prefix
+    assert [p['name'] for p in db_utils.query_patients(limit=2, offset=1)] == ['Ann', 'Bob']
+    assert [p['name'] for p in db_utils.query_patients('A')] == ['Abe', 'Ann']
+    assert (db_utils.count_patients(), db_utils.count_patients('A'), db_utils.count_patients('Z')) == (4, 2, 0)
+    first = db_utils.query_patients(limit=1)[0]
+    assert db_utils.get_patient(first['id']) == first
+    assert db_utils.get_patient('missing') is None
+
+def test_custom_rate_for_nan_doctor_id_is_stored_without_doctor(billing_db):
+    db_utils.add_insurance_rate('Aetna', 'Cold', 'J00', 50.0)
+    patient_id = db_utils.add_patient('Flo', 'flo@example.com', '6', 'Cold', 'J00', None, 'Aetna')
+    # As read from a float assigned_doctor_id column where some patients have a doctor
+    doctor_id = pd.Series([None, 1], dtype=float).iloc[0]
+    row = db_utils.set_custom_rate(patient_id, doctor_id, 'J00', 70.0)
+    assert row['Doctor Charge'] == 70.0
+    assert db_utils.get_custom_rate(patient_id, None, 'J00') == 70.0
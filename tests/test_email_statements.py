@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import socket
+import pytest
+from scripts import db_utils, email_statements
+from scripts.render_statements import MANIFEST_NAME, statement_filename
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+class RecordingHandler:
+    '''aiosmtpd handler keeping every accepted message; fail_first makes a recipient's first tries fail with 451.'''
+    def __init__(self, fail_first=None):
+        self.messages = []
+        self.fail_first = dict(fail_first or {})
+
+    async def handle_DATA(self, server, session, envelope):
+        for recipient in envelope.rcpt_tos:
+            if self.fail_first.get(recipient, 0) > 0:
+                self.fail_first[recipient] -= 1
+                return '451 Try again later'
+        self.messages.append(envelope)
+        return '250 OK'
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(handler):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        controller = aiosmtpd_controller.Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        servers.append(controller)
+        return email_statements.smtp_settings('127.0.0.1', port, starttls=False, sender='billing@example.com')
+    yield start
+    for controller in servers:
+        controller.stop()
+
+@pytest.fixture
+def statements(billing_db, tmp_path):
+    '''Three patients with a rendered statement each; returns (statements_dir, patient ids).'''
+    statements_dir = str(tmp_path / 'statements')
+    os.makedirs(statements_dir)
+    manifest = {}
+    ids = []
+    for i, name in enumerate(['Ann', 'Bob', 'Cy']):
+        patient_id = db_utils.add_patient(name, f'{name.lower()}@example.com', str(i), 'Flu', 'J10', None, 'Medicaid')
+        with open(os.path.join(statements_dir, statement_filename(patient_id)), 'wb') as f:
+            f.write(b'statement of ' + name.encode())
+        manifest[patient_id] = f'hash-{i}'
+        ids.append(patient_id)
+    with open(os.path.join(statements_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return statements_dir, ids
+
+def dispatch(statements_dir, settings, **kwargs):
+    jobs = email_statements.pending_statements(statements_dir)
+    return asyncio.run(email_statements.dispatch_statements(jobs, settings, backoff=0, **kwargs))
+
+def test_sends_each_statement_once(statements, smtp_server):
+    statements_dir, ids = statements
+    handler = RecordingHandler()
+    settings = smtp_server(handler)
+    result = dispatch(statements_dir, settings, pool_size=2, concurrency=3)
+    assert result == {'sent': 3, 'failed': {}}
+    assert sorted(m.rcpt_tos[0] for m in handler.messages) == ['ann@example.com', 'bob@example.com', 'cy@example.com']
+    assert set(db_utils.get_statement_send_status().values()) == {'sent'}
+
+    # A rerun finds nothing left to send
+    assert email_statements.pending_statements(statements_dir) == []
+    assert len(handler.messages) == 3
+
+def test_transient_failures_are_retried(statements, smtp_server):
+    statements_dir, ids = statements
+    handler = RecordingHandler(fail_first={'bob@example.com': 2})
+    result = dispatch(statements_dir, smtp_server(handler), retries=3)
+    assert result['sent'] == 3
+    assert len(handler.messages) == 3
+
+def test_unreadable_statement_fails_only_its_job(statements, smtp_server):
+    statements_dir, ids = statements
+    jobs = email_statements.pending_statements(statements_dir)
+    os.remove(jobs[0]['path'])  # disappears between listing and sending
+    handler = RecordingHandler()
+    result = asyncio.run(email_statements.dispatch_statements(jobs, smtp_server(handler), backoff=0))
+    assert result['sent'] == 2
+    assert list(result['failed']) == [jobs[0]['patient_id']]
+    assert db_utils.get_statement_send_status()[(jobs[0]['patient_id'], jobs[0]['statement_hash'])] == 'failed'
+
+def test_crash_after_acceptance_does_not_resend(statements, smtp_server, monkeypatch, capsys):
+    statements_dir, ids = statements
+    handler = RecordingHandler()
+    settings = smtp_server(handler)
+    record = db_utils.record_statement_send
+
+    def crash_before_logging_sent(*args):
+        if args[3] == 'sent':
+            raise KeyboardInterrupt  # killed after the server accepted the message
+        record(*args)
+    monkeypatch.setattr(db_utils, 'record_statement_send', crash_before_logging_sent)
+    with pytest.raises(KeyboardInterrupt):
+        dispatch(statements_dir, settings, concurrency=1)
+    monkeypatch.undo()
+    assert len(handler.messages) == 1
+
+    result = dispatch(statements_dir, settings)
+    assert result['sent'] == 2
+    assert len(handler.messages) == 3  # the accepted one was not sent again
+    assert '--retry-unconfirmed' in capsys.readouterr().out
+
+def test_unconfirmed_send_is_not_repeated_without_retry_flag(statements, capsys):
+    statements_dir, ids = statements
+    # A run that died after handing this statement to the server, before logging the outcome
+    job = email_statements.pending_statements(statements_dir)[0]
+    db_utils.record_statement_send(job['patient_id'], job['statement_hash'], job['recipient'], 'sending', 0)
+
+    pending = email_statements.pending_statements(statements_dir)
+    assert job['patient_id'] not in {j['patient_id'] for j in pending}
+    assert '--retry-unconfirmed' in capsys.readouterr().out
+
+    retried = email_statements.pending_statements(statements_dir, retry_unconfirmed=True)
+    assert job['patient_id'] in {j['patient_id'] for j in retried}
@@ -0,0 +1,52 @@
+import threading
+import pytest
+from scripts import db_utils, instrumentation
+
+@pytest.fixture
+def enabled():
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+
+def recorded_functions(report):
+    return {row['function'] for row in report['functions']}
+
+def test_concurrent_runs_record_separately(billing_db, enabled):
+    # Two "sessions" timing overlapping reruns in their own threads, like Streamlit's
+    started = threading.Barrier(2)
+    reports = {}
+
+    def session(name, work):
+        with instrumentation.recording() as recorder:
+            started.wait()
+            work()
+            if name == 'resetting':
+                instrumentation.reset()
+            work()
+            started.wait()
+            reports[name] = instrumentation.snapshot(recorder)
+
+    threads = [
+        threading.Thread(target=session, args=('doctors', db_utils.get_doctors)),
+        threading.Thread(target=session, args=('resetting', db_utils.get_patients)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    calls = {name: {row['function']: row['calls'] for row in report['functions']} for name, report in reports.items()}
+    assert calls['doctors']['db_utils.get_doctors'] == 2  # not wiped by the other session's reset
+    assert 'db_utils.get_patients' not in calls['doctors']
+    assert calls['resetting']['db_utils.get_patients'] == 1
+    assert 'db_utils.get_doctors' not in calls['resetting']
+    assert all('patients' not in q['statement'] for q in reports['doctors']['queries'])
+
+def test_outside_recording_goes_to_the_process_recorder(billing_db, enabled):
+    instrumentation.reset()
+    with instrumentation.recording():
+        db_utils.get_doctors()
+    db_utils.get_patients()
+    functions = recorded_functions(instrumentation.snapshot())
+    assert 'db_utils.get_patients' in functions
+    assert 'db_utils.get_doctors' not in functions
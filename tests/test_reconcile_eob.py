@@ -0,0 +1,74 @@
+import os
+import pandas as pd
+from scripts import db_utils, generate_synthetic_data, reconcile_eob
+from scripts.db_models import BASE_DIR
+
+UHC_EOB = os.path.join(BASE_DIR, 'data', 'uhc_eob_data.csv')
+
+def add_uhc_patient(cpt_code='99214'):
+    '''The patient of the bundled UHC EOB (member 123456789), billed for J10 at UHC's rate of 60.00.'''
+    db_utils.add_insurance_rate('UHC', 'Flu', 'J10', 60.0)
+    patient_id = db_utils.add_patient('Jane Doe', 'jane@example.com', '1', 'Flu', 'J10', None, 'UHC')
+    db_utils.upsert_payer_members_bulk([{'insurance_provider': 'UHC', 'member_id': '123456789', 'patient_id': patient_id}])
+    if cpt_code:
+        db_utils.upsert_procedure_codes_bulk([{'icd_code': 'J10', 'cpt_code': cpt_code}])
+    return patient_id
+
+def test_without_claim_keys_nothing_is_flagged(billing_db):
+    add_uhc_patient(cpt_code=None)
+    summary = reconcile_eob.reconcile_eob(UHC_EOB)
+    assert summary['cannot_match'].startswith('no CPT on claims')
+    assert summary['lines'] == summary['unmatched'] == 0
+    assert db_utils.get_reconciliation_exceptions() == []
+
+def test_lines_match_on_member_id_and_cpt_code(billing_db):
+    patient_id = add_uhc_patient()
+    summary = reconcile_eob.reconcile_eob(UHC_EOB)
+    assert summary['cannot_match'] is None
+    assert (summary['lines'], summary['matched'], summary['unmatched']) == (4, 1, 3)
+
+    # "99214,25" is the billed office visit: paid 78.89 of 60.00 expected, so no exception
+    flagged = db_utils.get_reconciliation_exceptions(summary['source_hash'])
+    assert sorted(row['code'] for row in flagged) == ['96372', 'J0696', 'J1100']
+    assert {(row['member_id'], row['patient_id'], row['exception_type']) for row in flagged} == {
+        ('123456789', patient_id, 'unmatched')
+    }
+
+def test_unknown_member_is_unmatched(billing_db):
+    add_uhc_patient()
+    summary = reconcile_eob.reconcile_eob(UHC_EOB, payer='Aetna')
+    assert summary['unmatched'] == 4
+    assert {row['patient_id'] for row in db_utils.get_reconciliation_exceptions()} == {None}
+
+def test_claim_without_cpt_code_is_not_checked(billing_db):
+    add_uhc_patient()
+    db_utils.add_insurance_rate('UHC', 'Cold', 'J00', 20.0)
+    other = db_utils.add_patient('Jo Roe', 'jo@example.com', '2', 'Cold', 'J00', None, 'UHC')
+    # The EOB's member now belongs to a claim whose ICD code has no CPT code
+    db_utils.upsert_payer_members_bulk([{'insurance_provider': 'UHC', 'member_id': '123456789', 'patient_id': other}])
+    summary = reconcile_eob.reconcile_eob(UHC_EOB)
+    assert (summary['unkeyed'], summary['matched'], summary['unmatched']) == (4, 0, 0)
+
+def test_synthetic_eob_round_trip(billing_db, tmp_path):
+    generate_synthetic_data.generate_synthetic_data(patients=500, doctors=3, icd_codes=12, insurers=3)
+    eob_path = str(tmp_path / 'eob.csv')
+    expected = generate_synthetic_data.write_synthetic_eob(eob_path, 3000, underpaid=0.1, denied=0.1,
+                                                           unmatched=0.1, chunk_size=700)
+    summary = reconcile_eob.reconcile_eob(eob_path, chunk_size=400)
+    assert {k: summary[k] for k in expected} == expected
+    assert summary['matched'] == 3000 - expected['unmatched']
+    assert len(db_utils.get_reconciliation_exceptions(summary['source_hash'])) == (
+        expected['underpaid'] + expected['denied'] + expected['unmatched']
+    )
+
+def test_line_numbers_count_within_each_source_file(billing_db, tmp_path):
+    add_uhc_patient()
+    # Batch output: two source files whose lines interleave across chunks
+    lines = pd.read_csv(UHC_EOB, dtype=str, keep_default_na=False)
+    batch = pd.concat([lines.assign(**{'Source File': name}) for name in ('a.pdf', 'b.pdf')]).sort_index(kind='stable')
+    path = tmp_path / 'eob_data.csv'
+    batch.to_csv(path, index=False)
+    summary = reconcile_eob.reconcile_eob(str(path), chunk_size=3)
+    flagged = db_utils.get_reconciliation_exceptions(summary['source_hash'])
+    numbers = {name: sorted(row['line_number'] for row in flagged if row['source_file'] == name) for name in ('a.pdf', 'b.pdf')}
+    assert numbers['a.pdf'] == numbers['b.pdf'] == [n for n, code in enumerate(lines['CPT Code'], 1) if code != '99214,25']
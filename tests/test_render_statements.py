@@ -0,0 +1,39 @@
+import io
+import os
+import pytest
+from docx import Document
+from scripts import db_utils, render_statements
+
+def template(*paragraphs):
+    '''A .docx whose paragraphs are given as lists of run texts.'''
+    doc = Document()
+    for runs in paragraphs:
+        paragraph = doc.add_paragraph()
+        for text in runs:
+            paragraph.add_run(text)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def test_default_template_passes_the_check():
+    render_statements.check_template(render_statements.build_statement_template())
+
+@pytest.mark.parametrize('paragraphs, message', [
+    ([['Patient: {{patient_name}}'], ['Due: {{amount_due}}']], 'Unknown'),
+    # As Word saves text whose formatting changed while it was typed
+    ([['Patient: {{patient_name}}'], ['Due: {{patient_', 'pays}}']], 'split'),
+    ([['Due: {{patient pays}}']], 'Malformed'),
+    ([['No placeholders here']], 'no placeholders'),
+])
+def test_bad_templates_are_rejected(paragraphs, message):
+    with pytest.raises(ValueError, match=message):
+        render_statements.check_template(template(*paragraphs))
+
+def test_bad_template_renders_nothing(billing_db, tmp_path):
+    db_utils.add_insurance_rate('UHC', 'Flu', 'J10', 60.0)
+    db_utils.add_patient('Jane Doe', 'jane@example.com', '1', 'Flu', 'J10', None, 'UHC')
+    path = tmp_path / 'template.docx'
+    path.write_bytes(template(['Amount due: {{patient_', 'pays}}']))
+    with pytest.raises(ValueError):
+        render_statements.render_statements(str(tmp_path / 'out'), workers=1, template_path=str(path))
+    assert not any(name.endswith('.docx') for name in os.listdir(tmp_path / 'out'))